@@ -68,6 +68,7 @@ from matplotlib.offsetbox import AnnotationBbox, OffsetImage
 import matplotlib.patches as mpatches
 
 import json
+import shutil
 from pathlib import Path
 
 get_ipython().run_line_magic('matplotlib', 'inline')
@@ -76,9 +77,6 @@ import geopandas as gpd
 from shapely.geometry import Point
 from shapely.geometry import Polygon
 import folium
-from folium.plugins import MarkerCluster
-from folium.plugins import FastMarkerCluster
-from folium.plugins import HeatMap
 import branca.colormap as cm
 from PIL import Image
 
@@ -86,6 +84,15 @@ import libpysal as lps
 import esda
 from esda.getisord import G_Local
 
+from birdflu.images import ImageStore
+from birdflu.clusters import ClusterIndex, ClusterLayer
+from birdflu.contiguity import contiguity_weights
+from birdflu.cube import CountCube
+from birdflu.density import DensitySurface
+from birdflu.hotspots import LocalGStar
+from birdflu.rates import eb_rate, rate_labels, raw_rate
+from birdflu.store import load_dataset
+
 pd.options.mode.chained_assignment = None  # default='warn'
 
 
@@ -93,7 +100,10 @@ pd.options.mode.chained_assignment = None  # default='warn'
 
 
 # Loading dataset
-bird_flu = pd.read_pickle("./data/bird-flu.pkl")
+bird_flu = load_dataset()
+
+# counts by Year, Month, County, Locality, species and target, built in one pass
+cube = CountCube.from_frame(bird_flu)
 
 
 # <a id="2"></a>
@@ -113,8 +123,8 @@ sns.palplot(['#004D44','#A39161','#F6F6F2','#FBFBFB']);
 # In[221]:
 
 
-x=bird_flu.groupby(['target_H5_HPAI'])['target_H5_HPAI'].count()
-y=len(bird_flu)
+x=cube.rollup('target_H5_HPAI').rename('target_H5_HPAI')
+y=cube.total()
 r=((x/y)).round(2)
 ratio = pd.DataFrame(r).T
 
@@ -166,7 +176,7 @@ infected_birds.info()
 # In[224]:
 
 
-infected_species = infected_birds.groupby('Common_Name').size().sort_values(ascending=False)
+infected_species = cube.top('Common_Name', target_H5_HPAI=1)
 
 
 # In[225]:
@@ -232,9 +242,10 @@ ax.axes.get_xaxis().set_ticks([])
 ax.invert_yaxis()
 
 # Black-headed Gull
-image = bird_flu.loc[bird_flu['Common_Name'] == 'Black-headed Gull', 'Image'].head(1)
-image = image.item()
-offset_img(x=250, y=9, img=image, ax=ax, zoom=0.14, offset=0)
+images = ImageStore()
+width = images.shape('Black-headed Gull')[1] * 0.14 # drawn at 14% of the original size
+image = images.fit('Black-headed Gull', width)
+offset_img(x=250, y=9, img=image, ax=ax, zoom=width / image.shape[1], offset=0)
 
 plt.annotate('',xy=(310, 7.3), xytext=(325, 0.4), 
              arrowprops=dict(facecolor='#444444',arrowstyle="-",connectionstyle="angle3,angleA=90,angleB=0"), 
@@ -268,7 +279,7 @@ plt.show()
 # In[228]:
 
 
-top_infected_locations = infected_birds.groupby('Locality').size().sort_values(ascending=False)[:10]
+top_infected_locations = cube.top('Locality', n=10, target_H5_HPAI=1)
 
 
 # In[229]:
@@ -354,9 +365,7 @@ def monthFormatter(month):
 # In[232]:
 
 
-total_infected_bymonth = bird_flu.groupby(['Month', 'target_H5_HPAI']).size().rename("count")
-prop_infected_bymonth = round(total_infected_bymonth / total_infected_bymonth.groupby(level=0).sum(),2)
-prop_infected_bymonth = prop_infected_bymonth.iloc[1::2].reset_index(level='target_H5_HPAI', drop=True)
+prop_infected_bymonth = round(cube.proportion('Month'),2)
 
 
 # In[233]:
@@ -404,9 +413,7 @@ for s in ['top', 'right']:
 # In[234]:
 
 
-total_infected_byYear = bird_flu.groupby(['Year', 'target_H5_HPAI']).size().rename("count")
-prop_infected_byYear = round(total_infected_byYear / total_infected_byYear.groupby(level=0).sum(),2)
-prop_infected_byYear = prop_infected_byYear.iloc[::2].reset_index(level='target_H5_HPAI', drop=True).sort_index(ascending=True).filter(items=range(2009,2020), axis=0)
+prop_infected_byYear = round(cube.proportion('Year'),2).filter(items=range(2009,2020), axis=0)
 
 
 # In[235]:
@@ -452,6 +459,10 @@ plt.show()
 
 import topojson as tp
 
+from birdflu.geometry import WGS84
+from birdflu.choropleth import MultiResolutionChoropleth, topology_pyramid
+from birdflu.topology import simplified_topology
+
 
 # In[237]:
 
@@ -488,36 +499,19 @@ except FileNotFoundError:
 
 topo_json = 'data/topology.json'
 try:
-    with open(topo_json, 'r') as f:
-        data = json.load(f)
-    # parse topojson file using `object_name`
-    topo = tp.Topology(data, object_name="data")
+    # quantized and simplified topologies are cached on disk by source-file hash (see birdflu.topology)
+    simple_dp = simplified_topology(topo_json, quantization=200, epsilon=0.001, algorithm='dp')
 except FileNotFoundError:
     print(f"File {topo_json} does not exist.")
 
 
-# In[241]:
-
-
-topo_tq = topo.topoquantize(200)
-
-
 # > dp and vw, for Douglas-Peucker or Visvalingam-Whyatt respectively. vw will only be selected if simplify_with is set to simplification. Default is dp, since it “produced the most accurate generalization” (Shi, W. & Cheung, C., 2006).
 
 # In[242]:
 
 
-simple_dp = topo_tq.toposimplify(
-    epsilon=0.001, 
-    simplify_with='shapely', 
-    simplify_algorithm='dp'
-)
-
-simple_vw = topo_tq.toposimplify(
-    epsilon=0.001, 
-    simplify_with='simplification', 
-    simplify_algorithm='vw'
-)
+# Visvalingam-Whyatt is only computed (and cached) on demand for this comparison
+simple_vw = simplified_topology(topo_json, quantization=200, epsilon=0.001, algorithm='vw')
 
 simple_dp.to_alt().properties(title=['Douglas-Peucker simplification']) | simple_vw.to_alt().properties(title='Visvalingam-Whyatt simplification')
 
@@ -542,10 +536,13 @@ admin_areas.columns = map(str.lower, admin_areas.columns)
 
 admin_areas['council'] = admin_areas['council'].str.title()
 admin_areas['county'] = admin_areas['county'].str.title()
-admin_areas['prop_infected'] = admin_areas.apply(lambda row: row.infected_birds / row.total_birds if row.total_birds > 0 else 0, axis = 1)
-admin_areas['prop_healthy'] = admin_areas.apply(lambda row: row.healthy_birds / row.total_birds if row.total_birds > 0 else 0, axis = 1)
-admin_areas['label_prop_healthy'] = admin_areas.apply(lambda row: f'{round(row.prop_healthy * 100, 2)}%', axis=1)
-admin_areas['label_prop_infected'] = admin_areas.apply(lambda row: f'{round(row.prop_infected * 100, 2)}%', axis=1)
+admin_areas['prop_infected'] = raw_rate(admin_areas['infected_birds'], admin_areas['total_birds'])[0]
+admin_areas['prop_healthy'] = raw_rate(admin_areas['healthy_birds'], admin_areas['total_birds'])[0]
+admin_areas['label_prop_healthy'] = rate_labels(admin_areas['prop_healthy'])
+admin_areas['label_prop_infected'] = rate_labels(admin_areas['prop_infected'])
+
+# empirical-Bayes rates shrink councils with few captured birds towards the national rate
+admin_areas['eb_prop_infected'], admin_areas['eb_lower'], admin_areas['eb_upper'] = eb_rate(admin_areas['infected_birds'], admin_areas['total_birds'])
 
 
 # In[246]:
@@ -575,7 +572,7 @@ colormap = cm.linear.OrRd_04.to_step(data=admin_areas['prop_infected'], method='
 
 
 admin_areas_simplify = admin_areas.copy()
-admin_areas_simplify["geometry"] = gdf_simplified["geometry"].set_crs(epsg=29902, inplace=True)
+admin_areas_simplify["geometry"] = gdf_simplified["geometry"].set_crs(WGS84, inplace=True)
 
 
 # In[249]:
@@ -596,17 +593,39 @@ highlight_function = lambda x: {'fillColor': '#000000',
                                 'fillOpacity': 0.50, 
                                 'weight': 0.1}
 
-choropleth = folium.features.GeoJson(
-    admin_areas_simplify,
-    style_function=style_function,
-    control=False,
-    highlight_function=highlight_function,
-    tooltip=folium.features.GeoJsonTooltip(fields=['council','county','gaeilge','label_prop_infected'],
-        aliases=['Council','County','Gaeilge','% of Infected Birds'],
-        style=('background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;'),
-        sticky=True
+# Multi-resolution output: a pyramid of simplified topologies of which the browser
+# only loads the level matching the current zoom (see birdflu.choropleth).
+# The levels are written to maps/choropleth_levels/ and published with the HTML in docs/.
+MULTI_RESOLUTION = True
+
+tooltip_fields = ['council','county','gaeilge','label_prop_infected']
+tooltip_aliases = ['Council','County','Gaeilge','% of Infected Birds']
+tooltip_style = 'background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;'
+
+if MULTI_RESOLUTION:
+    admin_areas['fill_color'] = admin_areas['prop_infected'].map(colormap)
+    choropleth = MultiResolutionChoropleth(
+        topology_pyramid(topo_json, admin_areas[tooltip_fields + ['fill_color']]),
+        directory='maps/choropleth_levels',
+        url_prefix='choropleth_levels',
+        fields=tooltip_fields,
+        aliases=tooltip_aliases,
+        style={'weight':0.5, 'color':'black', 'fillOpacity':0.75},
+        highlight=highlight_function(None),
+        tooltip_style=tooltip_style
+    )
+else:
+    choropleth = folium.features.GeoJson(
+        admin_areas_simplify,
+        style_function=style_function,
+        control=False,
+        highlight_function=highlight_function,
+        tooltip=folium.features.GeoJsonTooltip(fields=tooltip_fields,
+            aliases=tooltip_aliases,
+            style=tooltip_style,
+            sticky=True
+        )
     )
-)
 
 colormap.caption = "Proportion of Infected Birds on each Council/County"
 
@@ -620,6 +639,44 @@ mymap
 
 mymap.save('maps/choropleth_map.html')
 
+# docs/ is the published site: the map fetches its finer levels relative to the HTML
+shutil.copy('maps/choropleth_map.html', 'docs/choropleth_map.html')
+if MULTI_RESOLUTION:
+    shutil.copytree('maps/choropleth_levels', 'docs/choropleth_levels', dirs_exist_ok=True)
+
+
+# In[ ]:
+
+
+# Kernel density of the sightings, rasterized once instead of sending every point to the browser
+# (see birdflu.density); the tiles are written to maps/density_tiles/, publish them next to the HTML.
+density_map = folium.Map(location=[mean_latitude, mean_longitude], zoom_start=7, tiles=None)
+folium.TileLayer('CartoDB positron', name='Light Map', control=False).add_to(density_map)
+
+infected_density = DensitySurface.from_points(infected_birds['Longitude'], infected_birds['Latitude'], bandwidth=2000)
+all_density = DensitySurface.from_points(bird_flu['Longitude'], bird_flu['Latitude'], bandwidth=2000)
+infected_density.tile_layer('maps/density_tiles/infected', 'density_tiles/infected', 'Infected birds').add_to(density_map)
+all_density.tile_layer('maps/density_tiles/all', 'density_tiles/all', 'All captured birds', colormap='PuBu', show=False).add_to(density_map)
+folium.LayerControl(collapsed=False).add_to(density_map)
+
+density_map.save('maps/density_map.html')
+density_map
+
+
+# In[ ]:
+
+
+# Individual capture sites, clustered once offline (see birdflu.clusters); the map only fetches
+# the cluster tiles in view from maps/cluster_tiles/, publish them next to the HTML.
+cluster_index = ClusterIndex(bird_flu['Longitude'], bird_flu['Latitude'], bird_flu['target_H5_HPAI'], bird_flu['Common_Name'])
+
+cluster_map = folium.Map(location=[mean_latitude, mean_longitude], zoom_start=7, tiles=None)
+folium.TileLayer('CartoDB positron', name='Light Map', control=False).add_to(cluster_map)
+ClusterLayer(cluster_index, 'maps/cluster_tiles', 'cluster_tiles').add_to(cluster_map)
+
+cluster_map.save('maps/cluster_map.html')
+cluster_map
+
 
 # In[251]:
 
@@ -694,7 +751,9 @@ mymap.save('maps/choropleth_map.html')
 
 
 df = admin_areas
-wq =  lps.weights.Queen.from_dataframe(df)
+# Queen contiguity from the arcs the councils share in the topology (same order as admin_areas),
+# cached in data/weights-cache/ until a boundary changes
+wq = contiguity_weights(topo_json)
 
 
 # In[259]:
@@ -706,7 +765,9 @@ y = df['prop_infected']
 # In[260]:
 
 
-lg = G_Local(y, wq, star=True)
+# G* with 99,999 seeded conditional permutations spread over all CPUs,
+# stopping early once every council is clearly (non-)significant
+lg = LocalGStar(y, wq, permutations=99999, seed=12345)
 
 
 # In[261]:
@@ -792,36 +853,19 @@ ax = g_map(lg, df, ax, 4)
 plt.show()
 
 
-# In[264]:
-
-
-# Sligo - Z = 2.853354 / p-value = 0.017
-# Mayo - Z = 2.175596 / p-value = 0.025
-# Longford - Z = 1.563024 / p-value = 0.031
-
-
 # In[265]:
 
 
 hotspots = df[(df['P'] < 0.05) & (df['Z'] > 0)]
 coldspots = df[(df['P'] < 0.05) & (df['Z'] < 0)]
-#hotspots
+pd.concat({'Hot spot': hotspots, 'Cold spot': coldspots})[['council', 'gaeilge', 'Z', 'P']]
 
 
 # **z = standardized G statistic in Getis & Ord (1992)**
 # 
 # **p-value < 0.05 - statistically significant**
 # 
-# ### Hot Spots
-# - Sligo / Sligeach ( z = 1.353464 / p-value = 0.033 ) 
-# - Mayo / Maigh Eo ( z = 1.031976 / p-value = 0.020 )
-# - Longford / An Longfort ( z = 0.650739 / p-value = 0.028 )
-# 
-# ### Cold Spots
-# - Laois / Laois ( z = -0.764141 / p-value = 0.018 )
-# - Carlow / Ceatharlach ( z = -0.675114 / p-value = 0.016 )
-# - Kilkenny / Cill Chainnigh ( z = -0.662391 / p-value = 0.035 )
-# - Louth / Lú ( z = -0.411557 / p-value = 0.019 )
+# The table above lists the hot spots (z > 0) and the cold spots (z < 0). Their pseudo p-values come from the permutations of the run, so they are read from the table rather than quoted here.
 
 # <a id="4"></a>
 # # <p style="font-size:100%; text-align:left; color:#444444;">4- Conclusion</p>
@@ -832,7 +876,7 @@ coldspots = df[(df['P'] < 0.05) & (df['Z'] < 0)]
 # 
 # After reaching a peak of infection rate in 2015, the infection rate has presented stable between 14% and 18% from 2016 to 2019.
 # 
-# Although Sligo/Sligeach and Roscommon/Ros Comáin have presented the highest rate of infections, 3 counties were marked as hot spots, and especially Sligo and Mayo could be considered possible entering routes for the disease.
+# Although Sligo/Sligeach and Roscommon/Ros Comáin have presented the highest rate of infections, the counties marked as hot spots could be considered possible entering routes for the disease.
 
 # ---
 # <img title="GitHub Mark" src="./img/GitHub-Mark-64px.png" style="height: 32px; padding-right: 15px" alt="GitHub Mark" align="left"> [GitHub repository](https://github.com/pessini/avian-flu-wild-birds-ireland) <br>Author: Leandro Pessini
@@ -0,0 +1,47 @@
+"""
+History of benchmark runs, one JSON line per run in benchmarks/results/.
+"""
+import json
+import platform
+import subprocess
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+RESULTS_DIR = ROOT / 'benchmarks' / 'results'
+
+
+def git_revision():
+    proc = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True)
+    return proc.stdout.strip() or None
+
+
+def load(name):
+    '''
+    Every recorded run of benchmark `name`, oldest first
+    '''
+    path = RESULTS_DIR / f'{name}.jsonl'
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def baseline(name, revision=None):
+    '''
+    Latest run of benchmark `name`, at `revision` if given
+    '''
+    runs = [run for run in load(name) if revision is None or run.get('revision') == revision]
+    return runs[-1] if runs else None
+
+
+def append(name, results, **info):
+    '''
+    Record a run of benchmark `name`
+    '''
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    record = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': git_revision(),
+              'python': platform.python_version(), 'machine': platform.node(), **info, 'results': results}
+    with open(RESULTS_DIR / f'{name}.jsonl', 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    return record
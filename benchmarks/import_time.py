@@ -0,0 +1,135 @@
+"""
+Startup-time regression benchmark of the birdflu entry points.
+
+Every entry point is imported in a fresh interpreter with ``-X importtime``,
+several times, recording the median import time, the peak RSS, the slowest
+top-level imports and which heavy geo / plotting modules were loaded. Results
+are appended to ``benchmarks/results/import_time.jsonl`` and compared with the
+previous run, or the last run at ``--baseline REVISION``:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --check --tolerance 0.25
+
+With ``--check`` the exit status is 1 when an entry point loads a module it
+must not, or is slower than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+import history
+from history import ROOT
+
+from birdflu.tracing import peak_rss_mb
+
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'geopandas', 'shapely', 'pyproj', 'folium', 'branca', 'PIL',
+                 'libpysal', 'esda', 'topojson', 'scipy', 'requests']
+
+# entry point: (statement, heavy modules it may load)
+ENTRY_POINTS = {
+    'package': ('import birdflu', []),
+    'aggregate': ('from birdflu import CountCube, load_dataset', []),
+    'report': ('import birdflu.report', []),
+    'figures': ('import birdflu.figures', []),
+    'geometry': ('from birdflu import add_grid_coords', []),
+    'spatial': ('from birdflu import count_birds_by_area', []),
+    'hotspots': ('from birdflu import LocalGStar', ['scipy']),
+    'emerging': ('from birdflu import EmergingHotSpots', ['scipy']),
+    'clusters': ('from birdflu import ClusterIndex', []),
+    'choropleth': ('from birdflu import MultiResolutionChoropleth', ['folium', 'branca', 'requests']),
+}
+
+PROBE = '''
+import json, resource, sys
+print(json.dumps({{
+    'loaded': sorted({{name.split('.')[0] for name in sys.modules}} & {heavy}),
+    'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}}))
+'''
+
+
+def parse_importtime(stderr):
+    '''
+    Total and top-level cumulative import times (in seconds) from the
+    ``-X importtime`` report
+    '''
+    total, top_level = 0, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        total += int(self_us)
+        if not name[1:].startswith(' '):
+            top_level[name.strip()] = int(cumulative_us) / 1e6
+    return total / 1e6, top_level
+
+
+def measure(statement, repeat=5, top=5):
+    '''
+    Median import time of `statement` in a fresh interpreter
+    '''
+    times, rss, slowest = [], [], {}
+    for _ in range(repeat):
+        code = statement + '\n' + PROBE.format(heavy=set(HEAVY_MODULES))
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                              capture_output=True, text=True, check=True)
+        total, top_level = parse_importtime(proc.stderr)
+        probe = json.loads(proc.stdout.splitlines()[-1])
+        times.append(total)
+        # converted here: importing the helper in the probe would count in the import time
+        rss.append(peak_rss_mb(probe['max_rss']))
+        for name, seconds in top_level.items():
+            slowest.setdefault(name, []).append(seconds)
+
+    slowest = {name: statistics.median(seconds) for name, seconds in slowest.items()}
+    return {
+        'seconds': statistics.median(times),
+        'max_rss_mb': statistics.median(rss),
+        'loaded': probe['loaded'],
+        'slowest': dict(sorted(slowest.items(), key=lambda item: -item[1])[:top]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('entry_points', nargs='*', metavar='ENTRY_POINT',
+                        help=f'entry points to measure (default: all of {", ".join(ENTRY_POINTS)})')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--check', action='store_true', help='fail on forbidden imports or slowdowns')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over the baseline')
+    parser.add_argument('--baseline', metavar='REVISION', help='compare with the last run at this git revision')
+    parser.add_argument('--no-save', action='store_true', help='do not append the results to the history')
+    args = parser.parse_args(argv)
+    unknown = set(args.entry_points) - set(ENTRY_POINTS)
+    if unknown:
+        parser.error(f'unknown entry points: {", ".join(sorted(unknown))}')
+
+    baseline = history.baseline('import_time', args.baseline)
+    results = {name: measure(ENTRY_POINTS[name][0], args.repeat) for name in args.entry_points or ENTRY_POINTS}
+
+    failures = []
+    print(f'{"entry point":<12} {"import [s]":>10} {"baseline":>10} {"RSS [MB]":>9}  heavy modules loaded')
+    for name, result in results.items():
+        previous = (baseline or {}).get('results', {}).get(name)
+        forbidden = sorted(set(result['loaded']) - set(ENTRY_POINTS[name][1]))
+        print(f'{name:<12} {result["seconds"]:>10.3f} {previous["seconds"] if previous else float("nan"):>10.3f} '
+              f'{result["max_rss_mb"]:>9.1f}  {", ".join(result["loaded"]) or "-"}')
+        if forbidden:
+            failures.append(f'{name} loads {", ".join(forbidden)}')
+        if previous and result['seconds'] > previous['seconds'] * (1 + args.tolerance):
+            failures.append(f'{name} is {result["seconds"] / previous["seconds"] - 1:.0%} slower than at '
+                            f'{baseline.get("revision")}: ' + ', '.join(
+                                f'{module} {seconds:.3f}s' for module, seconds in result['slowest'].items()))
+
+    if not args.no_save:
+        history.append('import_time', results)
+
+    for failure in failures:
+        print('FAIL', failure, file=sys.stderr)
+    return 1 if args.check and failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
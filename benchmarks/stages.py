@@ -0,0 +1,260 @@
+"""
+Time and memory benchmark of the costly stages of the analysis.
+
+Every stage runs in a fresh interpreter on the bundled data, scaled up by
+repeating the observations (and tiling the administrative areas side by
+side) 10, 100 or 1000 times. With ``--synthetic`` the scaled observations are
+drawn from the model of birdflu.synthetic instead of repeated:
+
+    python benchmarks/stages.py
+    python benchmarks/stages.py --stages spatial_join gstar --scales 1 10 100 1000
+    python benchmarks/stages.py --check --baseline 0fc4a8b
+
+For each stage and scale the best and median wall times, the peak memory
+traced by tracemalloc and the peak RSS of the process are recorded. Runs are
+appended to ``benchmarks/results/stages.jsonl``; with ``--check`` the exit
+status is 1 when a stage is slower than the baseline (the previous run, or
+the last run at ``--baseline REVISION``) by more than the tolerance.
+"""
+import argparse
+import json
+import math
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import history
+from history import ROOT
+
+from birdflu.tracing import peak_rss_mb
+
+CSV_PATH = ROOT / 'data' / 'bird_flu.csv'
+TOPOLOGY_PATH = ROOT / 'data' / 'topology.json'
+ADMIN_AREAS_PATH = ROOT / 'data' / 'Administrative_Areas_Ireland.json'
+
+STAGES = ['ingest', 'cube', 'proximity', 'spatial_join', 'topology', 'weights', 'contiguity', 'gstar', 'map']
+SCALES = [1, 10, 100, 1000]
+
+# stages that need the administrative areas or the topology
+NEEDS_AREAS = {'spatial_join', 'topology', 'weights', 'contiguity', 'gstar', 'map'}
+
+
+def read_observations(path, scale=1, synthetic=False):
+    import numpy as np
+    import pandas as pd
+
+    df = pd.read_csv(path, encoding='latin-1')
+    if scale == 1:
+        return df
+    if synthetic:
+        from birdflu.synthetic import SurveillanceModel
+
+        return SurveillanceModel(df).sample(scale * len(df), np.random.default_rng(12345))
+    return pd.concat([df] * scale, ignore_index=True)
+
+
+def tile_areas(areas, scale):
+    '''
+    `scale` copies of the areas laid out side by side on a square grid
+    '''
+    import geopandas as gpd
+    import pandas as pd
+
+    if scale == 1:
+        return areas
+    minx, miny, maxx, maxy = areas.total_bounds
+    columns = math.ceil(math.sqrt(scale))
+    tiles = []
+    for i in range(scale):
+        tile = areas.copy()
+        tile['geometry'] = areas.geometry.translate((i % columns) * (maxx - minx), (i // columns) * (maxy - miny))
+        tiles.append(tile)
+    return gpd.GeoDataFrame(pd.concat(tiles, ignore_index=True), crs=areas.crs)
+
+
+def setup(stage, scale, paths, workdir, permutations, synthetic=False):
+    '''
+    Inputs of `stage` at `scale` and the function timed on them
+    '''
+    if stage == 'ingest':
+        from birdflu.stages import join_birdwatch
+
+        source = read_observations(paths['csv'], scale, synthetic)
+        csv = workdir / 'observations.csv'
+        source.to_csv(csv, index=False, encoding='latin-1')
+        birdwatch = source[['Scientific_Name', 'Common_Name']].drop_duplicates('Scientific_Name').rename(
+            columns={'Common_Name': 'Bird_Name'})
+        del source
+        return lambda: join_birdwatch(read_observations(csv), birdwatch)
+
+    observations = read_observations(paths['csv'], scale, synthetic)
+    if stage == 'cube':
+        from birdflu.cube import CountCube
+
+        return lambda: CountCube.from_frame(observations)
+
+    if stage == 'proximity':
+        import numpy as np
+
+        from birdflu.proximity import ProximityIndex
+
+        # 5000 sites scattered around the capture sites, scored against all the infected birds
+        sites = observations[['Longitude', 'Latitude']].sample(5000, replace=True, random_state=12345)
+        sites += np.random.default_rng(12345).normal(0, 0.05, sites.shape)
+        return lambda: ProximityIndex(observations).summary(sites.reset_index(drop=True))
+
+    from birdflu.stages import area_counts, read_admin_areas
+
+    areas = read_admin_areas(paths['admin_areas'])
+    if stage == 'spatial_join':
+        from birdflu.geometry import points_from_frame
+        from birdflu.spatial import count_birds_by_area
+
+        return lambda: count_birds_by_area(areas, points_from_frame(observations))
+
+    areas = tile_areas(area_counts(areas, read_observations(paths['csv'])), scale)
+    if stage in ('topology', 'contiguity'):
+        source = paths['topology']
+        if scale > 1:
+            import topojson as tp
+
+            source = workdir / 'topology.json'
+            source.write_text(tp.Topology(areas[['geometry']], prequantize=False).to_json())
+
+    if stage == 'contiguity':
+        from birdflu.contiguity import contiguity_matrix
+
+        # the Queen weights of the 'weights' stage, from the shared arcs
+        return lambda: contiguity_matrix(source)
+
+    if stage == 'topology':
+        from birdflu.topology import simplified_topology
+
+        caches = iter(range(10 ** 6))
+        # a new cache directory on every call, so nothing is ever read back
+        return lambda: simplified_topology(source, cache_dir=workdir / f'cache-{next(caches)}')
+
+    import libpysal as lps
+
+    if stage == 'weights':
+        return lambda: lps.weights.Queen.from_dataframe(areas, use_index=False)
+
+    if stage == 'gstar':
+        from birdflu.hotspots import LocalGStar
+
+        w = lps.weights.Queen.from_dataframe(areas, use_index=False)
+        return lambda: LocalGStar(areas['prop_infected'], w, permutations=permutations, seed=12345, n_jobs=1)
+
+    if stage == 'map':
+        from birdflu.figures import choropleth_map
+
+        return lambda: choropleth_map(areas, (53.4, -7.9)).get_root().render()
+
+    raise ValueError(f'Unknown stage {stage!r}')
+
+
+def measure(stage, scale, paths, repeat, permutations, synthetic=False):
+    '''
+    Timings and memory of one stage at one scale, in this process
+    '''
+    with tempfile.TemporaryDirectory() as workdir:
+        run = setup(stage, scale, paths, Path(workdir), permutations, synthetic)
+        rss_before = peak_rss_mb()
+
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        rss_after = peak_rss_mb()
+
+        tracemalloc.start()
+        run()
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'best': min(times),
+        'median': statistics.median(times),
+        'traced_peak_mb': traced_peak / 2 ** 20,
+        'rss_peak_mb': rss_after,
+        'rss_growth_mb': rss_after - rss_before,
+    }
+
+
+def run_isolated(stage, scale, args):
+    # one interpreter per case so that peak RSS and caches don't leak between stages
+    command = [sys.executable, __file__, '--measure', stage, str(scale), '--repeat', str(args.repeat),
+               '--permutations', str(args.permutations), '--csv', str(args.csv),
+               '--topology', str(args.topology), '--admin-areas', str(args.admin_areas)]
+    if args.synthetic:
+        command.append('--synthetic')
+    proc = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'}
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--scales', nargs='+', type=int, default=SCALES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--permutations', type=int, default=999, help='G* permutations')
+    parser.add_argument('--csv', type=Path, default=CSV_PATH)
+    parser.add_argument('--topology', type=Path, default=TOPOLOGY_PATH)
+    parser.add_argument('--admin-areas', type=Path, default=ADMIN_AREAS_PATH)
+    parser.add_argument('--synthetic', action='store_true', help='scale up with synthetic observations')
+    parser.add_argument('--check', action='store_true', help='fail on slowdowns over the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over the baseline')
+    parser.add_argument('--baseline', metavar='REVISION', help='compare with the last run at this git revision')
+    parser.add_argument('--no-save', action='store_true', help='do not append the results to the history')
+    parser.add_argument('--measure', nargs=2, metavar=('STAGE', 'SCALE'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    args.csv, args.topology, args.admin_areas = (path.resolve() for path in [args.csv, args.topology, args.admin_areas])
+    paths = {'csv': args.csv, 'topology': args.topology, 'admin_areas': args.admin_areas}
+    if args.measure:
+        sys.path.insert(0, str(ROOT))
+        stage, scale = args.measure
+        print(json.dumps(measure(stage, int(scale), paths, args.repeat, args.permutations, args.synthetic)))
+        return 0
+
+    missing = [str(path) for path in paths.values() if not path.exists()]
+    stages = args.stages
+    if missing:
+        print(f'Skipping {", ".join(sorted(NEEDS_AREAS & set(stages)))}: missing {", ".join(missing)}')
+        stages = [stage for stage in stages if stage not in NEEDS_AREAS]
+
+    benchmark = 'stages-synthetic' if args.synthetic else 'stages'
+    baseline = history.baseline(benchmark, args.baseline)
+    results, failures = {}, []
+    print(f'{"stage":<13} {"scale":>6} {"best [s]":>9} {"baseline":>9} {"traced [MB]":>12} {"RSS [MB]":>9}')
+    for stage in stages:
+        for scale in args.scales:
+            name = f'{stage}@{scale}'
+            result = results[name] = run_isolated(stage, scale, args)
+            if 'error' in result:
+                print(f'{stage:<13} {scale:>6}  {result["error"]}')
+                continue
+            previous = (baseline or {}).get('results', {}).get(name, {})
+            print(f'{stage:<13} {scale:>6} {result["best"]:>9.3f} {previous.get("best", float("nan")):>9.3f} '
+                  f'{result["traced_peak_mb"]:>12.1f} {result["rss_peak_mb"]:>9.1f}')
+            if 'best' in previous and result['best'] > previous['best'] * (1 + args.tolerance):
+                failures.append(f'{name} is {result["best"] / previous["best"] - 1:.0%} slower than at '
+                                f'{baseline.get("revision")}')
+
+    if not args.no_save:
+        history.append(benchmark, results, repeat=args.repeat, permutations=args.permutations)
+
+    for failure in failures:
+        print('FAIL', failure, file=sys.stderr)
+    return 1 if args.check and failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
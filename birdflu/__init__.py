@@ -0,0 +1,43 @@
+"""
+Reusable building blocks for the bird flu analysis notebooks.
+
+The public names below are imported lazily (PEP 562): ``from birdflu import
+CountCube, load_dataset`` only loads pandas and pyarrow, while the geo and
+plotting stacks (geopandas, shapely, folium, matplotlib, libpysal, ...) are
+loaded the first time one of their functions is used.
+"""
+import importlib
+
+_EXPORTS = {
+    'birdflu.choropleth': ['MultiResolutionChoropleth', 'topology_pyramid', 'write_pyramid'],
+    'birdflu.clusters': ['ClusterIndex', 'ClusterLayer'],
+    'birdflu.contiguity': ['contiguity_weights'],
+    'birdflu.cube': ['CountCube'],
+    'birdflu.density': ['DensitySurface', 'kernel_density'],
+    'birdflu.emerging': ['EmergingHotSpots', 'space_time_cube'],
+    'birdflu.geometry': ['IRISH_GRID', 'WGS84', 'add_grid_coords', 'points_from_frame', 'transform_coords'],
+    'birdflu.hotspots': ['LocalGStar', 'distance_band_weights', 'knn_weights', 'point_hotspots'],
+    'birdflu.images': ['ImageStore'],
+    'birdflu.lab_results': ['ingest_lab_results', 'read_lab_results'],
+    'birdflu.proximity': ['ProximityIndex'],
+    'birdflu.scraper': ['scrape'],
+    'birdflu.spatial': ['count_birds_by_area', 'match_points_to_areas'],
+    'birdflu.species': ['SpeciesIndex'],
+    'birdflu.store': ['load_dataset', 'write_dataset'],
+    'birdflu.topology': ['quantized_topology', 'simplified_topology'],
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_MODULES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,188 @@
+"""
+Zoom-dependent, multi-resolution council choropleth for folium maps.
+
+Instead of embedding one GeoJSON at a single simplification level, the map
+gets a pyramid of topology-preserving simplifications. Every level is a
+quantized, delta-encoded TopoJSON (shared arcs instead of repeated polygon
+rings) written next to the HTML file. Only the coarsest level is inlined for
+the first paint; the browser fetches a finer level when the zoom reaches it.
+"""
+import json
+from pathlib import Path
+
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from jinja2 import Template
+
+from birdflu.topology import simplified_topology
+
+# (minimum zoom, quantization factor, Douglas-Peucker epsilon)
+ZOOM_LEVELS = (
+    (0, 200, 0.001),
+    (9, 1000, 0.0005),
+    (11, 10000, 0.0001),
+)
+
+
+def topology_pyramid(topo_json, properties, levels=ZOOM_LEVELS, object_name='data'):
+    '''
+    Simplified topologies of `topo_json` with feature properties attached
+    ...
+
+    Arguments
+    ---------
+    topo_json   : str or Path
+                  TopoJSON file with the areas, in the same order as `properties`
+    properties  : DataFrame
+                  One row of properties per area (tooltip fields, fill colour)
+    levels      : sequence of (int, int, float)
+                  Minimum zoom, quantization factor and epsilon of every level
+    object_name : str
+                  Name of the object in the TopoJSON file
+
+    Returns
+    -------
+    pyramid     : list of (int, dict)
+                  Minimum zoom and TopoJSON dictionary of every level
+    '''
+    records = json.loads(properties.to_json(orient='records'))
+
+    pyramid = []
+    for min_zoom, quantization, epsilon in levels:
+        topo = simplified_topology(topo_json, quantization, epsilon, 'dp', object_name).to_dict()
+        geometries = topo['objects'][object_name]['geometries']
+        if len(geometries) != len(records):
+            raise ValueError(f'{topo_json} has {len(geometries)} areas, expected {len(records)}')
+        for geometry, record in zip(geometries, records):
+            geometry['properties'] = record
+        pyramid.append((min_zoom, topo))
+    return pyramid
+
+
+def write_pyramid(pyramid, directory, url_prefix):
+    '''
+    Write every level to `directory` and return [{'min_zoom', 'url'}] for the map
+    '''
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    levels = []
+    for i, (min_zoom, topo) in enumerate(pyramid):
+        name = f'level-{i}.topojson'
+        with open(directory / name, 'w') as f:
+            json.dump(topo, f, separators=(',', ':'))
+        levels.append({'min_zoom': min_zoom, 'url': f'{url_prefix.rstrip("/")}/{name}'})
+    return levels
+
+
+class MultiResolutionChoropleth(JSCSSMixin, MacroElement):
+    '''
+    Choropleth that swaps in the pyramid level matching the current zoom
+    ...
+
+    Arguments
+    ---------
+    pyramid       : list of (int, dict)
+                    Output of `topology_pyramid`
+    directory     : str or Path
+                    Where to write the level files, next to the saved map
+    url_prefix    : str
+                    URL of `directory` relative to the saved map
+    fields        : list of str
+                    Properties shown in the tooltip
+    aliases       : list of str
+                    Tooltip labels of `fields`
+    style         : dict
+                    Leaflet path style; the fill colour is read from the
+                    `fill_color` property of each area
+    highlight     : dict
+                    Leaflet path style on mouse over
+    tooltip_style : str
+                    CSS of the tooltip content
+    '''
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function(map) {
+            var levels = {{ this.levels|tojson }};
+            var style = {{ this.style|tojson }};
+            var highlight = {{ this.highlight|tojson }};
+            var fields = {{ this.fields|tojson }};
+            var aliases = {{ this.aliases|tojson }};
+            var tooltipStyle = {{ this.tooltip_style|tojson }};
+            var loaded = {}, pending = {}, current = null, layer = null;
+
+            levels.forEach(function(level, i) {
+                if (level.data) { loaded[i] = level.data; delete level.data; }
+            });
+
+            function tooltip(properties) {
+                var rows = fields.map(function(field, i) {
+                    return '<tr><th>' + aliases[i] + '</th><td>' + properties[field] + '</td></tr>';
+                });
+                return '<div style="' + tooltipStyle + '"><table>' + rows.join('') + '</table></div>';
+            }
+
+            function levelFor(zoom) {
+                var found = 0;
+                levels.forEach(function(level, i) { if (zoom >= level.min_zoom) found = i; });
+                return found;
+            }
+
+            function show(i) {
+                var topo = loaded[i];
+                var next = L.geoJson(topojson.feature(topo, topo.objects[Object.keys(topo.objects)[0]]), {
+                    style: function(feature) {
+                        return Object.assign({}, style, {fillColor: feature.properties.fill_color});
+                    },
+                    onEachFeature: function(feature, path) {
+                        path.bindTooltip(tooltip(feature.properties), {sticky: true});
+                        path.on('mouseover', function() { path.setStyle(highlight); });
+                        path.on('mouseout', function() { next.resetStyle(path); });
+                    }
+                }).addTo(map);
+                if (layer) { map.removeLayer(layer); }
+                layer = next;
+                current = i;
+            }
+
+            function update() {
+                var i = levelFor(map.getZoom());
+                if (i === current) { return; }
+                if (loaded[i]) { return show(i); }
+                if (pending[i]) { return; }
+                // a missing or broken level keeps the coarser one shown, the next zoom retries it
+                pending[i] = fetch(levels[i].url)
+                    .then(function(response) { return response.ok ? response.json() : null; })
+                    .catch(function() { return null; })
+                    .then(function(topo) {
+                        delete pending[i];
+                        if (!topo) { return; }
+                        loaded[i] = topo;
+                        if (levelFor(map.getZoom()) === i) { show(i); }
+                    });
+            }
+
+            map.on('zoomend', update);
+            update();
+            return {levels: levels, layer: function() { return layer; }};
+        })({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    default_js = [
+        ('topojson-client', 'https://cdn.jsdelivr.net/npm/topojson-client@3/dist/topojson-client.min.js'),
+    ]
+
+    def __init__(self, pyramid, directory, url_prefix, fields, aliases,
+                 style=None, highlight=None, tooltip_style=''):
+        super().__init__()
+        self._name = 'MultiResolutionChoropleth'
+        self.levels = write_pyramid(pyramid, directory, url_prefix)
+        # the coarsest level is inlined so the first paint needs no request
+        self.levels[0]['data'] = pyramid[0][1]
+        self.fields = list(fields)
+        self.aliases = list(aliases)
+        self.style = style or {}
+        self.highlight = highlight or {}
+        self.tooltip_style = tooltip_style
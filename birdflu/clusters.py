@@ -0,0 +1,326 @@
+"""
+Hierarchical point clusters of the sightings, precomputed for folium maps.
+
+MarkerCluster and FastMarkerCluster ship every sighting to the browser and
+cluster them in JavaScript on every load. Instead, as supercluster does, the
+sightings are clustered once, offline, from the most detailed zoom level to
+the least: at each level every node absorbs the unclaimed nodes of the
+level below within `radius` pixels, heaviest first. Every cluster keeps the
+number of birds, of infected birds and the birds of each species.
+
+The levels are written as JSON tiles (zoom/x/y.json) next to the map, and
+the map only fetches the tiles in view at its zoom, so its load time and
+memory depend on the clusters on screen, not on the number of sightings:
+
+    index = ClusterIndex(bird_flu['Longitude'], bird_flu['Latitude'], bird_flu['target_H5_HPAI'],
+                         bird_flu['Common_Name'])
+    ClusterLayer(index, 'maps/cluster_tiles', 'cluster_tiles').add_to(mymap)
+"""
+import functools
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from birdflu.tracing import traced
+
+RADIUS = 60
+TILE_SIZE = 256
+MIN_ZOOM = 5
+MAX_ZOOM = 14
+TOP_SPECIES = 3
+
+
+def mercator(lon, lat):
+    '''
+    Web Mercator coordinates of `lon`, `lat` scaled to [0, 1], y to the south
+    '''
+    lon = np.asarray(lon, dtype='float64')
+    lat = np.clip(np.asarray(lat, dtype='float64'), -85.0511, 85.0511)
+    x = lon / 360 + 0.5
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) / (2 * np.pi)
+    return x, y
+
+
+def _greedy_clusters(x, y, weight, radius):
+    # cluster of every node: each node, heaviest first, takes the unclaimed nodes within `radius`
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree(np.column_stack([x, y]))
+    parent = np.full(len(x), -1, dtype=np.int64)
+    n = 0
+    for i in np.argsort(-weight, kind='stable'):
+        if parent[i] >= 0:
+            continue
+        neighbours = np.asarray(tree.query_ball_point((x[i], y[i]), radius), dtype=np.int64)
+        parent[neighbours[parent[neighbours] < 0]] = n
+        n += 1
+    return parent, n
+
+
+
+def _swap_directory(tmp, directory):
+    # replace `directory` by `tmp`, the old content only removed once out of the way
+    old = directory.with_name(f'.{directory.name}.old-{os.getpid()}')
+    if directory.exists():
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(directory, old)
+    os.replace(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+
+class ClusterIndex:
+    '''
+    Clusters of the sightings at every zoom level
+    ...
+
+    Arguments
+    ---------
+    lon, lat : array-like
+               Coordinates of the sightings (WGS84)
+    infected : array-like, optional
+               1 for the infected birds
+    species  : array-like, optional
+               Species of every sighting
+    radius   : float
+               Cluster radius, in screen pixels
+    min_zoom : int
+               Least detailed zoom level
+    max_zoom : int
+               Most detailed clustered zoom level; the levels above show the
+               distinct capture sites
+
+    Attributes
+    ----------
+    levels   : dict
+               By zoom, a DataFrame of the clusters with their x, y
+               (see `mercator`), count, infected and parent (index of the
+               cluster containing it at the level below, -1 at `min_zoom`)
+    species  : dict
+               By zoom, a sparse matrix of the birds of every species
+               (columns, named by `species_names`) in every cluster
+    '''
+
+    def __init__(self, lon, lat, infected=None, species=None, radius=RADIUS, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+        from scipy import sparse
+
+        self.radius, self.min_zoom, self.max_zoom = radius, min_zoom, max_zoom
+        x, y = mercator(lon, lat)
+        keep = np.isfinite(x) & np.isfinite(y)
+        x, y = x[keep], y[keep]
+        infected = np.zeros(len(x)) if infected is None else np.asarray(infected, dtype='float64')[keep]
+        species = np.full(len(x), None) if species is None else np.asarray(species, dtype=object)[keep]
+
+        # sightings at the same place are one node from the start
+        site = pd.DataFrame({'x': x, 'y': y}).groupby(['x', 'y'], sort=False).ngroup().to_numpy()
+        codes, self.species_names = pd.factorize(species)
+        nodes = pd.DataFrame({
+            'x': np.bincount(site, weights=x) / np.bincount(site),
+            'y': np.bincount(site, weights=y) / np.bincount(site),
+            'count': np.bincount(site),
+            'infected': np.bincount(site, weights=infected).astype(np.int64),
+        })
+        known = codes >= 0
+        counts = sparse.csr_matrix((np.ones(known.sum()), (site[known], codes[known])),
+                                   shape=(len(nodes), len(self.species_names)))
+
+        self.levels, self.species = {}, {}
+        self._build(nodes, counts)
+
+    @traced('clusters.ClusterIndex.build')
+    def _build(self, nodes, counts):
+        from scipy import sparse
+
+        zoom = self.max_zoom + 1
+        self.levels[zoom], self.species[zoom] = nodes, counts
+        for zoom in range(self.max_zoom, self.min_zoom - 1, -1):
+            below = self.levels[zoom + 1]
+            # the radius in pixels at this zoom, in the [0, 1] coordinates
+            parent, n = _greedy_clusters(below['x'].to_numpy(), below['y'].to_numpy(), below['count'].to_numpy(),
+                                         self.radius / (TILE_SIZE * 2 ** zoom))
+            below['parent'] = parent
+            weights = below['count'].to_numpy()
+            total = np.bincount(parent, weights=weights, minlength=n)
+            self.levels[zoom] = pd.DataFrame({
+                'x': np.bincount(parent, weights=below['x'].to_numpy() * weights, minlength=n) / total,
+                'y': np.bincount(parent, weights=below['y'].to_numpy() * weights, minlength=n) / total,
+                'count': total.astype(np.int64),
+                'infected': np.bincount(parent, weights=below['infected'].to_numpy(), minlength=n).astype(np.int64),
+            })
+            membership = sparse.csr_matrix((np.ones(len(parent)), (parent, np.arange(len(parent)))),
+                                           shape=(n, len(parent)))
+            self.species[zoom] = membership @ self.species[zoom + 1]
+        self.levels[self.min_zoom]['parent'] = -1
+
+    def top_species(self, zoom, n=TOP_SPECIES):
+        '''
+        The `n` most captured species of every cluster at `zoom`, as
+        [(name, birds), ...]
+        '''
+        matrix = self.species[zoom]
+        top = []
+        for i in range(matrix.shape[0]):
+            row = matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]]
+            values = matrix.data[matrix.indptr[i]:matrix.indptr[i + 1]]
+            order = np.argsort(-values, kind='stable')[:n]
+            top.append([(self.species_names[row[j]], int(values[j])) for j in order])
+        return top
+
+    def clusters(self, zoom):
+        '''
+        Clusters at `zoom` (clamped to the levels of the index) with their
+        coordinates and aggregates
+        '''
+        zoom = min(max(zoom, self.min_zoom), self.max_zoom + 1)
+        level = self.levels[zoom]
+        x, y = level['x'].to_numpy(), level['y'].to_numpy()
+        return pd.DataFrame({
+            'lon': (x - 0.5) * 360,
+            'lat': np.degrees(2 * np.arctan(np.exp((0.5 - y) * 2 * np.pi)) - np.pi / 2),
+            'count': level['count'],
+            'infected': level['infected'],
+            'top_species': self.top_species(zoom),
+        })
+
+    def write(self, directory):
+        '''
+        Write the clusters of every level to `directory`/zoom/x/y.json, one
+        file per 256 px tile holding clusters; returns the number of files
+
+        The tiles replace the whole of `directory`, so none of an earlier
+        index is left behind and served.
+        '''
+        directory = Path(directory)
+        # written next to `directory` and swapped in once complete
+        tmp = directory.with_name(f'.{directory.name}.tmp-{os.getpid()}')
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        try:
+            written = self._write(tmp)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        _swap_directory(tmp, directory)
+        return written
+
+    def _write(self, directory):
+        written = 0
+        for zoom in self.levels:
+            clusters = self.clusters(zoom)
+            level = self.levels[zoom]
+            tiles = pd.DataFrame({'tx': np.floor(level['x'].to_numpy() * 2 ** zoom).astype(np.int64),
+                                  'ty': np.floor(level['y'].to_numpy() * 2 ** zoom).astype(np.int64)})
+            for (tx, ty), rows in tiles.groupby(['tx', 'ty']).groups.items():
+                records = [[round(c.lat, 5), round(c.lon, 5), int(c.count), int(c.infected),
+                            [[name, birds] for name, birds in c.top_species]]
+                           for c in clusters.loc[rows].itertuples(index=False)]
+                path = directory / str(zoom) / str(tx) / f'{ty}.json'
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, 'w') as f:
+                    json.dump(records, f, separators=(',', ':'))
+                written += 1
+        return written
+
+
+_TEMPLATE = """
+{% macro script(this, kwargs) %}
+var {{ this.get_name() }} = (function(map) {
+    var url = {{ this.url|tojson }}, minZoom = {{ this.min_zoom }}, maxZoom = {{ this.max_zoom }};
+    var color = {{ this.color|tojson }};
+    var tiles = {}, layer = L.layerGroup().addTo(map);
+
+    function marker(c) {
+        var share = c[3] / c[2];
+        var m = L.circleMarker([c[0], c[1]], {
+            radius: 4 + 3 * Math.log2(c[2]), weight: 1, color: share > 0 ? '#b30000' : color,
+            fillColor: share > 0 ? 'rgb(' + Math.round(180 + 75 * share) + ',0,0)' : color,
+            fillOpacity: 0.4 + 0.4 * share
+        });
+        var species = c[4].map(function(s) { return s[0] + ' (' + s[1] + ')'; }).join('<br>');
+        m.bindTooltip('<b>' + c[2] + ' birds</b>, ' + c[3] + ' infected<br>' + species);
+        m.on('click', function() {
+            if (c[2] > 1) { map.setView([c[0], c[1]], Math.min(map.getZoom() + 2, maxZoom + 1)); }
+        });
+        return m;
+    }
+
+    function update() {
+        var zoom = Math.max(minZoom, Math.min(map.getZoom(), maxZoom + 1));
+        var bounds = map.getBounds();
+        var nw = map.project(bounds.getNorthWest(), zoom).divideBy({{ this.tile_size }}).floor();
+        var se = map.project(bounds.getSouthEast(), zoom).divideBy({{ this.tile_size }}).floor();
+        var requests = [];
+        for (var x = nw.x; x <= se.x; x++) {
+            for (var y = nw.y; y <= se.y; y++) {
+                var key = zoom + '/' + x + '/' + y;
+                if (!(key in tiles)) {
+                    tiles[key] = fetch(url + '/' + key + '.json')
+                        .then(function(response) { return response.ok ? response.json() : []; })
+                        .catch(function() { return []; });
+                }
+                requests.push(tiles[key]);
+            }
+        }
+        Promise.all(requests).then(function(loaded) {
+            if (Math.max(minZoom, Math.min(map.getZoom(), maxZoom + 1)) !== zoom) { return; }
+            layer.clearLayers();
+            loaded.forEach(function(clusters) { clusters.forEach(function(c) { layer.addLayer(marker(c)); }); });
+        });
+    }
+
+    map.on('moveend', update);
+    update();
+    return {layer: layer};
+})({{ this._parent.get_name() }});
+{% endmacro %}
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def _cluster_layer():
+    # built on first use, so that only the maps load branca and jinja2
+    from branca.element import MacroElement
+    from jinja2 import Template
+
+    class ClusterLayer(MacroElement):
+        '''
+        Cluster markers loading the tiles of a `ClusterIndex` in view
+        ...
+
+        Arguments
+        ---------
+        index      : ClusterIndex
+        directory  : str or Path
+                     Where to write the cluster tiles, next to the saved map
+        url_prefix : str
+                     URL of `directory` relative to the saved map
+        color      : str
+                     Colour of the clusters without infected birds; clusters are
+                     redder the larger their share of infected birds
+
+        Clicking a cluster zooms in on it.
+        '''
+
+        _template = Template(_TEMPLATE)
+
+        def __init__(self, index, directory, url_prefix, color='#3182bd'):
+            super().__init__()
+            self._name = 'ClusterLayer'
+            index.write(directory)
+            self.url = url_prefix.rstrip('/')
+            self.min_zoom = index.min_zoom
+            self.max_zoom = index.max_zoom
+            self.tile_size = TILE_SIZE
+            self.color = color
+
+    ClusterLayer.__qualname__ = 'ClusterLayer'
+    return ClusterLayer
+
+
+def __getattr__(name):
+    # PEP 562: the folium element is only defined when first imported
+    if name == 'ClusterLayer':
+        return _cluster_layer()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,181 @@
+"""
+Queen and Rook contiguity weights read off the arcs of a TopoJSON topology.
+
+A topology stores every shared boundary once, as an arc referenced by the
+polygons on both of its sides. So contiguity is a join on the arc indices
+rather than `libpysal.weights.Queen.from_dataframe` comparing the vertices
+of every pair of nearby polygons:
+
+- rook:  polygons referencing the same arc share an edge
+- queen: polygons whose arcs share a vertex; arcs are not cut where two
+         polygons only touch at a point, so every vertex of the arcs is
+         matched, not only their end points
+
+The binary sparse matrices are cached on disk under the SHA-256 of the
+geometries (arcs, transform and arc indices of every polygon), so editing
+the properties of the topology keeps them and editing a boundary doesn't
+read a stale one; G*, emerging hot spots or smoothed rates built on them
+reuse the weights instantly:
+
+    w = contiguity_weights('data/topology.json')
+    lg = LocalGStar(df['prop_infected'], w)
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from birdflu.tracing import traced
+
+CACHE_PATH = Path('data/weights-cache')
+KINDS = ('queen', 'rook')
+# bumped when the matrices change for the same geometries
+CACHE_VERSION = 2
+
+
+def _topology_dict(topology):
+    # a TopoJSON file, a parsed TopoJSON dict or a topojson.Topology
+    if isinstance(topology, (str, Path)):
+        with open(topology, 'r') as f:
+            return json.load(f)
+    if hasattr(topology, 'to_dict'):
+        return topology.to_dict()
+    return topology
+
+
+def _polygon_arcs(geometry):
+    # arc indices of the rings of a Polygon or MultiPolygon, ~i being arc i reversed
+    arcs = geometry.get('arcs') or []
+    if geometry['type'] == 'Polygon':
+        arcs = [arcs]
+    elif geometry['type'] != 'MultiPolygon':
+        raise ValueError(f'Cannot compute the contiguity of a {geometry["type"]}')
+    return [~i if i < 0 else i for polygon in arcs for ring in polygon for i in ring]
+
+
+def geometry_digest(topology, object_name='data'):
+    '''
+    SHA-256 hex digest of the arcs, transform and polygon arcs of
+    `object_name`, ignoring the properties and ids
+    '''
+    topology = _topology_dict(topology)
+    geometries = topology['objects'][object_name]['geometries']
+    key = [topology['arcs'], topology.get('transform'), [[g['type'], g.get('arcs')] for g in geometries]]
+    return hashlib.sha256(json.dumps(key, separators=(',', ':')).encode()).hexdigest()
+
+
+def _vertices(arcs, transform):
+    # arc of every vertex and its position as a complex number; quantized arcs are
+    # delta-encoded integers
+    lengths = np.fromiter(map(len, arcs), dtype=np.int64, count=len(arcs))
+    xy = np.array([position[:2] for arc in arcs for position in arc], dtype='float64').reshape(-1, 2)
+    arc = np.repeat(np.arange(len(arcs)), lengths)
+    if transform is not None:
+        xy = np.cumsum(xy, axis=0)
+        starts = np.cumsum(lengths) - lengths
+        # undo the running sum across the arcs: subtract the total up to the previous arc
+        offset = np.vstack([np.zeros((1, 2)), xy[starts[1:] - 1]]) if len(arcs) else np.zeros((0, 2))
+        xy -= np.repeat(offset, lengths, axis=0)
+    return arc, xy[:, 0] + 1j * xy[:, 1]
+
+
+@traced()
+def contiguity_matrix(topology, object_name='data', kind='queen'):
+    '''
+    Binary sparse contiguity of the polygons of a topology
+    ...
+
+    Arguments
+    ---------
+    topology    : str, Path, dict or topojson.Topology
+                  TopoJSON file or topology
+    object_name : str
+                  Name of the object holding the polygons
+    kind        : str
+                  'queen' (a shared vertex) or 'rook' (a shared edge)
+
+    Returns
+    -------
+    matrix      : scipy.sparse.csr_matrix
+                  n x n, 1 for the neighbours, in the order of the geometries
+    '''
+    from scipy import sparse
+
+    if kind not in KINDS:
+        raise ValueError(f'Unknown contiguity {kind!r}, expected one of {", ".join(KINDS)}')
+    topology = _topology_dict(topology)
+    geometries = topology['objects'][object_name]['geometries']
+    arcs = topology['arcs']
+
+    polygon_arcs = [_polygon_arcs(g) for g in geometries]
+    rows = np.repeat(np.arange(len(geometries)), [len(a) for a in polygon_arcs])
+    columns = np.fromiter((i for a in polygon_arcs for i in a), dtype=np.int64, count=len(rows))
+    incidence = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(geometries), len(arcs)))
+
+    if kind == 'queen' and len(arcs):
+        # polygons through the vertices of their arcs: a shared arc shares its vertices too
+        arc, points = _vertices(arcs, topology.get('transform'))
+        # complex numbers sort much faster than the rows of a 2-D array
+        _, point = np.unique(points, return_inverse=True)
+        vertices = sparse.csr_matrix((np.ones(len(point)), (arc, point)), shape=(len(arcs), point.max() + 1))
+        incidence = incidence @ vertices
+
+    matrix = (incidence @ incidence.T).tocsr()
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    matrix.data[:] = 1.0
+    matrix.sort_indices()
+    return matrix
+
+
+def contiguity_weights(topology, object_name='data', kind='queen', ids=None, cache_dir=CACHE_PATH):
+    '''
+    libpysal weights of the contiguity of the polygons of a topology, cached
+    on disk by geometry digest
+    ...
+
+    Arguments
+    ---------
+    topology    : str, Path, dict or topojson.Topology
+                  TopoJSON file or topology, e.g. data/topology.json
+    object_name : str
+                  Name of the object holding the polygons
+    kind        : str
+                  'queen' or 'rook'
+    ids         : list, optional
+                  Ids of the polygons, in the order of the geometries;
+                  0 .. n - 1 by default, as `from_dataframe(df, use_index=False)`
+    cache_dir   : str or Path, optional
+                  Directory holding the cached matrices, None to not cache
+
+    Returns
+    -------
+    w           : libpysal.weights.W
+                  Binary weights, as `Queen` and `Rook` build them
+    '''
+    from libpysal.weights import W
+    from scipy import sparse
+
+    topology = _topology_dict(topology)
+    if cache_dir is None:
+        matrix = contiguity_matrix(topology, object_name, kind)
+    else:
+        cache_file = Path(cache_dir) / f'{kind}-v{CACHE_VERSION}-{geometry_digest(topology, object_name)}.npz'
+        if cache_file.exists():
+            matrix = sparse.load_npz(cache_file)
+        else:
+            matrix = contiguity_matrix(topology, object_name, kind)
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache_file.with_name(cache_file.name + '.tmp')
+            with open(tmp, 'wb') as f:
+                sparse.save_npz(f, matrix)
+            os.replace(tmp, cache_file)
+    # straight from the CSR arrays, W.from_sparse and remap_ids are much slower
+    ids = list(range(matrix.shape[0])) if ids is None else list(ids)
+    labels = np.empty(len(ids), dtype=object)
+    labels[:] = ids
+    indices, indptr = matrix.indices, matrix.indptr
+    neighbors = {ids[i]: labels[indices[indptr[i]:indptr[i + 1]]].tolist() for i in range(len(ids))}
+    return W(neighbors, id_order=ids)
@@ -0,0 +1,112 @@
+"""
+Materialized count cube over the observation dimensions.
+
+The cube holds one row per distinct combination of Year, Month, County,
+Locality, species and target_H5_HPAI with the number of birds captured, and
+is built in a single grouped pass. Charts then ask the cube for top-N lists,
+proportions and filtered roll-ups instead of grouping the raw rows again.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from birdflu.tracing import traced
+
+DIMENSIONS = ['Year', 'Month', 'County', 'Locality', 'Common_Name', 'target_H5_HPAI']
+TARGET = 'target_H5_HPAI'
+CUBE_PATH = Path('data/bird-flu-cube.parquet')
+
+
+class CountCube:
+    '''
+    Counts of captured birds by `DIMENSIONS`
+    ...
+
+    Arguments
+    ---------
+    counts : DataFrame
+             One row per combination of the dimensions with a `count` column
+
+    Filters are passed as keyword arguments named after a dimension, with a
+    single value or a list/range of accepted values, e.g.
+    `cube.top('Common_Name', n=15, target_H5_HPAI=1, Year=range(2009, 2020))`.
+    '''
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.dimensions = [c for c in counts.columns if c != 'count']
+
+    @classmethod
+    @traced('cube.CountCube.from_frame')
+    def from_frame(cls, df, dimensions=DIMENSIONS):
+        '''
+        Build the cube from raw observations in one grouped pass
+        '''
+        counts = df.groupby(list(dimensions), observed=True, dropna=False).size()
+        return cls(counts.rename('count').reset_index())
+
+    @classmethod
+    def concat(cls, cubes):
+        '''
+        Merge cubes over the same dimensions, e.g. built from separate chunks
+        '''
+        cubes = list(cubes)
+        dimensions = cubes[0].dimensions
+        counts = pd.concat([cube.counts for cube in cubes], ignore_index=True)
+        counts = counts.groupby(dimensions, observed=True, dropna=False, sort=False)['count'].sum()
+        return cls(counts.reset_index())
+
+    @classmethod
+    def load(cls, path=CUBE_PATH):
+        return cls(pd.read_parquet(path))
+
+    def save(self, path=CUBE_PATH):
+        self.counts.to_parquet(path, index=False)
+        return path
+
+    def _select(self, filters):
+        unknown = set(filters) - set(self.dimensions)
+        if unknown:
+            raise KeyError(f'Not a dimension of the cube: {sorted(unknown)}')
+
+        mask = np.ones(len(self.counts), dtype=bool)
+        for column, value in filters.items():
+            values = self.counts[column]
+            if isinstance(value, (list, tuple, set, range, np.ndarray, pd.Index)):
+                mask &= values.isin(list(value)).to_numpy()
+            else:
+                mask &= (values == value).to_numpy()
+        return self.counts[mask]
+
+    def total(self, **filters):
+        '''
+        Number of birds matching the filters
+        '''
+        return int(self._select(filters)['count'].sum())
+
+    def rollup(self, by, **filters):
+        '''
+        Counts summed by the `by` dimension(s), sorted by key
+        '''
+        by = [by] if isinstance(by, str) else list(by)
+        selected = self._select(filters)
+        rolled = selected.groupby(by, observed=True, sort=True)['count'].sum()
+        return rolled.rename(None)
+
+    def top(self, by, n=None, **filters):
+        '''
+        The `n` largest counts by the `by` dimension(s), all of them if `n` is None
+        '''
+        rolled = self.rollup(by, **filters).sort_values(ascending=False)
+        return rolled if n is None else rolled[:n]
+
+    def proportion(self, by, value=1, **filters):
+        '''
+        Share of birds with `target_H5_HPAI == value` within each group of `by`
+        '''
+        by = [by] if isinstance(by, str) else list(by)
+        counts = self.rollup(by + [TARGET], **filters)
+        totals = counts.groupby(level=by, observed=True).sum()
+        matched = counts.xs(value, level=TARGET).reindex(totals.index, fill_value=0)
+        return matched / totals
@@ -0,0 +1,302 @@
+"""
+Kernel density surfaces of the sightings, rasterized for folium maps.
+
+Instead of shipping every sighting to the browser (HeatMap, MarkerCluster),
+the points are binned on the Web Mercator pixel grid of a zoom level and
+convolved with a Gaussian kernel by FFT, so the cost is linear in the number
+of points for the binning and grows with the grid, not the points, for the
+smoothing. The surface is added to a map as one PNG image overlay, or as a
+pyramid of 256 px XYZ tiles written next to the HTML file:
+
+    surface = DensitySurface.from_points(infected['Longitude'], infected['Latitude'], bandwidth=3000)
+    surface.overlay('Infected birds').add_to(mymap)
+    surface.tile_layer('maps/density_tiles', 'density_tiles', 'Infected birds').add_to(mymap)
+"""
+import base64
+import io
+import math
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from birdflu.geometry import WGS84, transform_coords
+from birdflu.tracing import traced
+
+WEB_MERCATOR = 'EPSG:3857'
+# half the width of the Web Mercator world, in metres
+ORIGIN = 20037508.342789244
+TILE_SIZE = 256
+
+MIN_ZOOM = 5
+MAX_ZOOM = 9
+OVERLAY_ZOOM = 8
+BANDWIDTH = 2000
+TRUNCATE = 4
+
+
+def pixel_size(zoom):
+    '''
+    Width in Web Mercator metres of a tile pixel at `zoom`
+    '''
+    return 2 * ORIGIN / (TILE_SIZE * 2 ** zoom)
+
+
+def _linear_binning(col, row, shape, weights):
+    # every point spread on its 4 nearest cell centres, in proportion to its distance to them
+    grid = np.zeros(shape[0] * shape[1])
+    c0, r0 = np.floor(col).astype(np.int64), np.floor(row).astype(np.int64)
+    fc, fr = col - c0, row - r0
+    for dc, dr, share in [(0, 0, (1 - fc) * (1 - fr)), (1, 0, fc * (1 - fr)), (0, 1, (1 - fc) * fr), (1, 1, fc * fr)]:
+        c, r = c0 + dc, r0 + dr
+        inside = (c >= 0) & (c < shape[1]) & (r >= 0) & (r < shape[0])
+        grid += np.bincount(r[inside] * shape[1] + c[inside], (share * weights)[inside], minlength=grid.size)
+    return grid.reshape(shape)
+
+
+def gaussian_kernel(sigma, truncate=TRUNCATE):
+    '''
+    Normalized 2-D Gaussian of standard deviation `sigma` (in cells)
+    '''
+    radius = max(int(math.ceil(truncate * sigma)), 1)
+    x = np.arange(-radius, radius + 1)
+    k = np.exp(-0.5 * (x / sigma) ** 2)
+    kernel = np.outer(k, k)
+    return kernel / kernel.sum()
+
+
+@traced()
+def kernel_density(x, y, bounds, cell_size, bandwidth, weights=None):
+    '''
+    Gaussian kernel density of points on a regular grid, by linear binning
+    and FFT convolution
+    ...
+
+    Arguments
+    ---------
+    x, y      : array-like
+                Projected coordinates of the points, in metres
+    bounds    : (float, float, float, float)
+                minx, miny, maxx, maxy of the grid
+    cell_size : float
+                Width of a cell, in the units of `x` and `y`
+    bandwidth : float
+                Standard deviation of the kernel, in the same units
+    weights   : array-like, optional
+                Weight of every point, 1 by default
+
+    Returns
+    -------
+    density   : ndarray
+                Points per square unit of every cell, first row at the north
+    '''
+    from scipy.signal import fftconvolve
+
+    minx, miny, maxx, maxy = bounds
+    shape = (int(round((maxy - miny) / cell_size)), int(round((maxx - minx) / cell_size)))
+    x, y = np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64')
+    weights = np.ones(len(x)) if weights is None else np.asarray(weights, dtype='float64')
+    keep = np.isfinite(x) & np.isfinite(y)
+
+    # cell (0, 0) is the north-west corner, coordinates are of the cell centres
+    col = (x[keep] - minx) / cell_size - 0.5
+    row = (maxy - y[keep]) / cell_size - 0.5
+    counts = _linear_binning(col, row, shape, weights[keep])
+    # single precision halves the memory of the FFTs, plenty for a colour scale
+    density = fftconvolve(counts.astype(np.float32), gaussian_kernel(bandwidth / cell_size).astype(np.float32),
+                          mode='same')
+    # FFT round-off leaves tiny negative values in empty areas
+    return np.maximum(density, 0) / cell_size ** 2
+
+
+def _lut(colormap):
+    import matplotlib
+
+    return (matplotlib.colormaps[colormap](np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+
+
+def _colorize(values, vmax, lut):
+    # RGBA pixels, transparent where the density is nil and more opaque where high
+    scaled = np.clip(values / vmax, 0, 1) if vmax > 0 else np.zeros_like(values)
+    rgba = lut[(scaled * 255).astype(np.uint8)]
+    rgba[..., 3] = (np.sqrt(scaled) * 255).astype(np.uint8)
+    return rgba
+
+
+def _png(rgba):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+
+def _swap_directory(tmp, directory):
+    # replace `directory` by `tmp`, the old content only removed once out of the way
+    old = directory.with_name(f'.{directory.name}.old-{os.getpid()}')
+    if directory.exists():
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(directory, old)
+    os.replace(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+
+class DensitySurface:
+    '''
+    Kernel density on the Web Mercator pixel grid of a zoom level
+    ...
+
+    Arguments
+    ---------
+    values : ndarray
+             Density of every pixel, in points per km2, first row at the north
+    zoom   : int
+             Zoom level of the pixel grid
+    origin : (int, int)
+             Global pixel column and row of `values[0, 0]` at `zoom`
+
+    Pixels are aligned with the XYZ tiles of `zoom`, so the tiles are slices
+    of `values` and the tiles of lower zooms averages of 2x2 pixels.
+    '''
+
+    def __init__(self, values, zoom, origin):
+        self.values = values
+        self.zoom = zoom
+        self.origin = origin
+
+    @classmethod
+    def from_points(cls, lon, lat, bandwidth=BANDWIDTH, zoom=MAX_ZOOM, weights=None):
+        '''
+        Density of the points at `lon`, `lat` (WGS84), with a Gaussian kernel of
+        `bandwidth` metres on the ground
+        '''
+        x, y = transform_coords(lon, lat, WGS84, WEB_MERCATOR)
+        keep = np.isfinite(x) & np.isfinite(y)
+        if not keep.any():
+            raise ValueError('No points with coordinates')
+
+        # Web Mercator stretches distances by 1 / cos(latitude)
+        scale = 1 / math.cos(math.radians(float(np.nanmean(np.asarray(lat, dtype='float64')[keep]))))
+        size = pixel_size(zoom)
+        margin = TRUNCATE * bandwidth * scale
+        col0 = int(math.floor((x[keep].min() - margin + ORIGIN) / size))
+        col1 = int(math.ceil((x[keep].max() + margin + ORIGIN) / size))
+        row0 = int(math.floor((ORIGIN - y[keep].max() - margin) / size))
+        row1 = int(math.ceil((ORIGIN - y[keep].min() + margin) / size))
+        bounds = (col0 * size - ORIGIN, ORIGIN - row1 * size, col1 * size - ORIGIN, ORIGIN - row0 * size)
+
+        density = kernel_density(x, y, bounds, size, bandwidth * scale, weights)
+        # per km2 on the ground rather than per Mercator m2
+        return cls(density * scale ** 2 * 1e6, zoom, (col0, row0))
+
+    @property
+    def bounds(self):
+        '''
+        [[south, west], [north, east]] of the surface, as folium expects them
+        '''
+        size = pixel_size(self.zoom)
+        col0, row0 = self.origin
+        rows, cols = self.values.shape
+        x = np.array([col0, col0 + cols]) * size - ORIGIN
+        y = ORIGIN - np.array([row0 + rows, row0]) * size
+        lon, lat = transform_coords(x, y, WEB_MERCATOR, WGS84)
+        return [[float(lat[0]), float(lon[0])], [float(lat[1]), float(lon[1])]]
+
+    def vmax(self, quantile=0.999):
+        '''
+        Density mapped to the top of the colour scale: the `quantile` of the
+        non-nil pixels, so that a few hot pixels don't wash out the rest
+        '''
+        positive = self.values[self.values > self.values.max() * 1e-6]
+        return float(np.quantile(positive, quantile)) if len(positive) else 0.0
+
+    def coarsen(self):
+        '''
+        The surface at `zoom - 1`, each pixel the mean of 2x2 pixels
+        '''
+        col0, row0 = self.origin
+        rows, cols = self.values.shape
+        # pad to even global pixel boundaries
+        left, top = col0 % 2, row0 % 2
+        right, bottom = (left + cols) % 2, (top + rows) % 2
+        values = np.pad(self.values, ((top, bottom), (left, right)))
+        values = values.reshape(values.shape[0] // 2, 2, values.shape[1] // 2, 2).mean(axis=(1, 3))
+        return DensitySurface(values, self.zoom - 1, ((col0 - left) // 2, (row0 - top) // 2))
+
+    def image(self, colormap='YlOrRd', vmax=None):
+        '''
+        PNG of the surface
+        '''
+        return _png(_colorize(self.values, self.vmax() if vmax is None else vmax, _lut(colormap)))
+
+    def overlay(self, name='Density', zoom=OVERLAY_ZOOM, colormap='YlOrRd', vmax=None, opacity=0.8, show=True):
+        '''
+        Folium image overlay of the surface coarsened to `zoom`, inlined as a
+        PNG data URL
+        '''
+        from folium.raster_layers import ImageOverlay
+
+        vmax = self.vmax() if vmax is None else vmax
+        surface = self
+        while surface.zoom > zoom:
+            surface = surface.coarsen()
+        url = 'data:image/png;base64,' + base64.b64encode(surface.image(colormap, vmax)).decode()
+        return ImageOverlay(url, surface.bounds, name=name, opacity=opacity, interactive=False, zindex=2, show=show)
+
+    def write_tiles(self, directory, min_zoom=MIN_ZOOM, colormap='YlOrRd', vmax=None):
+        '''
+        Write the XYZ tiles `directory`/z/x/y.png from `zoom` down to
+        `min_zoom`, skipping the empty ones; returns the number written
+
+        The tiles replace the whole of `directory`, so none of an earlier
+        run (other data or bounds) is left behind and served.
+        '''
+        directory = Path(directory)
+        # written next to `directory` and swapped in once complete
+        tmp = directory.with_name(f'.{directory.name}.tmp-{os.getpid()}')
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        try:
+            written = self._write_tiles(tmp, min_zoom, colormap, vmax)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        _swap_directory(tmp, directory)
+        return written
+
+    def _write_tiles(self, directory, min_zoom, colormap, vmax):
+        vmax = self.vmax() if vmax is None else vmax
+        lut = _lut(colormap)
+        surface, written = self, 0
+        while True:
+            col0, row0 = surface.origin
+            rows, cols = surface.values.shape
+            for tx in range(col0 // TILE_SIZE, (col0 + cols - 1) // TILE_SIZE + 1):
+                for ty in range(row0 // TILE_SIZE, (row0 + rows - 1) // TILE_SIZE + 1):
+                    tile = np.zeros((TILE_SIZE, TILE_SIZE))
+                    c, r = tx * TILE_SIZE - col0, ty * TILE_SIZE - row0
+                    window = surface.values[max(r, 0):r + TILE_SIZE, max(c, 0):c + TILE_SIZE]
+                    tile[max(-r, 0):max(-r, 0) + window.shape[0], max(-c, 0):max(-c, 0) + window.shape[1]] = window
+                    if tile.max() < vmax / 255:
+                        continue
+                    path = directory / str(surface.zoom) / str(tx) / f'{ty}.png'
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    path.write_bytes(_png(_colorize(tile, vmax, lut)))
+                    written += 1
+            if surface.zoom <= min_zoom:
+                return written
+            surface = surface.coarsen()
+
+    def tile_layer(self, directory, url, name='Density', min_zoom=MIN_ZOOM, colormap='YlOrRd', vmax=None,
+                   opacity=0.8, show=True):
+        '''
+        Folium tile layer of the tiles written to `directory`, served from
+        `url` relative to the saved map; zooms past `zoom` upscale its tiles
+        '''
+        import folium
+
+        self.write_tiles(directory, min_zoom, colormap, vmax)
+        return folium.TileLayer(tiles=f'{url.rstrip("/")}/{{z}}/{{x}}/{{y}}.png', attr=name, name=name,
+                                overlay=True, control=True, show=show, opacity=opacity, min_zoom=min_zoom,
+                                max_native_zoom=self.zoom, max_zoom=18)
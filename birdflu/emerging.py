@@ -0,0 +1,238 @@
+"""
+Emerging hot spot (space-time) analysis on an area x month cube.
+
+Observations are binned by area and month, G* is computed over space-time
+neighbours (the area, its contiguous neighbours, and the same areas in the
+previous `time_window` months) and every area is classified from the series
+of its significant hot/cold bins and the Mann-Kendall trend of its z-scores
+(new, consecutive, intensifying, persistent, diminishing, sporadic,
+oscillating or historical hot and cold spots).
+
+The mean and variance used by G* are those of the bins inside each
+space-time window rather than of the whole cube, so a slice only depends on
+the months in its window. Adding a month then recomputes that month's slice
+only, and revising a month recomputes the `time_window + 1` slices that see it.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+
+from birdflu.spatial import match_points_to_areas
+
+
+def space_time_cube(areas, points, value='INFECTED_BIRDS', target='target_H5_HPAI'):
+    '''
+    Bin observations by area and month
+    ...
+
+    Arguments
+    ---------
+    areas  : GeoDataFrame
+             Polygons, in the order used by the weights
+    points : GeoDataFrame
+             Observations with point geometries, Year, Month and `target`
+    value  : str
+             'INFECTED_BIRDS', 'TOTAL_BIRDS' or 'prop_infected'
+    target : str
+             Column flagging infected (1) and healthy (0) birds
+
+    Returns
+    -------
+    cube   : DataFrame
+             `value` per area (rows, indexed like `areas`) and month (monthly
+             PeriodIndex columns covering the whole observed range)
+    '''
+    point_idx, area_idx = match_points_to_areas(areas, points)
+
+    # months since year 0 on the int arrays, no Period objects per observation
+    month = (points['Year'].to_numpy()[point_idx].astype(np.int64) * 12
+             + points['Month'].to_numpy()[point_idx].astype(np.int64) - 1)
+    first = month.min()
+    periods = pd.period_range(pd.Period(year=first // 12, month=first % 12 + 1, freq='M'),
+                              periods=month.max() - first + 1, freq='M')
+    period_idx = month - first
+
+    shape = (len(areas), len(periods))
+    cell = area_idx * shape[1] + period_idx
+    status = points[target].to_numpy()[point_idx]
+    infected = np.bincount(cell[status == 1], minlength=shape[0] * shape[1]).reshape(shape)
+    total = infected + np.bincount(cell[status == 0], minlength=shape[0] * shape[1]).reshape(shape)
+
+    if value == 'INFECTED_BIRDS':
+        values = infected
+    elif value == 'TOTAL_BIRDS':
+        values = total
+    elif value == 'prop_infected':
+        values = np.divide(infected, total, out=np.zeros(shape), where=total > 0)
+    else:
+        raise ValueError(f'Unknown value {value!r}')
+    return pd.DataFrame(values, index=areas.index, columns=periods)
+
+
+def mann_kendall(z):
+    '''
+    Mann-Kendall trend z-scores and two-sided p-values of every row of `z`
+    '''
+    z = np.asarray(z, dtype='float64')
+    n = z.shape[1]
+    s = np.zeros(z.shape[0])
+    for i in range(n - 1):
+        s += np.sign(z[:, i + 1:] - z[:, [i]]).sum(axis=1)
+    variance = n * (n - 1) * (2 * n + 5) / 18
+    trend = np.where(s == 0, 0.0, (s - np.sign(s)) / np.sqrt(max(variance, 1e-12)))
+    return trend, 2 * stats.norm.sf(np.abs(trend))
+
+
+def _classify(significant, opposite, trend, trend_p, alpha, kind):
+    '''
+    Pattern of one area for hot (or, swapping the arguments, cold) spots
+    '''
+    n = len(significant)
+    share = significant.mean()
+    last = significant[-1]
+    earlier = significant[:-1]
+
+    if not last:
+        return f'historical {kind} spot' if n > 1 and earlier.mean() >= 0.9 else None
+
+    if share >= 0.9:
+        if trend_p < alpha:
+            increasing = trend > 0 if kind == 'hot' else trend < 0
+            return f'{"intensifying" if increasing else "diminishing"} {kind} spot'
+        return f'persistent {kind} spot'
+
+    if not earlier.any():
+        return f'new {kind} spot'
+
+    # length of the final uninterrupted run of significant bins
+    run = n - np.flatnonzero(~significant)[-1] - 1
+    if run >= 2 and not significant[:n - run].any():
+        return f'consecutive {kind} spot'
+    if opposite[:-1].any():
+        return f'oscillating {kind} spot'
+    return f'sporadic {kind} spot'
+
+
+class EmergingHotSpots:
+    '''
+    Incrementally updated space-time G* and emerging hot spot patterns
+    ...
+
+    Arguments
+    ---------
+    w           : libpysal W or scipy sparse matrix
+                  Spatial contiguity of the areas (rows of the cube)
+    time_window : int
+                  Number of previous months included in the neighbourhood
+    alpha       : float
+                  Significance level of the hot/cold bins and of the trend
+
+    Attributes
+    ----------
+    values      : DataFrame
+                  Area x month cube the statistics were computed on
+    z, p        : DataFrame
+                  Space-time G* z-scores and two-sided normal p-values
+    '''
+
+    def __init__(self, w, time_window=1, alpha=0.05):
+        matrix = sparse.csr_matrix(w.sparse if hasattr(w, 'sparse') else w, dtype='float64')
+        matrix = matrix - sparse.diags(matrix.diagonal())
+        matrix.eliminate_zeros()
+        matrix.data[:] = 1.0
+        # binary space-time weights always include the focal area
+        self.spatial = matrix + sparse.identity(matrix.shape[0], format='csr')
+        self.time_window = time_window
+        self.alpha = alpha
+        self.values = None
+        self.z = None
+        self.p = None
+
+    def update(self, cube):
+        '''
+        Add new months and revisions of existing ones, recomputing only the affected slices
+        ...
+
+        Arguments
+        ---------
+        cube : DataFrame
+               Area x month values (see `space_time_cube`); months already
+               present with identical values are left untouched, months
+               missing between the first and the last one are zero
+
+        Returns
+        -------
+        recomputed : PeriodIndex
+               Months whose G* slice was (re)computed
+        '''
+        if self.values is None:
+            merged = cube
+        else:
+            merged = self.values.combine_first(cube)
+            merged.update(cube)
+        # months missing between the first and last ones are zero, so the time lags and the
+        # trends only ever link adjacent months
+        merged = merged.reindex(columns=pd.period_range(merged.columns.min(), merged.columns.max(), freq='M'),
+                                fill_value=0).fillna(0)
+        if self.values is None:
+            changed = merged.columns
+        else:
+            known = self.values.reindex(columns=merged.columns)
+            changed = merged.columns[~(known == merged).all(axis=0).to_numpy()]
+
+        columns = merged.columns
+        positions = np.flatnonzero(columns.isin(changed))
+        affected = np.unique(np.concatenate([positions + lag for lag in range(self.time_window + 1)]))
+        affected = affected[affected < len(columns)]
+
+        z = (self.z if self.z is not None else pd.DataFrame(index=merged.index)).reindex(columns=columns)
+        values = merged.to_numpy(dtype='float64')
+        for t in affected:
+            z.iloc[:, t] = self._slice(values, t)
+
+        self.values = merged
+        self.z = z
+        self.p = pd.DataFrame(2 * stats.norm.sf(np.abs(z.to_numpy(dtype='float64'))),
+                              index=z.index, columns=columns)
+        return columns[affected]
+
+    def _slice(self, values, t):
+        '''
+        G* z-scores of every area for the window ending at month `t`
+        '''
+        window = values[:, max(0, t - self.time_window):t + 1]
+        n = window.size
+        mean = window.mean()
+        std = window.std()
+        if std == 0:
+            return np.zeros(values.shape[0])
+
+        weighted_sum = self.spatial @ window.sum(axis=1)
+        weights = np.asarray(self.spatial.sum(axis=1)).ravel() * window.shape[1]
+        # binary weights: the sum of squared weights equals the sum of weights
+        denominator = std * np.sqrt((n * weights - weights ** 2) / (n - 1))
+        return (weighted_sum - mean * weights) / denominator
+
+    def classify(self):
+        '''
+        Emerging hot spot pattern and z-score trend of every area
+        '''
+        z = self.z.to_numpy(dtype='float64')
+        p = self.p.to_numpy()
+        hot = (p < self.alpha) & (z > 0)
+        cold = (p < self.alpha) & (z < 0)
+        trend, trend_p = mann_kendall(z)
+
+        patterns = []
+        for i in range(len(z)):
+            pattern = _classify(hot[i], cold[i], trend[i], trend_p[i], self.alpha, 'hot') \
+                or _classify(cold[i], hot[i], trend[i], trend_p[i], self.alpha, 'cold')
+            patterns.append(pattern or 'no pattern detected')
+
+        return pd.DataFrame({
+            'pattern': patterns,
+            'trend_z': trend,
+            'trend_p': trend_p,
+            'hot_bins': hot.sum(axis=1),
+            'cold_bins': cold.sum(axis=1),
+        }, index=self.z.index)
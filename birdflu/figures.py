@@ -0,0 +1,384 @@
+"""
+The analysis figures as functions, for headless (Agg) rendering.
+
+Each function takes already aggregated inputs and returns the figure (or the
+folium map), so the report runner can render them independently. Text and
+highlights that the notebook writes by hand for the full 1980-2020 data are
+derived from the data here, since reports run on arbitrary subsets.
+"""
+import numpy as np
+
+BACKGROUND_COLOR = '#F6F6F2'
+HIGH_COLOR = '#004D44'
+LOW_COLOR = '#A39161'
+TEXT_COLOR = '#444444'
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def monthFormatter(month):
+    """
+    Take the representative number of a month and return its abbreviation
+    """
+    return MONTHS[month - 1] if 1 <= month <= 12 else "Invalid month"
+
+
+def _figure(figsize):
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(1, 1, figsize=figsize, dpi=150)
+    fig.patch.set_facecolor(BACKGROUND_COLOR)
+    ax.set_facecolor(BACKGROUND_COLOR)
+    return fig, ax
+
+
+def _title(ax, title, subtitle):
+    ax.text(0, 1.12, title, transform=ax.transAxes, fontfamily='serif', fontsize=14,
+            fontweight='bold', color=TEXT_COLOR)
+    ax.text(0, 1.03, subtitle, transform=ax.transAxes, fontfamily='serif', fontsize=10,
+            color=TEXT_COLOR)
+
+
+def offset_img(x, y, img, ax, zoom, offset, pad=0.4):
+    '''For adding  .png images to the graph.
+    source: https://stackoverflow.com/questions/61971090/how-can-i-add-images-to-bars-in-axes-matplotlib'''
+    from matplotlib.offsetbox import AnnotationBbox, OffsetImage
+
+    im = OffsetImage(img, zoom=zoom)
+    im.image.axes = ax
+    ab = AnnotationBbox(im, (x, y), xybox=(offset, 0), frameon=False,
+                        xycoords='data',
+                        boxcoords="offset points",
+                        pad=pad)
+    ax.add_artist(ab)
+
+
+def proportion_figure(counts, years):
+    '''
+    Horizontal bar of infected vs healthy birds
+    ...
+
+    Arguments
+    ---------
+    counts : Series
+             Number of birds by target_H5_HPAI (0 and 1)
+    years  : (int, int)
+             First and last year of the data, for the subtitle
+    '''
+    fig, ax = _figure((6.5, 1.8))
+    total = counts.sum()
+    infected = round(counts.get(1, 0) / total, 2)
+    healthy = round(counts.get(0, 0) / total, 2)
+
+    ax.barh([0], [infected], color=HIGH_COLOR, alpha=0.9, ec=BACKGROUND_COLOR)
+    ax.barh([0], [healthy], left=[infected], color=LOW_COLOR, alpha=0.9, ec=BACKGROUND_COLOR)
+
+    ax.set_xlim(0, 1)
+    ax.set_xticks([])
+    ax.set_yticks([])
+    for s in ['top', 'left', 'right', 'bottom']:
+        ax.spines[s].set_visible(False)
+
+    for share, centre, label in [(infected, infected / 2, 'Bird Flu'),
+                                 (healthy, infected + healthy / 2, 'Healthy birds')]:
+        ax.annotate(f"{int(share * 100)}%", xy=(centre, 0), va='center', ha='center', fontsize=20,
+                    fontweight='light', fontfamily='serif', color='white')
+        ax.annotate(label, xy=(centre, -0.15), va='center', ha='center', fontsize=12,
+                    fontweight='light', fontfamily='serif', color='white')
+
+    subtitle = 'From {} to {}, {:,} birds were captured in Ireland \nand most are not targeted for the H5N1 strain'.format(
+        years[0], years[1], total)
+    fig.text(0.125, 1.1, 'How many wild birds were infected with avian flu?', fontfamily='serif',
+             fontsize=14, fontweight='bold', color=TEXT_COLOR)
+    fig.text(0.125, 0.915, subtitle, fontfamily='serif', fontsize=10, color=TEXT_COLOR)
+    return fig
+
+
+def species_figure(infected_species, image=None, image_zoom=None, top=15, highlight=4):
+    '''
+    Species with the most infected birds, the `highlight` first ones emphasised
+    ...
+
+    Arguments
+    ---------
+    infected_species : Series
+                       Infected birds by Common_Name, sorted descending
+    image            : array, optional
+                       Picture of the most infected species
+    image_zoom       : float, optional
+                       Zoom to draw `image` with
+    '''
+    fig, ax = _figure((8, 6))
+    data = infected_species[:top]
+    counts = data.to_numpy()
+    highlight = min(highlight, len(data))
+
+    color_map = [HIGH_COLOR] * highlight + [LOW_COLOR] * (len(data) - highlight)
+    ax.barh(data.index[:highlight], counts[:highlight], edgecolor='darkgray', color=color_map[:highlight], alpha=0.9)
+    ax.barh(data.index, counts, edgecolor='white', color=color_map, alpha=0.3)
+
+    for i, value in enumerate(counts):
+        bold = i < highlight
+        ax.annotate(value, xy=(value - value * 0.05, i), va='center', ha='right',
+                    fontweight='bold' if bold else 'light', fontfamily=None if bold else 'serif',
+                    fontsize=13 if bold else 10, color='#FBFBFB')
+
+    ax.axes.get_xaxis().set_ticks([])
+    ax.invert_yaxis()
+    for s in ['top', 'bottom', 'right']:
+        ax.spines[s].set_visible(False)
+
+    if image is not None and len(data) > 9:
+        peak = counts.max()
+        offset_img(x=peak * 0.75, y=9, img=image, ax=ax, zoom=image_zoom or 1, offset=0)
+        ax.annotate('', xy=(peak * 0.93, 7.3), xytext=(peak * 0.98, 0.4),
+                    arrowprops=dict(facecolor=TEXT_COLOR, arrowstyle="-", connectionstyle="angle3,angleA=90,angleB=0"))
+
+    _title(ax, 'Species captured where Avian Flu has been detected',
+           f'Showing {len(data)} out of {len(infected_species)} species with the highest Avian Flu incidence')
+    return fig
+
+
+def locality_figure(top_locations, counties, county='Dublin'):
+    '''
+    Top locations with infected birds, coloured by whether they are in `county`
+    ...
+
+    Arguments
+    ---------
+    top_locations : Series
+                    Infected birds by Locality, sorted descending
+    counties      : Series
+                    County of every Locality
+    '''
+    from matplotlib.lines import Line2D
+
+    fig, ax = _figure((8, 6))
+    data = top_locations
+    counts = data.to_numpy()
+    in_county = counties.reindex(data.index).to_numpy() == county
+    color_map = [HIGH_COLOR if flag else LOW_COLOR for flag in in_county]
+
+    ax.barh(data.index, counts, edgecolor='white', color=color_map, alpha=0.8)
+    for i, value in enumerate(counts):
+        ax.annotate(value, xy=(value - value * 0.05, i), va='center', ha='right',
+                    fontweight='bold', fontfamily='serif', fontsize=10, color='#FBFBFB')
+
+    ax.axes.get_xaxis().set_ticks([])
+    ax.invert_yaxis()
+    for s in ['top', 'bottom', 'right']:
+        ax.spines[s].set_visible(False)
+
+    _title(ax, f'Top {len(data)} Locations where Avian Flu is most frequent',
+           f'{in_county.sum()} out of {len(data)} locations with the highest presence of birds '
+           f'with avian flu are in {county}.')
+
+    custom_lines = [Line2D([0], [0], color=HIGH_COLOR, lw=6),
+                    Line2D([0], [0], color=LOW_COLOR, lw=6)]
+    ax.legend(custom_lines, [county, 'Other County'], loc='lower right', facecolor=BACKGROUND_COLOR,
+              edgecolor=TEXT_COLOR, borderpad=0.7)
+    return fig
+
+
+def monthly_figure(prop_infected_bymonth, threshold=0.15):
+    '''
+    Monthly proportion of infected birds, months above `threshold` highlighted
+    '''
+    import matplotlib.ticker as mtick
+
+    fig, ax = _figure((10, 6))
+    data = prop_infected_bymonth
+    positions = np.arange(len(data.index))
+    above = data.to_numpy() > threshold
+    color_map = [HIGH_COLOR if flag else LOW_COLOR for flag in above]
+
+    ax.bar(positions, data, zorder=1, color=color_map, width=0.1)
+    ax.scatter(positions, data, zorder=1, s=100, color=color_map)
+    ax.set_xticks(positions)
+    ax.set_xticklabels(map(monthFormatter, list(data.index)), rotation=0)
+    ax.yaxis.set_major_formatter(mtick.PercentFormatter(1.0, decimals=0))
+    ax.axhline(y=threshold, lw=1, color=TEXT_COLOR)
+    for s in ['top', 'right']:
+        ax.spines[s].set_visible(False)
+
+    months = [monthFormatter(m) for m in data.index[above]]
+    subtitle = (', '.join(months) + f' with more than {threshold:.0%} infected birds.') if months \
+        else f'No month with more than {threshold:.0%} infected birds.'
+    _title(ax, 'Monthly proportion of Infected Birds captured', subtitle)
+    return fig
+
+
+def yearly_figure(prop_infected_byYear):
+    '''
+    Yearly proportion of infected birds with the peak year annotated
+    '''
+    import matplotlib.ticker as mtick
+
+    fig, ax = _figure((10, 6))
+    data = prop_infected_byYear.copy()
+    data.index = data.index.map(str)
+
+    ax.plot(data.index, data, color=HIGH_COLOR, linewidth=2)
+    ax.scatter(data.index, data, zorder=1, s=100, color=HIGH_COLOR)
+    ax.set_xticks(np.arange(len(data)))
+    ax.set_xticklabels(data.index, rotation=0)
+    ax.yaxis.set_major_formatter(mtick.PercentFormatter(1.0, decimals=0))
+    for s in ['right', 'top']:
+        ax.spines[s].set_visible(False)
+
+    if len(data):
+        peak = data.idxmax()
+        ax.annotate('{}\n{:.0%} infected birds'.format(peak, data[peak]),
+                    xy=(data.index.get_loc(peak), data[peak]), xytext=(60, -10), textcoords='offset points',
+                    arrowprops=dict(facecolor=TEXT_COLOR, arrowstyle="->"),
+                    fontsize=10, fontfamily='serif', ha='left', va='top', color=LOW_COLOR)
+        subtitle = f'Captured birds with Avian Flu from {data.index[0]} to {data.index[-1]}, peaking in {peak}.'
+    else:
+        subtitle = 'No captured birds in the selected years.'
+    _title(ax, '% of Infected Birds captured', subtitle)
+    return fig
+
+
+def choropleth_map(admin_areas, location, topo_json=None, levels_directory=None, levels_url=None,
+                   colormap='OrRd_04', quantiles=(0, 0.1, 0.5, 0.9, 0.98, 1)):
+    '''
+    Folium choropleth of `prop_infected` by council
+    ...
+
+    Arguments
+    ---------
+    admin_areas      : GeoDataFrame
+                       Councils with council, county, gaeilge, prop_infected
+                       and label_prop_infected columns
+    location         : (float, float)
+                       Initial centre of the map
+    topo_json        : str, optional
+                       TopoJSON of the councils; when given with the levels
+                       arguments the map uses the multi-resolution layer
+    levels_directory : str, optional
+                       Where to write the pyramid levels
+    levels_url       : str, optional
+                       URL of `levels_directory` relative to the saved map
+    colormap         : str
+                       Name of a `branca.colormap.linear` colormap
+    quantiles        : sequence of float
+                       Quantiles of `prop_infected` bounding the colour steps
+    '''
+    import branca.colormap as cm
+    import folium
+
+    colormap = getattr(cm.linear, colormap).to_step(data=admin_areas['prop_infected'], method='quant',
+                                                    quantiles=list(quantiles))
+    colormap.caption = "Proportion of Infected Birds on each Council/County"
+
+    mymap = folium.Map(location=location, zoom_start=7, tiles=None)
+    folium.TileLayer('CartoDB positron', name='Light Map', control=False).add_to(mymap)
+
+    fields = ['council', 'county', 'gaeilge', 'label_prop_infected']
+    aliases = ['Council', 'County', 'Gaeilge', '% of Infected Birds']
+    tooltip_style = 'background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;'
+    style = {'weight': 0.5, 'color': 'black', 'fillOpacity': 0.75}
+    highlight = {'fillColor': '#000000', 'color': '#000000', 'fillOpacity': 0.50, 'weight': 0.1}
+
+    if topo_json is not None and levels_directory is not None:
+        from birdflu.choropleth import MultiResolutionChoropleth, topology_pyramid
+
+        properties = admin_areas[fields].assign(fill_color=admin_areas['prop_infected'].map(colormap))
+        choropleth = MultiResolutionChoropleth(topology_pyramid(topo_json, properties), levels_directory,
+                                               levels_url, fields, aliases, style, highlight, tooltip_style)
+    else:
+        choropleth = folium.features.GeoJson(
+            admin_areas[fields + ['prop_infected', 'geometry']],
+            style_function=lambda x: dict(style, fillColor=colormap(x['properties']['prop_infected'])),
+            highlight_function=lambda x: highlight,
+            control=False,
+            tooltip=folium.features.GeoJsonTooltip(fields=fields, aliases=aliases, style=tooltip_style, sticky=True)
+        )
+
+    colormap.add_to(mymap)
+    mymap.add_child(choropleth)
+    return mymap
+
+
+def density_map(observations, location, tiles_directory=None, tiles_url=None, bandwidth=2000):
+    '''
+    Folium map of the kernel density of the infected and of all sightings
+    ...
+
+    Arguments
+    ---------
+    observations    : DataFrame
+                      Sightings with Longitude, Latitude and target_H5_HPAI
+    location        : (float, float)
+                      Initial centre of the map
+    tiles_directory : str, optional
+                      Where to write the density tiles; without it the
+                      densities are inlined as image overlays
+    tiles_url       : str, optional
+                      URL of `tiles_directory` relative to the saved map
+    bandwidth       : float
+                      Standard deviation of the kernel, in metres
+    '''
+    import folium
+
+    from birdflu.density import DensitySurface
+
+    mymap = folium.Map(location=location, zoom_start=7, tiles=None)
+    folium.TileLayer('CartoDB positron', name='Light Map', control=False).add_to(mymap)
+
+    layers = [('Infected birds', observations['target_H5_HPAI'] == 1, 'YlOrRd', True),
+              ('All captured birds', slice(None), 'PuBu', False)]
+    for i, (name, rows, colormap, show) in enumerate(layers):
+        points = observations.loc[rows]
+        if points.empty:
+            continue
+        surface = DensitySurface.from_points(points['Longitude'], points['Latitude'], bandwidth)
+        if tiles_directory is not None:
+            layer = surface.tile_layer(f'{tiles_directory}/{i}', f'{tiles_url}/{i}', name, colormap=colormap,
+                                       show=show)
+        else:
+            layer = surface.overlay(name, colormap=colormap, show=show)
+        layer.add_to(mymap)
+    folium.LayerControl(collapsed=False).add_to(mymap)
+    return mymap
+
+
+def g_map_figure(geog, legend_loc=4):
+    '''
+    Cluster map of the Getis-Ord G* hot and cold spots
+    ...
+
+    Arguments
+    ---------
+    geog       : GeoDataFrame
+                 Councils with geometry, county, Z and P columns
+    legend_loc : legend location
+    '''
+    import matplotlib.patches as mpatches
+
+    fig, ax = _figure((8, 8))
+    ec = '0.8'
+    sig = geog['P'] < 0.05
+    hot = sig & (geog['Z'] > 0)
+    cold = sig & (geog['Z'] < 0)
+
+    geog.loc[~sig, 'geometry'].plot(ax=ax, color='#bdbdbd', edgecolor=ec, linewidth=0.2)
+    if hot.any():
+        geog.loc[hot, 'geometry'].plot(ax=ax, color='#f03b20', edgecolor=ec, linewidth=0.2)
+    if cold.any():
+        geog.loc[cold, 'geometry'].plot(ax=ax, color='#2c7fb8', edgecolor=ec, linewidth=0.2)
+
+    ax.set_title('Getis-Ord G* statistic for % of Infected Birds', size=15)
+    ax.legend(handles=[mpatches.Patch(color='#f03b20', label='hot spot'),
+                       mpatches.Patch(color='#2c7fb8', label='cold spot'),
+                       mpatches.Patch(color='#bdbdbd', label='not significant')],
+              loc=legend_loc, facecolor=BACKGROUND_COLOR, edgecolor=TEXT_COLOR, borderpad=0.7)
+
+    for county, geometry in geog.loc[hot].dissolve('county').geometry.items():
+        point = geometry.representative_point()
+        ax.annotate(county, xy=(point.x, point.y), xytext=(0, 25), textcoords='offset points',
+                    arrowprops=dict(facecolor=TEXT_COLOR, arrowstyle="->"),
+                    fontsize=10, fontfamily='serif', ha='center', color='#f03b20')
+
+    ax.set_axis_off()
+    return fig
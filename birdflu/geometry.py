@@ -0,0 +1,98 @@
+"""
+Array-based construction and reprojection of the bird observation points.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+WGS84 = 'EPSG:4326'
+IRISH_GRID = 'EPSG:29902'
+
+CHUNK_SIZE = 1_000_000
+
+
+@lru_cache(maxsize=None)
+def get_transformer(from_crs, to_crs):
+    '''
+    Return a cached `pyproj.Transformer` taking (x, y) = (lon, lat) order
+    '''
+    from pyproj import Transformer
+
+    return Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
+
+def transform_coords(x, y, from_crs=WGS84, to_crs=IRISH_GRID, chunk_size=CHUNK_SIZE):
+    '''
+    Reproject coordinate arrays in fixed-size batches
+    ...
+
+    Arguments
+    ---------
+    x, y       : array-like
+                 Coordinates in `from_crs` (longitude and latitude for WGS84)
+    from_crs   : str
+                 Source CRS
+    to_crs     : str
+                 Target CRS
+    chunk_size : int
+                 Number of coordinates handed to PROJ at a time
+
+    Returns
+    -------
+    x, y       : ndarray
+                 Coordinates in `to_crs`
+    '''
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    transformer = get_transformer(from_crs, to_crs)
+
+    out_x = np.empty_like(x)
+    out_y = np.empty_like(y)
+    for start in range(0, len(x), chunk_size):
+        stop = start + chunk_size
+        out_x[start:stop], out_y[start:stop] = transformer.transform(x[start:stop], y[start:stop])
+    return out_x, out_y
+
+
+def add_grid_coords(df, lon='Longitude', lat='Latitude', to_crs=IRISH_GRID,
+                    columns=('Easting', 'Northing')):
+    '''
+    Return a copy of `df` with projected metric coordinates added
+    '''
+    df = df.copy()
+    df[columns[0]], df[columns[1]] = transform_coords(df[lon], df[lat], WGS84, to_crs)
+    return df
+
+
+def points_from_frame(df, lon='Longitude', lat='Latitude', to_crs=None):
+    '''
+    Build a GeoDataFrame of points straight from the coordinate columns
+    ...
+
+    Arguments
+    ---------
+    df     : DataFrame
+             Observations with WGS84 longitude and latitude columns
+    lon    : str
+             Longitude column
+    lat    : str
+             Latitude column
+    to_crs : str, optional
+             CRS to project the points to (e.g. IRISH_GRID for metres).
+             Defaults to keeping them in WGS84.
+
+    Returns
+    -------
+    gdf    : GeoDataFrame
+             Copy of `df` with a point `geometry` column and its CRS set
+    '''
+    import geopandas as gpd
+    import shapely
+
+    x, y = df[lon].to_numpy(dtype='float64'), df[lat].to_numpy(dtype='float64')
+    crs = WGS84
+    if to_crs is not None:
+        x, y = transform_coords(x, y, WGS84, to_crs)
+        crs = to_crs
+
+    return gpd.GeoDataFrame(df, geometry=shapely.points(x, y), crs=crs)
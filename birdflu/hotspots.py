@@ -0,0 +1,347 @@
+"""
+Getis-Ord local G* with parallel, reproducible permutation inference.
+
+`LocalGStar` mirrors the attributes of `esda.getisord.G_Local` with
+`star=True` (Gs, EGs, VGs, Zs, p_norm, p_sim), so it can be used wherever a
+`G_Local` result is expected, e.g. in `g_map`. Conditional permutations are
+drawn in fixed-size chunks, each seeded from its own child of a
+`numpy.random.SeedSequence`, and spread over a process pool. The p-values
+therefore only depend on `seed`, not on the number of workers. At most
+`n_jobs` chunks are in flight, so that stopping early saves the remaining
+ones.
+
+Ties of the permuted with the observed G* are counted as esda does, in the
+upper tail only, unless `ties='both'`: for a binary variable most G* values
+tie, and an observation whose permutations all tie with it would otherwise
+get the smallest p-value. `point_hotspots`, testing the binary target by
+default, counts them in both tails.
+
+Besides polygon contiguity, G* can run on observations or grid cells with
+sparse k-nearest-neighbour or distance-band weights built with a KD-tree on
+projected (metre) coordinates, see `point_hotspots`.
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse, stats
+
+from birdflu.tracing import traced
+
+PERMUTATIONS = 99999
+CHUNK_SIZE = 10000
+TIES = ('esda', 'both')
+
+
+def _binary_weights(w):
+    '''
+    Binary sparse adjacency (without self-neighbours) of a libpysal W or sparse matrix
+    '''
+    matrix = w.sparse if hasattr(w, 'sparse') else w
+    matrix = sparse.csr_matrix(matrix, dtype='float64')
+    matrix = matrix - sparse.diags(matrix.diagonal())
+    matrix.eliminate_zeros()
+    matrix.data[:] = 1.0
+    return matrix
+
+
+def _permutation_chunk(y, cardinality, observed, scale, seed, size):
+    '''
+    Count, per observation, the conditional permutations with G* >= observed
+    (first row) and with G* <= observed (second row)
+    '''
+    rng = np.random.default_rng(seed)
+    n = len(y)
+    k_max = int(cardinality.max()) if n else 0
+    tails = np.zeros((2, n), dtype=np.int64)
+    if k_max == 0:
+        # no neighbours: every permutation ties with the observed value
+        tails[:] = size
+        return tails
+
+    # one draw of k_max "neighbours" out of the n - 1 others per permutation,
+    # shifted past the focal observation for each i (as esda's crand does)
+    draws = np.empty((size, k_max), dtype=np.int64)
+    for row in draws:
+        row[:] = rng.choice(n - 1, size=k_max, replace=False)
+
+    # ties are common (binary variables), a relative tolerance keeps round-off from breaking them
+    tolerance = 1e-10 * np.abs(observed)
+    for i in range(n):
+        k = cardinality[i]
+        ids = draws[:, :k]
+        ids = ids + (ids >= i)
+        simulated = (y[ids].sum(axis=1) + y[i]) * scale[i]
+        tails[0, i] = (simulated >= observed[i] - tolerance[i]).sum()
+        tails[1, i] = (simulated <= observed[i] + tolerance[i]).sum()
+    return tails
+
+
+def _settled(folded, done, alpha, confidence):
+    '''
+    Observations whose p-value is surely above or below `alpha`
+    '''
+    delta = 1 - confidence
+    low = np.where(folded > 0, stats.beta.ppf(delta / 2, folded, done - folded + 1), 0.0)
+    high = stats.beta.ppf(1 - delta / 2, folded + 1, np.maximum(done - folded, 1))
+    return (high < alpha) | (low > alpha)
+
+
+class LocalGStar:
+    '''
+    Local Getis-Ord G* statistic
+    ...
+
+    Arguments
+    ---------
+    y               : array-like
+                      Variable, aligned with `w`
+    w               : libpysal W or scipy sparse matrix
+                      Contiguity (or other) weights without self-neighbours;
+                      the focal observation is always included (G*)
+    transform       : str
+                      'R' (row-standardized) or 'B' (binary), as in G_Local
+    permutations    : int
+                      Maximum number of conditional permutations, 0 for the
+                      analytic (normal approximation) results only
+    seed            : int, optional
+                      Seed making `p_sim` reproducible
+    n_jobs          : int, optional
+                      Number of worker processes, defaults to all CPUs
+    chunk_size      : int
+                      Permutations per task (and per early-stopping check)
+    alpha           : float
+                      Significance level used to decide when to stop early
+    confidence      : float
+                      Confidence required that a p-value is on one side of
+                      `alpha` before stopping
+    early_stop      : bool
+                      Stop once every observation is settled
+    ties            : str
+                      'esda' to count the permutations tying with the
+                      observed G* in the upper tail only, as G_Local does,
+                      or 'both' to count them in both tails, so that ties
+                      are never significant (binary variables)
+
+    Attributes
+    ----------
+    Gs, EGs, VGs, Zs, p_norm : array
+                      Statistic, its analytic moments, z-scores and one-sided
+                      normal p-values, as in G_Local
+    p_sim           : array
+                      One-sided pseudo p-values from the permutations, from
+                      the smaller of the tails G* >= observed and
+                      G* < observed (or G* <= observed with ties='both')
+    permutations    : int
+                      Number of permutations actually run
+    '''
+
+    @traced('hotspots.LocalGStar')
+    def __init__(self, y, w, transform='R', permutations=PERMUTATIONS, seed=None, n_jobs=None,
+                 chunk_size=CHUNK_SIZE, alpha=0.05, confidence=0.999, early_stop=True, ties='esda'):
+        if ties not in TIES:
+            raise ValueError(f'Unknown ties {ties!r}, expected one of {", ".join(TIES)}')
+        self.ties = ties
+        self.y = y = np.asarray(y, dtype='float64').flatten()
+        self.n = n = len(y)
+        self.transform = transform.upper()
+
+        adjacency = _binary_weights(w)
+        self.cardinality = np.asarray(adjacency.sum(axis=1)).ravel().astype(np.int64)
+
+        # self-weight of 1 before standardization, as G_Local does with star=True
+        if self.transform == 'R':
+            weight = 1.0 / (self.cardinality + 1)
+        elif self.transform == 'B':
+            weight = np.ones(n)
+        else:
+            raise ValueError(f"transform must be 'R' or 'B', got {transform!r}")
+        self.scale = weight / y.sum()
+
+        self.Gs = (adjacency @ y + y) * self.scale
+
+        # analytic moments under the normality assumption
+        row_sum = weight * (self.cardinality + 1)
+        mean = y.mean()
+        variance = (y ** 2).mean() - mean ** 2
+        self.EGs = row_sum / n
+        self.VGs = row_sum * (n - row_sum) / (n - 1) / n ** 2 * variance / mean ** 2
+        self.Zs = (self.Gs - self.EGs) / np.sqrt(self.VGs)
+        self.p_norm = stats.norm.sf(np.abs(self.Zs))
+
+        self.permutations = 0
+        if permutations:
+            self._simulate(permutations, seed, n_jobs, chunk_size, alpha, confidence, early_stop)
+
+    def _simulate(self, permutations, seed, n_jobs, chunk_size, alpha, confidence, early_stop):
+        sizes = [min(chunk_size, permutations - start) for start in range(0, permutations, chunk_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        args = (self.y, self.cardinality, self.Gs, self.scale)
+
+        tails = np.zeros((2, self.n), dtype=np.int64)
+        done = 0
+        n_jobs = n_jobs or os.cpu_count() or 1
+
+        def consume(results):
+            nonlocal tails, done
+            for size, chunk in zip(sizes, results):
+                tails += chunk
+                done += size
+                if early_stop and done < permutations and \
+                        _settled(self._folded(tails, done), done, alpha, confidence).all():
+                    return
+
+        def in_flight(executor):
+            # results in chunk order, submitting the next chunk only once one is consumed
+            pending = deque()
+            for s, size in zip(seeds, sizes):
+                pending.append(executor.submit(_permutation_chunk, *args, s, size))
+                if len(pending) == n_jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+        if n_jobs == 1:
+            consume(_permutation_chunk(*args, s, size) for s, size in zip(seeds, sizes))
+        else:
+            executor = ProcessPoolExecutor(n_jobs)
+            try:
+                consume(in_flight(executor))
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        self.permutations = done
+        self.p_sim = (self._folded(tails, done) + 1) / (done + 1)
+
+    def _folded(self, tails, done):
+        # permutations at least as extreme as the observed G*, in the smaller tail
+        if self.ties == 'both':
+            return tails.min(axis=0)
+        return np.minimum(tails[0], done - tails[0])
+
+
+def knn_weights(coords, k=8):
+    '''
+    Sparse binary weights linking every point to its `k` nearest neighbours
+    ...
+
+    Arguments
+    ---------
+    coords : array
+             (n, 2) projected coordinates, in metres
+    k      : int
+             Number of neighbours
+
+    Returns
+    -------
+    w      : scipy.sparse.csr_matrix
+             (n, n) weights, row i flags the neighbours of point i
+    '''
+    from scipy.spatial import cKDTree
+
+    coords = np.asarray(coords, dtype='float64')
+    n = len(coords)
+    k = min(k, n - 1)
+    _, neighbours = cKDTree(coords).query(coords, k=k + 1, workers=-1)
+
+    # drop the focal point itself, and the (k + 1)-th neighbour of the rows
+    # where duplicated coordinates hid the focal point from the query
+    rows = np.repeat(np.arange(n), k + 1)
+    cols = neighbours.ravel()
+    keep = rows != cols
+    keep &= np.cumsum(keep.reshape(n, k + 1), axis=1).ravel() <= k
+    return sparse.csr_matrix((np.ones(keep.sum()), (rows[keep], cols[keep])), shape=(n, n))
+
+
+def distance_band_weights(coords, threshold):
+    '''
+    Sparse binary weights linking points at most `threshold` metres apart
+    '''
+    from scipy.spatial import cKDTree
+
+    coords = np.asarray(coords, dtype='float64')
+    n = len(coords)
+    pairs = cKDTree(coords).query_pairs(threshold, output_type='ndarray')
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+
+
+def grid_cells(df, cell_size=5000, x='Easting', y='Northing', target='target_H5_HPAI'):
+    '''
+    Aggregate observations to square grid cells of `cell_size` metres
+    ...
+
+    Returns
+    -------
+    cells : DataFrame
+            Cell centre (x, y), TOTAL_BIRDS, INFECTED_BIRDS and prop_infected
+            for every cell with at least one observation
+    '''
+    import pandas as pd
+
+    col = np.floor(df[x].to_numpy() / cell_size).astype(np.int64)
+    row = np.floor(df[y].to_numpy() / cell_size).astype(np.int64)
+    cells = pd.DataFrame({'col': col, 'row': row, 'infected': df[target].to_numpy() == 1}) \
+        .groupby(['col', 'row'], sort=True)['infected'].agg(['size', 'sum']).reset_index()
+
+    return pd.DataFrame({
+        x: (cells['col'] + 0.5) * cell_size,
+        y: (cells['row'] + 0.5) * cell_size,
+        'TOTAL_BIRDS': cells['size'],
+        'INFECTED_BIRDS': cells['sum'].astype(np.int64),
+        'prop_infected': cells['sum'] / cells['size'],
+    })
+
+
+def point_hotspots(df, cell_size=None, k=8, threshold=None, variable=None, x='Easting', y='Northing',
+                   target='target_H5_HPAI', permutations=0, ties='both', **kwargs):
+    '''
+    G* hot spots of observations or grid cells
+    ...
+
+    Arguments
+    ---------
+    df           : DataFrame
+                   Observations with projected coordinates (see
+                   `birdflu.geometry.add_grid_coords`) and a `target` column
+    cell_size    : float, optional
+                   Aggregate to grid cells of this size (metres) first;
+                   by default every observation is a unit
+    k            : int
+                   Number of nearest neighbours, used unless `threshold` is set
+    threshold    : float, optional
+                   Distance band in metres instead of k-nearest neighbours
+    variable     : str, optional
+                   Column to test, `target` for observations and
+                   'prop_infected' for grid cells by default
+    permutations : int
+                   Passed to `LocalGStar`; the default 0 uses the analytic
+                   inference, which scales to millions of units
+    ties         : str
+                   Passed to `LocalGStar`; 'both' by default, the binary
+                   target of the observations ties massively
+    **kwargs     : passed to `LocalGStar` (seed, n_jobs, ...)
+
+    Returns
+    -------
+    units        : DataFrame
+                   Observations or cells with Z and P columns, P being the
+                   permutation p-value when permutations were run and the
+                   normal one otherwise
+    '''
+    if cell_size is not None:
+        units = grid_cells(df, cell_size, x, y, target)
+        variable = variable or 'prop_infected'
+    else:
+        units = df.copy()
+        variable = variable or target
+
+    coords = np.column_stack([units[x].to_numpy(), units[y].to_numpy()])
+    w = distance_band_weights(coords, threshold) if threshold is not None else knn_weights(coords, k)
+
+    g = LocalGStar(units[variable].to_numpy(), w, permutations=permutations, ties=ties, **kwargs)
+    units['Z'] = g.Zs
+    units['P'] = g.p_sim if g.permutations else g.p_norm
+    return units
@@ -0,0 +1,158 @@
+"""
+Content-addressed, memory-mapped store for the BirdWatch Ireland bird images.
+
+Pixel data lives outside the observations: every distinct image is saved once
+as `<digest>.npy` (plus pre-shrunk thumbnails) and the data frames only carry
+the digest in an `Image_Key` column. Images are memory-mapped on access, so
+loading observations never reads pixels and a figure can ask for the
+smallest thumbnail that is large enough for it.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+IMAGES_PATH = Path('data/images')
+
+# longest side, in pixels, of the precomputed thumbnails
+THUMBNAIL_SIZES = (64, 128, 256)
+
+
+def image_digest(image):
+    '''
+    Return the SHA-256 hex digest of an image's pixels, shape and dtype
+    '''
+    image = np.ascontiguousarray(image)
+    h = hashlib.sha256()
+    h.update(f'{image.dtype.str}{image.shape}'.encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def make_thumbnail(image, size):
+    '''
+    Shrink `image` so that its longest side is at most `size` pixels
+    '''
+    from PIL import Image
+
+    thumb = Image.fromarray(np.asarray(image))
+    thumb.thumbnail((size, size), Image.LANCZOS)
+    return np.asarray(thumb)
+
+
+def _save(path, array):
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+class ImageStore:
+    '''
+    Bird images keyed by species name
+    ...
+
+    Arguments
+    ---------
+    path : str or Path
+           Directory holding the `.npy` files and `index.json`
+    '''
+
+    def __init__(self, path=IMAGES_PATH):
+        self.path = Path(path)
+        self._index_file = self.path / 'index.json'
+        if self._index_file.exists():
+            with open(self._index_file, 'r') as f:
+                index = json.load(f)
+        else:
+            index = {'species': {}, 'shapes': {}}
+        self.species = index['species']
+        self.shapes = {k: tuple(v) for k, v in index['shapes'].items()}
+
+    def __contains__(self, name):
+        return name in self.species
+
+    def add(self, image, names=()):
+        '''
+        Save `image` (once per distinct content) and map `names` to it
+
+        Returns the image digest, to be stored in the `Image_Key` column.
+        '''
+        image = np.asarray(image)
+        digest = image_digest(image)
+
+        if digest not in self.shapes:
+            self.path.mkdir(parents=True, exist_ok=True)
+            _save(self._file(digest), image)
+            for size in THUMBNAIL_SIZES:
+                if max(image.shape[:2]) > size:
+                    _save(self._file(digest, size), make_thumbnail(image, size))
+            self.shapes[digest] = image.shape
+
+        for name in names:
+            if isinstance(name, str) and name:
+                self.species[name] = digest
+        return digest
+
+    def save(self):
+        '''
+        Persist the species index
+        '''
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self._index_file.with_name('index.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'species': self.species,
+                       'shapes': {k: list(v) for k, v in self.shapes.items()}}, f, indent=1)
+        os.replace(tmp, self._index_file)
+
+    def key(self, name):
+        '''
+        Digest of the image of species `name` (common or scientific name)
+        '''
+        try:
+            return self.species[name]
+        except KeyError:
+            raise KeyError(f'No image stored for {name!r}') from None
+
+    def shape(self, name):
+        '''
+        Shape of the full-resolution image, without reading any pixels
+        '''
+        return self.shapes[self.key(name)]
+
+    def get(self, name, size=None):
+        '''
+        Memory-mapped image of species `name` (or of a digest)
+        ...
+
+        Arguments
+        ---------
+        name : str
+               Species name or image digest (`Image_Key`)
+        size : int, optional
+               Longest side of the thumbnail to return. Defaults to the
+               full-resolution image.
+        '''
+        digest = name if name in self.shapes else self.key(name)
+        path = self._file(digest, size)
+        if size is not None and not path.exists():
+            # images smaller than `size` have no thumbnail of that size
+            path = self._file(digest)
+        return np.load(path, mmap_mode='r')
+
+    def fit(self, name, width):
+        '''
+        Smallest stored version of the image at least `width` pixels wide
+        '''
+        digest = name if name in self.shapes else self.key(name)
+        height, full_width = self.shapes[digest][:2]
+        for size in THUMBNAIL_SIZES:
+            if size < max(height, full_width) and full_width * size / max(height, full_width) >= width:
+                return self.get(digest, size)
+        return self.get(digest)
+
+    def _file(self, digest, size=None):
+        suffix = '' if size is None else f'_{size}'
+        return self.path / f'{digest}{suffix}.npy'
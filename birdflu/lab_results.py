@@ -0,0 +1,238 @@
+"""
+The 2021 wild bird avian influenza test results, in the historical schema.
+
+The 2021 results come as an Excel workbook with the EFSA field names
+(resQualValue, sampMatCode_source, sampArea, sampMonth, ...). The workbook is
+parsed once into a typed Parquet copy, reused until its content changes:
+
+    results = read_lab_results()
+
+and its rows are mapped onto the columns of the DAFM observations of
+1980-2020 (species, county, date, infected flag) and written to a store of
+their own, `LAB_DATASET_PATH`. They come from another sampling process and
+have no locality, so the analyses of the observations don't read them, but
+both periods load and aggregate together when `birdflu.store.load_dataset`
+is given both stores. The workbook has a row per
+sample part (Tissue-Pool, Intestine, Brain) of a bird, and the observations
+a row per bird: the parts of a bird are collapsed to one observation,
+infected when any part tested positive.
+
+    python -m birdflu.lab_results
+    load_dataset([DATASET_PATH, LAB_DATASET_PATH], columns=['Year', 'Common_Name', 'target_H5_HPAI'],
+                 filters=[('Year', '>=', 2015)])
+"""
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from birdflu.store import DATASET_PATH
+from birdflu.topology import file_digest
+from birdflu.tracing import traced
+
+XLSX_PATH = Path('data/237231_9c2bc8b5-dc06-44b9-a112-759029fd7704.xlsx')
+CACHE_PATH = Path('data/lab-results-cache')
+LAB_DATASET_PATH = Path('data/lab-results')
+
+YEAR = 2021
+INFECTED = 'Positive'
+# a bird is the consecutive sampling events of a day, place and species, one per sample part
+BIRD_COLUMNS = ['sampDate', 'sampInfo_latitude', 'sampInfo_longitude', 'sampMatCode_source']
+
+CATEGORICAL_COLUMNS = ['progId', 'progType', 'sampMethod', 'progInfo_targetGroup', 'sampArea', 'sampMatCode_base',
+                       'sampMatCode_source', 'sampMatCode_part', 'labId', 'paramType', 'paramCode_param',
+                       'paramCode_antH', 'paramCode_antN', 'anMethCode', 'resQualValue']
+NUMERIC_DTYPES = {'sampYear': 'int16', 'sampMonth': 'int8', 'sampDay': 'int8', 'resId': 'int64',
+                  'sampInfo_latitude': 'float64', 'sampInfo_longitude': 'float64'}
+
+# 2021 species names and their (eBird) common name in the DAFM observations;
+# other names are matched ignoring case, spacing and British spelling
+COMMON_NAMES = {
+    'Knots': 'Red Knot',
+    'Peregrine': 'Peregrine Falcon',
+    'Brent Goose': 'Brant',
+    'Magpie': 'Eurasian Magpie',
+    'Kestrel': 'Eurasian Kestrel',
+    'Pigeon': 'Rock Pigeon',
+}
+
+
+def read_lab_results(path=XLSX_PATH, cache_dir=CACHE_PATH):
+    '''
+    Test results of the workbook `path` with compact dtypes, parsed once and
+    then read from a Parquet copy keyed by the workbook's SHA-256
+    '''
+    cache_dir = Path(cache_dir)
+    cache_file = cache_dir / f'{Path(path).stem}-{file_digest(path)}.parquet'
+    if cache_file.exists():
+        return pd.read_parquet(cache_file)
+
+    results = pd.read_excel(path)
+    results['sampDate'] = pd.to_datetime(results['sampDate'])
+    results = results.astype({c: t for c, t in NUMERIC_DTYPES.items() if c in results.columns})
+    results = results.astype({c: 'category' for c in CATEGORICAL_COLUMNS if c in results.columns})
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for stale in cache_dir.glob(f'{Path(path).stem}-*.parquet'):
+        stale.unlink()
+    tmp = cache_file.with_name(cache_file.name + '.tmp')
+    results.to_parquet(tmp, index=False)
+    os.replace(tmp, cache_file)
+    return results
+
+
+def _name_key(name):
+    return ' '.join(str(name).split()).lower().replace('grey', 'gray')
+
+
+def common_names(names, reference_names):
+    '''
+    Common names of the DAFM observations (`reference_names`) matching the
+    2021 `names`, the cleaned 2021 name where none does
+    '''
+    known = {_name_key(n): n for n in pd.unique(reference_names.dropna())}
+    fixes = {_name_key(k): v for k, v in COMMON_NAMES.items()}
+    cleaned = pd.Series(names).map(lambda n: ' '.join(str(n).split()) if isinstance(n, str) else n)
+    return cleaned.map(lambda n: fixes.get(_name_key(n), known.get(_name_key(n), n)) if isinstance(n, str) else n)
+
+
+def bird_ids(results):
+    '''
+    Number of the bird each test result is a sample part of
+    ...
+
+    The parts of a bird have consecutive `sampEventId` numbers on the same
+    day, place and species; a bird ends where the numbers jump or a part
+    repeats (the next bird of the same species found there).
+    '''
+    event = pd.to_numeric(results['sampEventId'].astype(str).str.extract(r'(\d+)\s*$')[0],
+                          errors='coerce').to_numpy()
+    group = results.groupby(BIRD_COLUMNS, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    part = results['sampMatCode_part'].astype(object).to_numpy() if 'sampMatCode_part' in results else None
+    order = np.lexsort([event, group])
+
+    birds = np.empty(len(results), dtype=np.int64)
+    bird, previous, parts = -1, None, set()
+    for i in order:
+        current = group[i], event[i]
+        # without parts every result is a bird
+        new = (previous is None or current[0] != previous[0] or current[1] != previous[1] + 1
+               or part is None or part[i] in parts)
+        if new:
+            bird, parts = bird + 1, set()
+        if part is not None:
+            parts.add(part[i])
+        birds[i], previous = bird, current
+    return birds
+
+
+@traced()
+def to_observations(results, reference=None):
+    '''
+    Test results mapped onto the columns of the DAFM observations, one row per
+    bird
+    ...
+
+    Arguments
+    ---------
+    results   : DataFrame
+                Test results, see `read_lab_results`
+    reference : DataFrame, optional
+                DAFM observations, the most frequent scientific name of each
+                common name and the province and ISO code of each county are
+                taken from them
+
+    Returns
+    -------
+    observations : DataFrame
+                   One row per bird (see `bird_ids`); `target_H5_HPAI` is 1
+                   for the birds with a positive sample part
+    '''
+    birds = bird_ids(results)
+    infected = np.zeros(birds.max() + 1 if len(birds) else 0, dtype=bool)
+    np.logical_or.at(infected, birds, (results['resQualValue'] == INFECTED).to_numpy())
+    # first part of every bird, in the order of the workbook
+    first = np.sort(np.unique(birds, return_index=True)[1])
+    infected = infected[birds[first]]
+    results = results.iloc[first]
+
+    date = pd.to_datetime(results['sampDate'])
+    observations = pd.DataFrame({
+        'Common_Name': results['sampMatCode_source'].astype(object).to_numpy(),
+        'Date': date.dt.strftime('%d/%m/%Y').to_numpy(),
+        'Year': results['sampYear'].to_numpy(),
+        'Month': results['sampMonth'].to_numpy(),
+        'Day': results['sampDay'].to_numpy(),
+        'Time': pd.array([pd.NA] * len(results), dtype='Int64'),
+        'Country': 'Ireland',
+        'County': results['sampArea'].astype(object).str.strip().str.title().to_numpy(),
+        'Locality': None,
+        'Latitude': results['sampInfo_latitude'].to_numpy(),
+        'Longitude': results['sampInfo_longitude'].to_numpy(),
+        'target_H5_HPAI': infected.astype(np.int8),
+    })
+
+    if reference is not None:
+        observations['Common_Name'] = common_names(observations['Common_Name'], reference['Common_Name']).to_numpy()
+        species = reference.groupby('Common_Name', observed=True)['Scientific_Name'].agg(
+            lambda names: names.value_counts().index[0])
+        observations['Scientific_Name'] = observations['Common_Name'].map(species)
+        observations['Parent_Species'] = observations['Scientific_Name']
+        counties = reference.dropna(subset=['County']).drop_duplicates('County').set_index('County')
+        for column in ['State', 'Country_State_County']:
+            observations[column] = observations['County'].map(counties[column])
+    return observations
+
+
+def ingest_lab_results(path=XLSX_PATH, dataset=LAB_DATASET_PATH, birdwatch=None, cache_dir=CACHE_PATH,
+                       reference=DATASET_PATH):
+    '''
+    Write the test results of `path` to the store `dataset`, apart from the
+    DAFM observations of the store `reference` their species and counties are
+    matched to, joined with the BirdWatch Ireland species if given; raises a
+    ValueError if any is not of `YEAR` or `dataset` is `reference`
+
+    Returns
+    -------
+    observations : DataFrame
+                   The rows written
+    '''
+    from birdflu.store import load_dataset, write_dataset
+
+    if Path(dataset).resolve() == Path(reference).resolve():
+        raise ValueError(f'The test results are not written to the store of the DAFM observations {reference}')
+    observations = None
+    if Path(reference).exists():
+        observations = load_dataset(reference, columns=['Common_Name', 'Scientific_Name', 'County', 'State',
+                                                        'Country_State_County'])
+    observations = to_observations(read_lab_results(path, cache_dir), observations)
+    # write_dataset replaces the partitions it writes: only ever that of YEAR
+    other_years = sorted(set(observations['Year'].unique()) - {YEAR})
+    if other_years:
+        raise ValueError(f'{path} has test results of {", ".join(map(str, other_years))}, only {YEAR} is ingested')
+    if birdwatch is not None:
+        from birdflu.stages import join_birdwatch
+
+        observations = join_birdwatch(observations, birdwatch)
+    write_dataset(observations, dataset)
+    return observations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--xlsx', default=str(XLSX_PATH), help='workbook of the test results')
+    parser.add_argument('--dataset', default=str(LAB_DATASET_PATH), help='store the test results are written to')
+    parser.add_argument('--reference', default=str(DATASET_PATH), help='store of the DAFM observations')
+    parser.add_argument('--birdwatch', help='pickled BirdWatch Ireland species to join')
+    args = parser.parse_args(argv)
+
+    birdwatch = pd.read_pickle(args.birdwatch) if args.birdwatch else None
+    observations = ingest_lab_results(args.xlsx, args.dataset, birdwatch, reference=args.reference)
+    print(f'{len(observations)} test results ({int(observations["target_H5_HPAI"].sum())} positive) '
+          f'written to {args.dataset}')
+
+
+if __name__ == '__main__':
+    main()
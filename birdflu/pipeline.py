@@ -0,0 +1,202 @@
+"""
+Content-hashed stage graph with an on-disk cache of every stage's output.
+
+A stage is a function of the outputs of its input stages and of keyword
+parameters. Its output is pickled under a key made of the SHA-256 of
+
+- the stage's name and the source code of its function,
+- its parameters, and the content of the parameters naming input files,
+- the digests of the outputs of its input stages,
+
+so editing a stage, one of its parameters or one of its files recomputes that
+stage only, and its downstream stages only if its output actually changed.
+Helper functions called by a stage are not part of its key, bump a `version`
+parameter when one of them changes.
+"""
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+from birdflu import tracing
+from birdflu.topology import file_digest
+
+CACHE_PATH = Path('data/pipeline-cache')
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), files=(), params=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.files = list(files)
+        self.params = dict(params or {})
+
+    def source(self):
+        try:
+            return inspect.getsource(self.func)
+        except (OSError, TypeError):
+            return f'{self.func.__module__}.{self.func.__qualname__}'
+
+    def __repr__(self):
+        return f'Stage({self.name!r}, inputs={self.inputs})'
+
+
+class Pipeline:
+    '''
+    Stages run in dependency order, cached on disk under `cache_dir`
+    ...
+
+    Arguments
+    ---------
+    cache_dir : str or Path
+                Directory holding one sub-directory of cached outputs per stage
+
+    Attributes
+    ----------
+    stages    : dict
+                Stages by name, in the order they were added
+    log       : dict
+                'cached' or 'computed' and the seconds taken, by stage, for
+                the stages of the last `run`
+    '''
+
+    def __init__(self, cache_dir=CACHE_PATH):
+        self.cache_dir = Path(cache_dir)
+        self.stages = {}
+        self.log = {}
+        self._values = {}
+        self._file_digests = {}
+
+    def add(self, name, func, inputs=(), files=(), **params):
+        '''
+        Add stage `name` computing `func(*outputs of inputs, **params)`;
+        `files` names the parameters holding paths of input files
+        '''
+        missing = [i for i in inputs if i not in self.stages]
+        if missing:
+            raise KeyError(f'Stage {name!r} depends on unknown stages: {", ".join(missing)}')
+        unknown = [f for f in files if f not in params]
+        if unknown:
+            raise ValueError(f'Stage {name!r} has no parameters {", ".join(unknown)}')
+        self.stages[name] = Stage(name, func, inputs, files, params)
+        return self.stages[name]
+
+    def update(self, name, **params):
+        '''
+        Change parameters of stage `name`
+        '''
+        self.stages[name].params.update(params)
+
+    def _file_digest(self, path):
+        stat = os.stat(path)
+        signature = (str(path), stat.st_mtime_ns, stat.st_size)
+        if signature not in self._file_digests:
+            self._file_digests[signature] = file_digest(path)
+        return self._file_digests[signature]
+
+    def key(self, stage, input_digests):
+        files = {f: self._file_digest(stage.params[f]) if stage.params[f] is not None else None
+                 for f in stage.files}
+        payload = [stage.name, stage.source(), stage.params, files, input_digests]
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def _paths(self, name, key):
+        directory = self.cache_dir / name
+        return directory / f'{key}.pkl', directory / f'{key}.json'
+
+    def _meta(self, name, key):
+        data_path, meta_path = self._paths(name, key)
+        if not (data_path.exists() and meta_path.exists()):
+            return None
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+
+    def _resolve(self, name, resolved):
+        # key and output digest of `name`, computing it on a cache miss
+        if name in resolved:
+            return resolved[name]
+        stage = self.stages[name]
+        input_digests = [self._resolve(i, resolved)[1] for i in stage.inputs]
+        key = self.key(stage, input_digests)
+
+        meta = self._meta(name, key)
+        if meta is not None:
+            self.log[name] = ('cached', 0.0)
+            resolved[name] = (key, meta['digest'])
+            return resolved[name]
+
+        start = time.perf_counter()
+        with tracing.span(f'pipeline.{name}', key=key[:12]) as span:
+            value = stage.func(*[self._load(i, resolved[i][0]) for i in stage.inputs], **stage.params)
+            if span is not None:
+                span.rows = tracing._count_rows(value)
+        seconds = time.perf_counter() - start
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha256(data).hexdigest()
+
+        data_path, meta_path = self._paths(name, key)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        for path, content in [(data_path, data),
+                              (meta_path, json.dumps({'digest': digest, 'seconds': seconds,
+                                                      'inputs': dict(zip(stage.inputs, input_digests))}).encode())]:
+            tmp = path.with_name(path.name + '.tmp')
+            tmp.write_bytes(content)
+            os.replace(tmp, path)
+
+        self._values[name, key] = value
+        self.log[name] = ('computed', seconds)
+        resolved[name] = (key, digest)
+        return resolved[name]
+
+    def _load(self, name, key):
+        if (name, key) not in self._values:
+            with open(self._paths(name, key)[0], 'rb') as f:
+                self._values[name, key] = pickle.load(f)
+        return self._values[name, key]
+
+    def run(self, target):
+        '''
+        Output of stage `target`, computing only the stages whose key changed
+        '''
+        self.log = {}
+        resolved = {}
+        key, _ = self._resolve(target, resolved)
+        return self._load(target, key)
+
+    def status(self, target):
+        '''
+        Which stages `target` depends on are 'cached', 'missing' (their key
+        has no cached output) or 'stale' (an input is missing, so their key
+        is not known yet)
+        '''
+        status, digests = {}, {}
+
+        def visit(name):
+            if name in status:
+                return
+            stage = self.stages[name]
+            for i in stage.inputs:
+                visit(i)
+            if any(status[i] != 'cached' for i in stage.inputs):
+                status[name] = 'stale'
+                return
+            meta = self._meta(name, self.key(stage, [digests[i] for i in stage.inputs]))
+            status[name] = 'cached' if meta is not None else 'missing'
+            if meta is not None:
+                digests[name] = meta['digest']
+
+        visit(target)
+        return status
+
+    def clear(self, name=None):
+        '''
+        Remove the cached outputs of stage `name`, or of every stage
+        '''
+        for stage in [name] if name is not None else list(self.stages):
+            shutil.rmtree(self.cache_dir / stage, ignore_errors=True)
+        self._values = {k: v for k, v in self._values.items() if name is not None and k[0] != name}
@@ -0,0 +1,471 @@
+"""
+Distances from arbitrary sites (poultry farms, registered premises) to the
+sightings.
+
+"How close is this site to recent positives?" is answered for batches of
+sites at once from KD-trees of the sightings in Irish Grid metres:
+
+    index = ProximityIndex.from_dataset()
+    index.nearest(sites, k=5, since='2021-01-01')          # 5 nearest infected birds of every site
+    index.summary(sites, radius=10000, since='2021-01-01')  # infected birds within 10 km, nearest, species
+
+or for a CSV of sites with Longitude and Latitude columns:
+
+    python -m birdflu.proximity sites.csv --radius 10000 --since 2021-01-01 --output exposure.csv
+
+The sightings are kept in segments with a tree each. New records are added
+as a segment of their own and the smaller segments merged as they
+accumulate, so a batch of records costs a tree of its size rather than a
+rebuild of the index; `refresh` adds the partitions written to the store
+since and drops the rows of the replaced ones. The time window and the
+infected filter are masks on the records: a segment they select little of
+gets a tree of the selected records, cached until the index changes, the
+others are queried for more neighbours than asked and filtered.
+"""
+import argparse
+import math
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from birdflu.geometry import IRISH_GRID, WGS84, transform_coords
+from birdflu.store import DATASET_PATH
+from birdflu.tracing import traced
+
+COLUMNS = ['Year', 'Month', 'Day', 'Latitude', 'Longitude', 'target_H5_HPAI', 'Common_Name']
+
+K = 5
+RADIUS = 10000
+TOP_SPECIES = 3
+# within-radius pairs held in memory at a time by `summary`
+MAX_PAIRS = 2_000_000
+# a segment is merged into the previous one until that one is this many times larger
+MERGE_RATIO = 2
+# below this share of a segment's records, the selected records get a tree of their own
+SUBSET_SHARE = 0.25
+
+_NAT = np.iinfo(np.int64).min
+
+
+def _tree(x, y):
+    from scipy.spatial import cKDTree
+
+    # unbalanced trees build several times faster and query about as fast
+    return cKDTree(np.column_stack([x, y]), balanced_tree=False, compact_nodes=False)
+
+
+def _days(observations):
+    # days since 1970-01-01 of the observations, _NAT where unknown
+    if not {'Year', 'Month', 'Day'} <= set(observations.columns):
+        date = pd.to_datetime(observations['Date'], dayfirst=True, errors='coerce')
+        return date.to_numpy('datetime64[D]').astype(np.int64)
+
+    # datetime64 arithmetic, many times faster than parsing the dates
+    year, month, day = (pd.to_numeric(observations[c], errors='coerce').to_numpy('float64')
+                        for c in ['Year', 'Month', 'Day'])
+    valid = np.isfinite(year) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0).astype(np.int64)
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + np.where(valid, day, 1) - 1
+    # days past the end of their month, e.g. 31/04
+    valid &= days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) == months
+    return np.where(valid, days.astype(np.int64), _NAT)
+
+
+def _day(date):
+    return None if date is None else pd.Timestamp(date).to_datetime64().astype('datetime64[D]').astype(np.int64)
+
+
+class ProximityIndex:
+    '''
+    KD-trees of the sightings in projected metres, queried for batches of sites
+    ...
+
+    Arguments
+    ---------
+    observations : DataFrame, optional
+                   Sightings with coordinates, Year, Month and Day (or Date),
+                   `target` and `species` columns, see `add`
+    crs          : str
+                   Projected CRS the distances are measured in
+    lon, lat     : str
+                   Coordinate columns of the observations and of the sites
+    target       : str
+                   Column flagging infected (1) and healthy (0) birds
+    species      : str
+                   Species column
+
+    Every query takes a time window `since`, `until` (inclusive, anything
+    `pandas.Timestamp` accepts) and `infected`: True (the default) for the
+    infected birds, False for the healthy ones, None for all.
+    '''
+
+    def __init__(self, observations=None, crs=IRISH_GRID, lon='Longitude', lat='Latitude', target='target_H5_HPAI',
+                 species='Common_Name'):
+        self.crs, self.lon, self.lat, self.target, self.species = crs, lon, lat, target, species
+        self.species_names = []
+        self._species_codes = {}
+        self._records = {
+            'x': np.empty(0), 'y': np.empty(0), 'lon': np.empty(0), 'lat': np.empty(0),
+            'day': np.empty(0, dtype=np.int64), 'infected': np.empty(0, dtype=bool),
+            'species': np.empty(0, dtype=np.int32), 'source': np.empty(0, dtype=np.int32),
+            'alive': np.empty(0, dtype=bool),
+        }
+        # (start, stop, tree) of contiguous ranges of the records
+        self._segments = []
+        self._subsets = {}
+        self.dataset, self.filters, self._files = None, None, {}
+        if observations is not None:
+            self.add(observations)
+
+    def __len__(self):
+        return int(self._records['alive'].sum())
+
+    @classmethod
+    def from_dataset(cls, path=DATASET_PATH, filters=None, **kwargs):
+        '''
+        Index of the observations of the store `path` (see
+        `birdflu.store.load_dataset` for `filters`), kept up to date by `refresh`
+        '''
+        index = cls(**kwargs)
+        index.dataset, index.filters = Path(path), filters
+        index.refresh()
+        return index
+
+    @traced('proximity.ProximityIndex.add')
+    def add(self, observations, source=-1):
+        '''
+        Add sightings to the index; those without coordinates are skipped.
+        Returns the number of sightings added
+        '''
+        x, y = transform_coords(observations[self.lon], observations[self.lat], WGS84, self.crs)
+        keep = np.isfinite(x) & np.isfinite(y)
+
+        codes, uniques = pd.factorize(observations[self.species])
+        for name in uniques:
+            if name not in self._species_codes:
+                self._species_codes[name] = len(self.species_names)
+                self.species_names.append(name)
+        # -1 (unknown species) stays -1 through the lookup's last entry
+        lookup = np.array([self._species_codes[name] for name in uniques] + [-1], dtype=np.int32)
+
+        added = {
+            'x': x, 'y': y,
+            'lon': np.asarray(observations[self.lon], dtype='float64'),
+            'lat': np.asarray(observations[self.lat], dtype='float64'),
+            'day': _days(observations),
+            'infected': np.asarray(observations[self.target]) == 1,
+            'species': lookup[codes],
+            'source': np.full(len(x), source, dtype=np.int32),
+            'alive': np.ones(len(x), dtype=bool),
+        }
+        start = len(self._records['x'])
+        for name, values in added.items():
+            self._records[name] = np.concatenate([self._records[name], values[keep]])
+        stop = len(self._records['x'])
+        if stop > start:
+            self._segments.append((start, stop, _tree(self._records['x'][start:], self._records['y'][start:])))
+            self._merge()
+        self._subsets.clear()
+        return stop - start
+
+    def _merge(self):
+        # sizes kept decreasing geometrically: O(log n) segments, each record rebuilt O(log n) times
+        while len(self._segments) > 1:
+            (start, middle, _), (_, stop, _) = self._segments[-2:]
+            if middle - start > MERGE_RATIO * (stop - middle):
+                break
+            self._segments[-2:] = [(start, stop, _tree(self._records['x'][start:stop],
+                                                       self._records['y'][start:stop]))]
+
+    def remove(self, source):
+        '''
+        Drop the sightings added with `source`; the trees are rebuilt once
+        half of their records are dropped
+        '''
+        records = self._records
+        records['alive'] &= records['source'] != source
+        self._subsets.clear()
+        if records['alive'].sum() < len(records['alive']) / 2:
+            alive = records['alive']
+            self._records = {name: values[alive] for name, values in records.items()}
+            self._segments = []
+            if len(self._records['x']):
+                self._segments = [(0, len(self._records['x']), _tree(self._records['x'], self._records['y']))]
+
+    def refresh(self):
+        '''
+        Add the files of the store written since the index was built or last
+        refreshed and drop the rows of the files deleted (partitions replaced
+        by `birdflu.store.write_dataset`); returns the number of files read
+        '''
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+
+        if self.dataset is None:
+            raise ValueError('The index was not built from a dataset, see ProximityIndex.from_dataset')
+        files = {path: Path(path).stat().st_mtime_ns
+                 for path in ds.dataset(self.dataset, format='parquet', partitioning='hive').files}
+        for path, (mtime, source) in list(self._files.items()):
+            if files.get(path) != mtime:
+                self.remove(source)
+                del self._files[path]
+
+        new = [path for path in files if path not in self._files]
+        columns = list(dict.fromkeys(COLUMNS + [self.lon, self.lat, self.target, self.species]))
+        expression = pq.filters_to_expression(self.filters) if self.filters else None
+        for path in new:
+            source = max([source for _, source in self._files.values()], default=-1) + 1
+            # the partition values (Year) come from the path below the dataset root
+            table = ds.dataset([path], format='parquet', partitioning='hive',
+                               partition_base_dir=str(self.dataset)).to_table(columns=columns, filter=expression)
+            self.add(table.to_pandas(), source)
+            self._files[path] = files[path], source
+        return len(new)
+
+    def _mask(self, since, until, infected):
+        records = self._records
+        mask = records['alive'].copy()
+        if infected is not None:
+            mask &= records['infected'] == bool(infected)
+        if since is not None or until is not None:
+            day = records['day']
+            mask &= day != _NAT
+            if since is not None:
+                mask &= day >= _day(since)
+            if until is not None:
+                mask &= day <= _day(until)
+        return mask
+
+    def _trees(self, mask, key):
+        # per segment: tree, positions of its records in the index, and the mask of the
+        # records to keep among its results (None: all of them)
+        for start, stop, tree in self._segments:
+            selected = mask[start:stop]
+            share = selected.mean()
+            if share == 0:
+                continue
+            if share == 1:
+                yield tree, np.arange(start, stop), None
+            elif share < SUBSET_SHARE:
+                if (start, stop, key) not in self._subsets:
+                    ids = start + np.flatnonzero(selected)
+                    self._subsets[start, stop, key] = _tree(self._records['x'][ids], self._records['y'][ids]), ids
+                subset, ids = self._subsets[start, stop, key]
+                yield subset, ids, None
+            else:
+                yield tree, np.arange(start, stop), selected
+
+    def _coords(self, sites):
+        x, y = transform_coords(sites[self.lon], sites[self.lat], WGS84, self.crs)
+        return np.column_stack([x, y])
+
+    def _nearest(self, xy, k, mask, key, max_distance):
+        distances = [np.full((len(xy), k), np.inf)]
+        ids = [np.full((len(xy), k), -1)]
+        for tree, positions, selected in self._trees(mask, key):
+            d, i = _knn(tree, xy, k, selected, max_distance)
+            distances.append(d)
+            ids.append(np.where(i >= 0, positions[np.maximum(i, 0)], -1))
+        distances, ids = np.hstack(distances), np.hstack(ids)
+        order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def _distinct(self, mask, key):
+        # tree of the distinct (x, y, species) of the selected records, their species and records:
+        # the sightings of a capture site are counted once per species rather than pair by pair
+        if ('distinct', key) not in self._subsets:
+            records = self._records
+            groups = pd.DataFrame({name: records[name][mask] for name in ['x', 'y', 'species']})
+            groups = groups.value_counts(sort=False).reset_index()
+            tree = _tree(groups['x'].to_numpy(), groups['y'].to_numpy()) if len(groups) else None
+            self._subsets['distinct', key] = tree, groups['species'].to_numpy(), groups['count'].to_numpy()
+        return self._subsets['distinct', key]
+
+    def _within(self, xy, radius, mask, key):
+        # (site, record, distance) of the pairs closer than `radius`
+        sites, records = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for tree, positions, selected in self._trees(mask, key):
+            neighbours = tree.query_ball_point(xy, radius, workers=-1, return_sorted=False)
+            lengths = np.fromiter(map(len, neighbours), dtype=np.int64, count=len(xy))
+            if not lengths.sum():
+                continue
+            i = np.concatenate([np.asarray(n, dtype=np.int64) for n in neighbours if n])
+            site = np.repeat(np.arange(len(xy)), lengths)
+            if selected is not None:
+                site, i = site[selected[i]], i[selected[i]]
+            sites.append(site)
+            records.append(positions[i])
+        sites, records = np.concatenate(sites), np.concatenate(records)
+        distances = np.hypot(self._records['x'][records] - xy[sites, 0], self._records['y'][records] - xy[sites, 1])
+        return sites, records, distances
+
+    def _frame(self, sites, site, records, distances):
+        names = np.array(self.species_names + [None], dtype=object)
+        return pd.DataFrame({
+            'site': sites.index.to_numpy()[site],
+            'distance_m': distances,
+            'Date': self._records['day'][records].astype('datetime64[D]'),
+            self.species: names[self._records['species'][records]],
+            'infected': self._records['infected'][records],
+            self.lat: self._records['lat'][records],
+            self.lon: self._records['lon'][records],
+        })
+
+    @traced('proximity.ProximityIndex.nearest')
+    def nearest(self, sites, k=K, since=None, until=None, infected=True, max_distance=np.inf):
+        '''
+        The `k` sightings nearest to every site
+        ...
+
+        Arguments
+        ---------
+        sites        : DataFrame
+                       Sites with `lon` and `lat` columns
+        k            : int
+                       Sightings per site
+        max_distance : float
+                       Farthest sighting returned, in metres
+
+        Returns
+        -------
+        nearest      : DataFrame
+                       One row per site and sighting, nearest first, with the
+                       site's label in `sites`, the `rank` of the sighting
+                       (1 for the nearest), its distance in metres, date,
+                       species, infected flag and coordinates; sites with
+                       fewer sightings in range have fewer rows
+        '''
+        mask = self._mask(since, until, infected)
+        distances, ids = self._nearest(self._coords(sites), k, mask, (since, until, infected), max_distance)
+        site, rank = np.nonzero(ids >= 0)
+        frame = self._frame(sites, site, ids[site, rank], distances[site, rank])
+        frame.insert(1, 'rank', rank + 1)
+        return frame
+
+    @traced('proximity.ProximityIndex.within')
+    def within(self, sites, radius=RADIUS, since=None, until=None, infected=True):
+        '''
+        The sightings within `radius` metres of every site, as `nearest`
+        returns them without the rank, by site and distance
+        '''
+        site, records, distances = self._within(self._coords(sites), radius, self._mask(since, until, infected),
+                                                (since, until, infected))
+        order = np.lexsort([distances, site])
+        return self._frame(sites, site[order], records[order], distances[order]).reset_index(drop=True)
+
+    @traced('proximity.ProximityIndex.summary')
+    def summary(self, sites, radius=RADIUS, since=None, until=None, infected=True, top=TOP_SPECIES):
+        '''
+        Exposure of every site to the sightings
+        ...
+
+        Arguments
+        ---------
+        sites  : DataFrame
+                 Sites with `lon` and `lat` columns
+        radius : float
+                 Distance in metres the sightings are counted within
+        top    : int
+                 Species listed per site
+
+        Returns
+        -------
+        summary : DataFrame
+                  Indexed like `sites`, with the number of `sightings` within
+                  `radius`, the distance in metres to the nearest sighting
+                  (`nearest_m`, at any distance, NaN when there is none) and
+                  the `top` species within `radius`, as [(name, birds), ...]
+        '''
+        key = (since, until, infected)
+        mask = self._mask(since, until, infected)
+        xy = self._coords(sites)
+        nearest, _ = self._nearest(xy, 1, mask, key, np.inf)
+
+        counts = np.zeros(len(xy), dtype=np.int64)
+        species = [[] for _ in range(len(xy))]
+        tree, codes, weights = self._distinct(mask, key)
+        if tree is not None:
+            lengths = tree.query_ball_point(xy, radius, workers=-1, return_length=True)
+            for chunk in _chunks(lengths):
+                neighbours = tree.query_ball_point(xy[chunk], radius, workers=-1, return_sorted=False)
+                i = np.concatenate([np.asarray(n, dtype=np.int64) for n in neighbours] + [np.empty(0, np.int64)])
+                site = chunk.start + np.repeat(np.arange(len(neighbours)), lengths[chunk])
+                counts += np.bincount(site, weights[i], minlength=len(xy)).astype(np.int64)
+                pairs = pd.DataFrame({'site': site, 'species': codes[i], 'birds': weights[i]})
+                pairs = pairs[pairs['species'] >= 0].groupby(['site', 'species'], sort=False)['birds'].sum()
+                pairs = pairs.reset_index().sort_values(['site', 'birds'], ascending=[True, False], kind='stable')
+                for s, group in pairs.groupby('site', sort=False):
+                    species[s] = [(self.species_names[code], int(birds))
+                                  for code, birds in zip(group['species'].to_numpy()[:top], group['birds'].to_numpy())]
+
+        return pd.DataFrame({
+            'sightings': counts,
+            'nearest_m': np.where(np.isfinite(nearest[:, 0]), nearest[:, 0], np.nan),
+            'species': species,
+        }, index=sites.index)
+
+
+def _chunks(lengths):
+    # consecutive slices of the sites with about MAX_PAIRS pairs each, at least one site
+    ends = np.searchsorted(np.cumsum(lengths), np.arange(MAX_PAIRS, lengths.sum(), MAX_PAIRS), side='right')
+    bounds = np.unique(np.concatenate([[0], ends, [len(lengths)]]))
+    return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _knn(tree, xy, k, selected, max_distance):
+    # `k` nearest points of `tree` among the `selected` ones (all if None), -1 and inf where fewer
+    n = tree.n
+    distances, ids = np.full((len(xy), k), np.inf), np.full((len(xy), k), -1)
+    if selected is None:
+        fetch = min(k, n)
+        d, i = tree.query(xy, k=fetch, distance_upper_bound=max_distance, workers=-1)
+        d, i = d.reshape(len(xy), fetch), i.reshape(len(xy), fetch)
+        found = i < n
+        distances[:, :fetch] = np.where(found, d, np.inf)
+        ids[:, :fetch] = np.where(found, i, -1)
+        return distances, ids
+
+    # ask for enough neighbours for k selected ones on average, and more for the sites short of them
+    pending = np.arange(len(xy))
+    fetch = math.ceil(2 * k / selected.mean())
+    while len(pending):
+        fetch = min(fetch, n)
+        d, i = tree.query(xy[pending], k=fetch, distance_upper_bound=max_distance, workers=-1)
+        d, i = d.reshape(len(pending), fetch), i.reshape(len(pending), fetch)
+        found = i < n
+        keep = found & selected[np.minimum(i, n - 1)]
+        rank = np.cumsum(keep, axis=1)
+        keep &= rank <= k
+        # done when k were found, or the tree has no more points (within max_distance)
+        done = (rank[:, -1] >= k) | (fetch == n) | ~found[:, -1]
+        rows, columns = np.nonzero(keep & done[:, None])
+        distances[pending[rows], rank[rows, columns] - 1] = d[rows, columns]
+        ids[pending[rows], rank[rows, columns] - 1] = i[rows, columns]
+        pending = pending[~done]
+        fetch *= 4
+    return distances, ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('sites', help='CSV of the sites, with Longitude and Latitude columns')
+    parser.add_argument('--dataset', default=str(DATASET_PATH), help='store of the observations')
+    parser.add_argument('--radius', type=float, default=RADIUS, help='metres the sightings are counted within')
+    parser.add_argument('--since', help='first day of the sightings')
+    parser.add_argument('--until', help='last day of the sightings')
+    parser.add_argument('--all', action='store_true', help='all the birds, not only the infected ones')
+    parser.add_argument('--output', help='CSV written, standard output by default')
+    args = parser.parse_args(argv)
+
+    sites = pd.read_csv(args.sites)
+    index = ProximityIndex.from_dataset(args.dataset)
+    summary = index.summary(sites, args.radius, args.since, args.until, None if args.all else True)
+    summary['species'] = summary['species'].map(lambda top: '; '.join(f'{name} ({birds})' for name, birds in top))
+    summary = sites.join(summary)
+    summary.to_csv(args.output if args.output else sys.stdout, index=False)
+
+
+if __name__ == '__main__':
+    main()
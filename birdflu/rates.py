@@ -0,0 +1,234 @@
+"""
+Vectorized raw, empirical-Bayes and spatial empirical-Bayes infection rates.
+
+Every estimator works on arrays of infected (`e`) and total (`n`) birds with
+the areas on the last axis, so the rates of every year / month / species slice
+are computed at once, each slice shrunk towards its own mean:
+
+- raw rates e / n (0 where no bird was captured) with Wilson score intervals
+- empirical-Bayes rates (Marshall's method of moments, as in
+  `esda.smoothing.Empirical_Bayes`) shrinking areas with few birds towards
+  the rate of the whole slice
+- spatial empirical-Bayes rates (as in `esda.smoothing.Spatial_Empirical_Bayes`)
+  shrinking them towards the rate of their neighbourhood instead
+
+The intervals of the smoothed rates are the quantiles of the Beta posterior of
+a Beta prior matching the mean and variance estimated for the rate.
+"""
+import numpy as np
+import pandas as pd
+
+# Beta prior concentration used when the between-area variance vanishes
+MAX_CONCENTRATION = 1e12
+
+
+def _as_float(*arrays):
+    return [np.asarray(a, dtype='float64') for a in arrays]
+
+
+def _divide(a, b, fill=0.0):
+    a, b = np.broadcast_arrays(a, b)
+    return np.divide(a, b, out=np.full(a.shape, fill), where=b != 0)
+
+
+def raw_rate(e, n, confidence=0.95):
+    '''
+    Raw rates e / n with Wilson score intervals
+    ...
+
+    Arguments
+    ---------
+    e          : array_like
+                 Infected birds
+    n          : array_like
+                 Captured birds, same shape as `e`
+    confidence : float
+                 Confidence level of the intervals
+
+    Returns
+    -------
+    rate, lower, upper : ndarray
+                 Rates, 0 where no bird was captured, with the bounds of
+                 their intervals, [0, 1] where no bird was captured
+    '''
+    from statistics import NormalDist
+
+    e, n = _as_float(e, n)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    rate = _divide(e, n)
+
+    centre = _divide(e + z ** 2 / 2, n + z ** 2, fill=0.5)
+    half = _divide(z * np.sqrt(n * rate * (1 - rate) + z ** 2 / 4), n + z ** 2, fill=0.5)
+    return rate, np.clip(centre - half, 0, 1), np.clip(centre + half, 0, 1)
+
+
+def _posterior_interval(e, n, mean, variance, confidence):
+    # Beta prior with the moments given, updated with e infected out of n
+    from scipy import stats
+
+    concentration = _divide(mean * (1 - mean), variance, fill=np.inf) - 1
+    concentration = np.clip(concentration, 1e-6, MAX_CONCENTRATION)
+    alpha = mean * concentration + e
+    beta = (1 - mean) * concentration + n - e
+
+    tail = (1 - confidence) / 2
+    with np.errstate(invalid='ignore'):
+        lower = stats.beta.ppf(tail, alpha, beta)
+        upper = stats.beta.ppf(1 - tail, alpha, beta)
+    # degenerate posteriors of slices without infected (or healthy) birds
+    lower = np.where(alpha <= 0, 0.0, np.where(beta <= 0, 1.0, lower))
+    upper = np.where(alpha <= 0, 0.0, np.where(beta <= 0, 1.0, upper))
+    return lower, upper
+
+
+def _shrink(e, n, rate, mean, variance, confidence):
+    weight = _divide(variance * n, variance * n + mean)
+    smoothed = mean + (rate - mean) * weight
+    return (smoothed,) + _posterior_interval(e, n, mean, variance, confidence)
+
+
+def eb_rate(e, n, confidence=0.95):
+    '''
+    Empirical-Bayes rates, shrunk towards the rate of their slice
+    ...
+
+    The rates are those of `esda.smoothing.Empirical_Bayes`, except that a
+    negative between-area variance is taken as 0 (every rate is then the
+    mean), and that areas without birds get the mean rather than making
+    every rate of the slice NaN.
+
+    Arguments
+    ---------
+    e          : array_like
+                 Infected birds, areas on the last axis
+    n          : array_like
+                 Captured birds, same shape as `e`
+    confidence : float
+                 Confidence level of the intervals
+
+    Returns
+    -------
+    rate, lower, upper : ndarray
+                 Smoothed rates and the bounds of their intervals
+    '''
+    e, n = _as_float(e, n)
+    rate = _divide(e, n)
+
+    mean = _divide(e.sum(axis=-1), n.sum(axis=-1))[..., None]
+    spread = _divide((n * (rate - mean) ** 2).sum(axis=-1), n.sum(axis=-1))[..., None]
+    # mean size of all the areas, those without birds included
+    mean_n = n.mean(axis=-1)[..., None]
+    variance = np.maximum(spread - _divide(mean, mean_n), 0)
+    return _shrink(e, n, rate, mean, variance, confidence)
+
+
+def spatial_eb_rate(e, n, w, confidence=0.95):
+    '''
+    Spatial empirical-Bayes rates, shrunk towards the rate of the area and
+    its neighbours
+    ...
+
+    Arguments
+    ---------
+    e          : array_like
+                 Infected birds, areas on the last axis in the order of `w`
+    n          : array_like
+                 Captured birds, same shape as `e`
+    w          : libpysal.weights.W
+                 Spatial weights of the areas; only the neighbours are used
+    confidence : float
+                 Confidence level of the intervals
+
+    Returns
+    -------
+    rate, lower, upper : ndarray
+                 Smoothed rates and the bounds of their intervals
+    '''
+    from scipy import sparse
+
+    e, n = _as_float(e, n)
+    rate = _divide(e, n)
+
+    neighbourhood = sparse.csr_matrix(w.sparse, dtype='float64', copy=True)
+    neighbourhood.data[:] = 1
+    neighbourhood = neighbourhood + sparse.identity(neighbourhood.shape[0], format='csr')
+    size = np.asarray(neighbourhood.sum(axis=1)).ravel()
+
+    def local_sum(x):
+        # sum over the neighbourhood of every area, for every slice
+        return (neighbourhood @ x.reshape(-1, x.shape[-1]).T).T.reshape(x.shape)
+
+    local_e, local_n = local_sum(e), local_sum(n)
+    mean = _divide(local_e, local_n)
+    # sum of n_j (r_j - mean_i)^2 over the neighbourhood of i, expanded
+    squares = local_sum(e * rate) - 2 * mean * local_e + mean ** 2 * local_n
+    variance = np.maximum(_divide(squares, local_n) - _divide(mean * size, local_n), 0)
+    return _shrink(e, n, rate, mean, variance, confidence)
+
+
+def rate_labels(rate):
+    '''
+    Rates as percentages rounded to 2 decimals, e.g. '12.5%'
+    '''
+    return pd.Series(np.round(np.asarray(rate, dtype='float64') * 100, 2)).astype(str).add('%').to_numpy()
+
+
+def rate_table(counts, w=None, areas=None, events='INFECTED_BIRDS', population='TOTAL_BIRDS', confidence=0.95):
+    '''
+    Raw and smoothed rates of every area and slice of `counts`
+    ...
+
+    Arguments
+    ---------
+    counts     : DataFrame
+                 Counts indexed by area, or by (area, *slice) as returned by
+                 `count_birds_by_area(..., by=[...])`
+    w          : libpysal.weights.W, optional
+                 Weights of `areas`, adds the spatial empirical-Bayes rates
+    areas      : Index, optional
+                 Every area, in the order of `w`; defaults to the areas of
+                 `counts`. Areas or slices missing from `counts` count no bird.
+    events     : str
+                 Column of infected birds
+    population : str
+                 Column of captured birds
+    confidence : float
+                 Confidence level of the intervals
+
+    Returns
+    -------
+    rates      : DataFrame
+                 `events`, `population` and the raw, eb and spatial_eb rates
+                 with their lower and upper bounds, indexed by (area, *slice)
+    '''
+    if counts.index.nlevels == 1:
+        e = counts[events].to_frame().T
+        n = counts[population].to_frame().T
+    else:
+        e = counts[events].unstack(level=0, fill_value=0)
+        n = counts[population].unstack(level=0, fill_value=0)
+    if areas is not None:
+        e = e.reindex(columns=areas, fill_value=0)
+        n = n.reindex(columns=areas, fill_value=0)
+
+    estimates = {'raw': raw_rate(e, n, confidence), 'eb': eb_rate(e, n, confidence)}
+    if w is not None:
+        if len(e.columns) != w.n:
+            raise ValueError(f'{len(e.columns)} areas but {w.n} in the weights, pass `areas`')
+        estimates['spatial_eb'] = spatial_eb_rate(e, n, w, confidence)
+
+    columns = {events: e.to_numpy(), population: n.to_numpy()}
+    for name, (rate, lower, upper) in estimates.items():
+        columns.update({name: rate, f'{name}_lower': lower, f'{name}_upper': upper})
+
+    # (slices, areas) arrays to rows ordered by area then slice
+    n_slices, n_areas = e.shape
+    area_codes = np.repeat(np.arange(n_areas), n_slices)
+    slice_codes = np.tile(np.arange(n_slices), n_areas)
+    if counts.index.nlevels == 1:
+        index = e.columns.rename(counts.index.name)
+    else:
+        index = pd.MultiIndex.from_arrays(
+            [e.columns[area_codes]] + [e.index.get_level_values(i)[slice_codes] for i in range(e.index.nlevels)],
+            names=counts.index.names)
+    return pd.DataFrame({name: np.asarray(values).T.ravel() for name, values in columns.items()}, index=index)
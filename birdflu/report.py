@@ -0,0 +1,233 @@
+"""
+Headless, parameterized batch report of the bird flu analysis.
+
+Runs the analysis of Wild-Bird-Species-Analysis.ipynb without IPython, with
+the Agg backend, on a subset of the observations, and renders the independent
+figures in parallel, one process each:
+
+    python -m birdflu.report --years 2009 2019 --county Dublin --output reports/dublin
+
+With `--trace reports/dublin/trace` the time, CPU and memory of every stage,
+including those run in the worker processes, are written to trace.json and
+trace.trace.json (see birdflu.tracing).
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# before matplotlib is imported here or in the worker processes
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import numpy as np
+
+from birdflu import tracing
+from birdflu.store import DATASET_PATH
+
+ADMIN_AREAS_PATH = Path('data/Administrative_Areas_Ireland.json')
+TOPOLOGY_PATH = Path('data/topology.json')
+
+FIGURES = ['proportion', 'species', 'locality', 'monthly', 'yearly', 'choropleth', 'gstar', 'density']
+
+
+@tracing.traced('report.load_observations')
+def load_observations(years=None, species=None, counties=None, path=DATASET_PATH):
+    '''
+    Observations of the years (inclusive range), species and counties given
+    '''
+    from birdflu.store import load_dataset
+
+    filters = []
+    if years:
+        filters += [('Year', '>=', years[0]), ('Year', '<=', years[1])]
+    if species:
+        filters.append(('Common_Name', 'in', list(species)))
+    if counties:
+        filters.append(('County', 'in', list(counties)))
+    return load_dataset(path, filters=filters or None)
+
+
+@tracing.traced('report.prepare_admin_areas')
+def prepare_admin_areas(observations, path=ADMIN_AREAS_PATH, topo_json=TOPOLOGY_PATH):
+    '''
+    Councils with the bird counts and proportions of `observations`
+    '''
+    from birdflu.stages import area_counts, read_admin_areas
+
+    admin_areas = area_counts(read_admin_areas(path), observations)
+
+    simplified = admin_areas.copy()
+    if topo_json is not None and Path(topo_json).exists():
+        from birdflu.geometry import WGS84
+        from birdflu.topology import simplified_topology
+
+        geometry = simplified_topology(topo_json, quantization=200, epsilon=0.001, algorithm='dp').to_gdf().geometry
+        simplified['geometry'] = geometry.set_crs(WGS84, allow_override=True).to_numpy()
+    return admin_areas, simplified
+
+
+def render(name, output, inputs):
+    '''
+    Render one figure to `output` and return the path written
+    '''
+    import matplotlib.pyplot as plt
+
+    from birdflu import figures
+
+    output = Path(output)
+    if name == 'choropleth':
+        path = output / 'choropleth_map.html'
+        mymap = figures.choropleth_map(**inputs, levels_directory=output / 'choropleth_levels',
+                                       levels_url='choropleth_levels')
+        with tracing.span('report.save', figure=name):
+            mymap.save(str(path))
+        return path
+
+    if name == 'density':
+        path = output / 'density_map.html'
+        mymap = figures.density_map(**inputs, tiles_directory=output / 'density_tiles', tiles_url='density_tiles')
+        with tracing.span('report.save', figure=name):
+            mymap.save(str(path))
+        return path
+
+    if name == 'gstar':
+        from birdflu.hotspots import LocalGStar
+
+        df = inputs['admin_areas']
+        if inputs['topo_json'] is not None:
+            from birdflu.contiguity import contiguity_weights
+
+            # the councils of the topology, in the same order
+            wq = contiguity_weights(inputs['topo_json'])
+        else:
+            import libpysal as lps
+
+            wq = lps.weights.Queen.from_dataframe(df, use_index=False)
+        # this already runs in a worker process, keep the permutations in it
+        lg = LocalGStar(df['prop_infected'], wq, permutations=inputs['permutations'], seed=inputs['seed'], n_jobs=1)
+        df['Z'] = lg.Zs
+        df['P'] = lg.p_sim if lg.permutations else lg.p_norm
+        df[['council', 'county', 'Z', 'P']].to_csv(output / 'gstar.csv', index=False)
+        fig = figures.g_map_figure(df)
+    else:
+        fig = getattr(figures, f'{name}_figure')(**inputs)
+
+    path = output / f'{name}.png'
+    with tracing.span('report.save', figure=name):
+        fig.savefig(path, bbox_inches='tight', facecolor=fig.get_facecolor())
+    plt.close(fig)
+    return path
+
+
+def _render_traced(name, output, inputs):
+    # the spans recorded in a worker process go back to the parent with the
+    # result, minus those a forked worker inherited from it
+    tracing.drain()
+    with tracing.span(f'report.render.{name}'):
+        path = render(name, output, inputs)
+    return path, tracing.drain()
+
+
+@tracing.traced('report.figure_inputs')
+def figure_inputs(observations, admin_areas=None, simplified=None, permutations=99999, seed=12345):
+    '''
+    Inputs of every figure, aggregated once from the observations
+    '''
+    from birdflu.cube import CountCube
+
+    cube = CountCube.from_frame(observations)
+    years = (int(observations['Year'].min()), int(observations['Year'].max()))
+
+    infected_species = cube.top('Common_Name', target_H5_HPAI=1)
+    image, image_zoom = None, None
+    if len(infected_species):
+        from birdflu.images import ImageStore
+
+        images = ImageStore()
+        if infected_species.index[0] in images:
+            width = images.shape(infected_species.index[0])[1] * 0.14
+            image = np.asarray(images.fit(infected_species.index[0], width))
+            image_zoom = width / image.shape[1]
+
+    localities = cube.rollup(['Locality', 'County'])
+    inputs = {
+        'proportion': {'counts': cube.rollup('target_H5_HPAI'), 'years': years},
+        'species': {'infected_species': infected_species, 'image': image, 'image_zoom': image_zoom},
+        'locality': {'top_locations': cube.top('Locality', n=10, target_H5_HPAI=1),
+                     'counties': localities.reset_index(level='County')['County'].groupby(level=0).first()},
+        'monthly': {'prop_infected_bymonth': round(cube.proportion('Month'), 2)},
+        'yearly': {'prop_infected_byYear': round(cube.proportion('Year'), 2)},
+        'density': {'observations': observations[['Longitude', 'Latitude', 'target_H5_HPAI']],
+                    'location': (observations['Latitude'].mean(), observations['Longitude'].mean())},
+    }
+    if admin_areas is not None:
+        inputs['choropleth'] = {
+            'admin_areas': simplified,
+            'location': (observations.loc[observations['target_H5_HPAI'] == 1, 'Latitude'].mean(),
+                         observations.loc[observations['target_H5_HPAI'] == 1, 'Longitude'].mean()),
+            'topo_json': str(TOPOLOGY_PATH) if TOPOLOGY_PATH.exists() else None,
+        }
+        inputs['gstar'] = {'admin_areas': admin_areas, 'permutations': permutations, 'seed': seed,
+                           'topo_json': str(TOPOLOGY_PATH) if TOPOLOGY_PATH.exists() else None}
+    return inputs
+
+
+def run(output, years=None, species=None, counties=None, figures=FIGURES, jobs=None,
+        permutations=99999, seed=12345):
+    '''
+    Render the report figures to `output`, one process per figure
+    '''
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+
+    observations = load_observations(years, species, counties)
+    if observations.empty:
+        raise ValueError('No observations match the filters')
+
+    admin_areas = simplified = None
+    if {'choropleth', 'gstar'} & set(figures):
+        admin_areas, simplified = prepare_admin_areas(observations)
+
+    inputs = figure_inputs(observations, admin_areas, simplified, permutations, seed)
+    with ProcessPoolExecutor(jobs or len(figures)) as executor:
+        futures = [executor.submit(_render_traced, name, output, inputs[name]) for name in figures]
+        paths = []
+        for future in futures:
+            path, events = future.result()
+            tracing.extend(events)
+            paths.append(path)
+        return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--years', nargs=2, type=int, metavar=('FIRST', 'LAST'), help='inclusive range of years')
+    parser.add_argument('--species', nargs='+', help='common names of the species to keep')
+    parser.add_argument('--county', nargs='+', dest='counties', help='counties to keep')
+    parser.add_argument('--output', default='reports', help='directory the figures are written to')
+    parser.add_argument('--figures', nargs='+', choices=FIGURES, default=FIGURES)
+    parser.add_argument('--jobs', type=int, help='number of worker processes (default: one per figure)')
+    parser.add_argument('--permutations', type=int, default=99999, help='G* permutations, 0 for analytic p-values')
+    parser.add_argument('--seed', type=int, default=12345)
+    parser.add_argument('--trace', metavar='PATH', help='write the per-stage trace to PATH.json and PATH.trace.json')
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        tracing.enable()
+    for path in run(args.output, args.years, args.species, args.counties, args.figures, args.jobs,
+                    args.permutations, args.seed):
+        print(path)
+
+    if args.trace:
+        for path in tracing.export(args.trace):
+            print(path)
+        print(f'{"stage":<36} {"calls":>5} {"wall [s]":>9} {"CPU [s]":>8} {"peak RSS [MB]":>14} {"rows":>9}')
+        for stage in tracing.summary():
+            rows = '' if stage['rows'] is None else stage['rows']
+            peak = '' if stage['peak_rss_mb'] is None else f'{stage["peak_rss_mb"]:.1f}'
+            print(f'{stage["name"]:<36} {stage["calls"]:>5} {stage["wall_s"]:>9.3f} {stage["cpu_s"]:>8.3f} '
+                  f'{peak:>14} {rows:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Concurrent, cached scraper for BirdWatch Ireland's list of Irish birds.
+
+Listing pages and bird images are fetched through one pooled
+`requests.Session` with bounded parallelism. Responses are kept in an
+on-disk HTTP cache and revalidated with `If-None-Match` /
+`If-Modified-Since`, so a re-run only downloads what changed. Records are
+yielded in page order, each page sorted by image URL then name, as soon as
+they and those before them are ready; the order does not depend on which
+request finishes first.
+"""
+import hashlib
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from urllib import parse
+
+import numpy as np
+
+BASE_URL = 'https://birdwatchireland.ie/irelands-birds-birdwatch-ireland/list-of-irelands-birds/'
+NO_PAGES = 24
+CACHE_PATH = Path('data/http-cache')
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:66.0) Gecko/20100101 Firefox/66.0",
+    "Accept-Encoding": "gzip, deflate",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "DNT": "1",
+    "Upgrade-Insecure-Requests": "1",
+}
+
+COLUMNS = ['Image', 'Bird_Name', 'Irish_Name', 'Scientific_Name', 'Bird_Family']
+
+
+class HttpCache:
+    '''
+    On-disk cache of response bodies with their validators
+    ...
+
+    Arguments
+    ---------
+    session : requests.Session
+              Session used for the (conditional) requests
+    path    : str or Path
+              Directory holding the cached bodies and metadata
+    '''
+
+    def __init__(self, session, path=CACHE_PATH):
+        self.session = session
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def get(self, url, timeout=30):
+        '''
+        Return the body of `url`, revalidating a cached copy if there is one
+        '''
+        key = hashlib.sha256(url.encode()).hexdigest()
+        body_file, meta_file = self.path / f'{key}.body', self.path / f'{key}.json'
+
+        headers = {}
+        meta = None
+        if meta_file.exists() and body_file.exists():
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        r = self.session.get(url, headers=headers, timeout=timeout)
+        if r.status_code == 304 and meta is not None:
+            return body_file.read_bytes()
+        r.raise_for_status()
+
+        _write(body_file, r.content)
+        _write(meta_file, json.dumps({
+            'url': url,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+        }).encode())
+        return r.content
+
+
+def _write(path, data):
+    # a temporary file of its own per write: threads fetching the same URL don't share one
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name, suffix='.tmp', delete=False) as f:
+        f.write(data)
+    try:
+        os.replace(f.name, path)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
+def make_session(pool_size=8):
+    '''
+    `requests.Session` with keep-alive connections pooled per host
+    '''
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _text(tag):
+    if tag is None:
+        return '0'
+    return tag.text if tag.text != '' else np.nan
+
+
+def parse_page(content):
+    '''
+    Parse a listing page into records with the image URL in place of the
+    image, sorted by image URL then bird name
+    '''
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser')
+
+    records = []
+    for d in soup.find_all('article', attrs={'class': 'bird'}):
+        img_html = d.find('div', attrs={'class': 'bird-img'}).find('img')
+        bird_info = d.find('div', attrs={'class': 'bird-info'}).find_all('p')
+
+        # there is a URL on Page 20 with an accent, hence parse.quote() ignoring : and /
+        image_url = parse.quote(img_html['data-src'], safe=':/') if img_html is not None else None
+
+        records.append({
+            'Image': image_url,
+            'Bird_Name': _text(d.find('h3', attrs={'class': 'title'})),
+            'Irish_Name': _text(bird_info[0]),
+            'Scientific_Name': _text(bird_info[1]),
+            'Bird_Family': _text(bird_info[2]),
+        })
+    return sorted(records, key=lambda r: (r['Image'] or '', r['Bird_Name'] or ''))
+
+
+def decode_image(content):
+    '''
+    Decode image bytes into an RGB array; palette, greyscale and RGBA
+    images are converted so that every record has three channels
+    '''
+    from PIL import Image
+
+    return np.asarray(Image.open(io.BytesIO(content)).convert('RGB'))
+
+
+def scrape(base_url=BASE_URL, no_pages=NO_PAGES, page_workers=4, image_workers=8,
+           cache_path=CACHE_PATH, session=None):
+    '''
+    Yield bird records in page order as their page and image arrive
+    ...
+
+    Arguments
+    ---------
+    base_url      : str
+                    Listing URL, pages are fetched from `base_url + 'page/<n>/'`
+    no_pages      : int
+                    Number of listing pages
+    page_workers  : int
+                    Maximum number of pages fetched at the same time
+    image_workers : int
+                    Maximum number of images fetched at the same time
+    cache_path    : str or Path
+                    Directory of the on-disk HTTP cache
+    session       : requests.Session, optional
+                    Session to use, by default one from `make_session`
+
+    Yields
+    ------
+    record        : dict
+                    Image (array, or '0' when the bird has none), Bird_Name,
+                    Irish_Name, Scientific_Name and Bird_Family
+    '''
+    session = session or make_session(page_workers + image_workers)
+    cache = HttpCache(session, cache_path)
+
+    def fetch_image(key, record):
+        url = record['Image']
+        record['Image'] = decode_image(cache.get(url)) if url is not None else '0'
+        return key, record
+
+    page_urls = [base_url + 'page/{}/'.format(i) for i in range(1, no_pages + 1)]
+    counts = {}   # page -> number of records, once parsed
+    ready = {}    # (page, position) -> record with its image
+    page, position = 0, 0
+    with ThreadPoolExecutor(page_workers) as pages, ThreadPoolExecutor(image_workers) as images:
+        page_of = {pages.submit(cache.get, url): i for i, url in enumerate(page_urls)}
+        futures = set(page_of)
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in page_of:
+                    # a listing page: queue its images while other pages are in flight
+                    records = parse_page(future.result())
+                    counts[page_of[future]] = len(records)
+                    futures |= {images.submit(fetch_image, (page_of[future], i), record)
+                                for i, record in enumerate(records)}
+                else:
+                    key, record = future.result()
+                    ready[key] = record
+
+            # release the records whose predecessors have all been released
+            while page in counts:
+                if position == counts[page]:
+                    page, position = page + 1, 0
+                elif (page, position) in ready:
+                    yield ready.pop((page, position))
+                    position += 1
+                else:
+                    break
@@ -0,0 +1,92 @@
+"""
+Point-in-polygon counting of captured birds per administrative area.
+"""
+import numpy as np
+import pandas as pd
+
+from birdflu.tracing import traced
+
+COUNT_COLUMNS = ['TOTAL_BIRDS', 'HEALTHY_BIRDS', 'INFECTED_BIRDS']
+
+
+def match_points_to_areas(areas, points):
+    '''
+    Pair every point with the areas it intersects using the areas' spatial index
+    ...
+
+    Arguments
+    ---------
+    areas  : GeoDataFrame
+             Polygons (e.g. administrative areas)
+    points : GeoDataFrame
+             Observations with point geometries. They are reprojected to the
+             CRS of `areas` when both are set and differ.
+
+    Returns
+    -------
+    pairs  : ndarray
+             Array of shape (2, n) with positional indices of the points
+             (first row) and the areas (second row) they fall in. A point on a
+             shared boundary is paired with every area it touches, as
+             `GeoSeries.intersects` would do.
+    '''
+    if areas.crs is not None and points.crs is not None and areas.crs != points.crs:
+        points = points.to_crs(areas.crs)
+
+    # one bulk STRtree query instead of a full scan of the points per polygon
+    return areas.sindex.query(points.geometry.values, predicate='intersects')
+
+
+@traced()
+def count_birds_by_area(areas, points, by=None, target='target_H5_HPAI'):
+    '''
+    Count total, healthy and infected birds falling inside each area
+    ...
+
+    Arguments
+    ---------
+    areas  : GeoDataFrame
+             Polygons to count the observations in
+    points : GeoDataFrame
+             Observations with point geometries and a `target` column
+    by     : str or list of str, optional
+             Columns of `points` (e.g. 'Common_Name', 'Month') to break the
+             counts down by
+    target : str
+             Column flagging infected (1) and healthy (0) birds
+
+    Returns
+    -------
+    counts : DataFrame
+             TOTAL_BIRDS, HEALTHY_BIRDS and INFECTED_BIRDS indexed like `areas`.
+             When `by` is given, the index is (area, *by) and only the
+             combinations with at least one bird are present.
+    '''
+    point_idx, area_idx = match_points_to_areas(areas, points)
+
+    status = points[target].to_numpy()[point_idx]
+    infected = status == 1
+    healthy = status == 0
+
+    if by is None:
+        n_areas = len(areas)
+        infected_count = np.bincount(area_idx[infected], minlength=n_areas)
+        healthy_count = np.bincount(area_idx[healthy], minlength=n_areas)
+        return pd.DataFrame({
+            'TOTAL_BIRDS': infected_count + healthy_count,
+            'HEALTHY_BIRDS': healthy_count,
+            'INFECTED_BIRDS': infected_count,
+        }, index=areas.index)
+
+    by = [by] if isinstance(by, str) else list(by)
+    area_name = areas.index.name or 'area'
+
+    matched = points[by].iloc[point_idx].reset_index(drop=True)
+    matched.insert(0, area_name, areas.index.to_numpy()[area_idx])
+    matched['HEALTHY_BIRDS'] = healthy.astype(np.int64)
+    matched['INFECTED_BIRDS'] = infected.astype(np.int64)
+    matched = matched[healthy | infected]
+
+    counts = matched.groupby([area_name] + by, observed=True, sort=True)[COUNT_COLUMNS[1:]].sum()
+    counts.insert(0, 'TOTAL_BIRDS', counts['HEALTHY_BIRDS'] + counts['INFECTED_BIRDS'])
+    return counts
@@ -0,0 +1,258 @@
+"""
+Reconciliation of scientific bird names against a checklist.
+
+The DAFM observations and the BirdWatch Ireland species do not always name a
+species the same way: a former genus (Larus ridibundus for Chroicocephalus
+ridibundus), a subspecies where the other lists the species (Branta bernicla
+hrota), a qualifier (Anas platyrhynchos (Domestic type)) or a typo. The index
+tries, in order,
+
+- exact:       the same name, ignoring case and spacing
+- synonym:     the same taxon once qualifiers are dropped and `SYNONYMS` are
+               replaced by their accepted name
+- species:     the species of a subspecies missing from the checklist
+- subspecies:  the only subspecies of the checklist under a species
+- fuzzy:       a typo in the epithet: the only name of the same genus
+               within `MAX_EDITS` edits of it (none for epithets shorter
+               than `FUZZY_LENGTH`), and only when no other name of the
+               genus is within one more edit, so that a species missing
+               from the checklist (Corvus corax) is not taken for a
+               neighbouring one (Corvus cornix); or, the genus missing from
+               the checklist, a typo in the genus with the same rule, the
+               candidate genera coming from an index of character trigrams
+               and the rest of the name matching exactly. A name with typos
+               in both is not matched
+
+Hybrids (x), slashes (a/b) and unidentified birds (sp.) are never matched.
+Every distinct name is resolved once and the results broadcast to the rows.
+"""
+import re
+import warnings
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# former or alternative binomial: accepted binomial
+SYNONYMS = {
+    'Larus ridibundus': 'Chroicocephalus ridibundus',
+    'Anas marila': 'Aythya marila',
+    'Anas penelope': 'Mareca penelope',
+    'Anas strepera': 'Mareca strepera',
+    'Anas americana': 'Mareca americana',
+    'Anas clypeata': 'Spatula clypeata',
+    'Anas querquedula': 'Spatula querquedula',
+    'Anas discors': 'Spatula discors',
+    'Carduelis chloris': 'Chloris chloris',
+    'Carduelis cannabina': 'Linaria cannabina',
+    'Carduelis flavirostris': 'Linaria flavirostris',
+    'Carduelis spinus': 'Spinus spinus',
+    'Parus caeruleus': 'Cyanistes caeruleus',
+    'Parus ater': 'Periparus ater',
+    'Philomachus pugnax': 'Calidris pugnax',
+    'Larus minutus': 'Hydrocoloeus minutus',
+    'Larus melanocephalus': 'Ichthyaetus melanocephalus',
+    'Sterna sandvicensis': 'Thalasseus sandvicensis',
+    'Sterna albifrons': 'Sternula albifrons',
+    'Puffinus gravis': 'Ardenna gravis',
+    'Puffinus griseus': 'Ardenna grisea',
+    'Porzana pusilla': 'Zapornia pusilla',
+    'Sturnus roseus': 'Pastor roseus',
+}
+MAX_EDITS = 1
+# letters of an epithet per allowed edit
+FUZZY_LENGTH = 5
+METHODS = ['exact', 'synonym', 'species', 'subspecies', 'fuzzy']
+
+_QUALIFIERS = re.compile(r'\s*(\[[^\]]*\]|\([^)]*\))')
+_UNIDENTIFIED = re.compile(r'/| x |(^|\s)sp\.?$')
+
+
+def _clean(name):
+    return ' '.join(str(name).split()).lower()
+
+
+def _trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class SpeciesIndex:
+    '''
+    Exact, synonym, subspecies, epithet and genus trigram indexes of a
+    checklist of scientific names
+    ...
+
+    Arguments
+    ---------
+    names    : iterable of str
+               Scientific names of the checklist, e.g. the BirdWatch Ireland
+               species
+    synonyms : dict
+               Former or alternative binomials and their accepted binomial
+    max_edits : int
+               Most typos (Levenshtein distance) in the epithet or the genus
+               of a fuzzy match, 0 turns fuzzy matching off
+
+    Attributes
+    ----------
+    unmatched : Counter
+                Rows by name left unmatched by `reconcile`, over all calls
+    '''
+
+    def __init__(self, names, synonyms=SYNONYMS, max_edits=MAX_EDITS):
+        self.synonyms = {_clean(k): _clean(v) for k, v in synonyms.items()}
+        self.max_edits = max_edits
+        self.unmatched = Counter()
+        self._resolved = {}
+
+        self.names = list(dict.fromkeys(n for n in names if isinstance(n, str)))
+        self._exact, self._canonical, self._subspecies = {}, {}, {}
+        for name in self.names:
+            self._exact.setdefault(_clean(name), name)
+            key = self.canonical(name)
+            if key is not None:
+                self._canonical.setdefault(key, name)
+        for key, name in self._canonical.items():
+            tokens = key.split()
+            if len(tokens) == 3:
+                self._subspecies.setdefault(' '.join(tokens[:2]), []).append(name)
+
+        # epithets by genus (species for a trinomial), for the fuzzy matches
+        self._epithets = {}
+        for key in self._canonical:
+            parent, _, epithet = key.rpartition(' ')
+            self._epithets.setdefault(parent, []).append(epithet)
+
+        # trigram postings of the genera, for the typos in the genus
+        self._genera = set(key.split()[0] for key in self._canonical)
+        self._postings = {}
+        for genus in sorted(self._genera):
+            for trigram in _trigrams(genus):
+                self._postings.setdefault(trigram, []).append(genus)
+
+    def canonical(self, name):
+        '''
+        Lower case binomial or trinomial of `name` without qualifiers and with
+        the accepted binomial of synonyms, None for hybrids, slashes and sp.
+        '''
+        key = _clean(_QUALIFIERS.sub('', str(name)))
+        if not key or _UNIDENTIFIED.search(key):
+            return None
+        if key in self.synonyms:
+            return self.synonyms[key]
+        tokens = key.split()
+        binomial = ' '.join(tokens[:2])
+        return ' '.join([self.synonyms.get(binomial, binomial)] + tokens[2:3])
+
+    def _fuzzy(self, key):
+        genus, _, rest = key.partition(' ')
+        if genus not in self._genera:
+            return self._fuzzy_genus(genus, rest)
+        parent, _, epithet = key.rpartition(' ')
+        edits = min(self.max_edits, len(epithet) // FUZZY_LENGTH)
+        if not parent or edits == 0:
+            return None, 0.0
+        return self._closest(epithet, self._epithets.get(parent, ()), edits, lambda other: f'{parent} {other}')
+
+    def _fuzzy_genus(self, genus, rest):
+        edits = min(self.max_edits, len(genus) // FUZZY_LENGTH)
+        if not rest or edits == 0:
+            return None, 0.0
+        # an edit changes at most 3 trigrams, genera sharing fewer are too far
+        trigrams = _trigrams(genus)
+        shared = Counter(other for trigram in trigrams for other in self._postings.get(trigram, ()))
+        least = len(trigrams) - 3 * edits
+        others = [other for other, n in shared.items() if n >= least and f'{other} {rest}' in self._canonical]
+        return self._closest(genus, others, edits, lambda other: f'{other} {rest}')
+
+    def _closest(self, word, others, edits, key):
+        distances = sorted((_edit_distance(word, other), other) for other in others)
+        if not distances or distances[0][0] > edits or len(distances) > 1 and distances[1][0] <= distances[0][0] + 1:
+            # nothing close enough, or another name nearly as close: don't guess
+            return None, 0.0
+        distance, other = distances[0]
+        match = key(other)
+        return self._canonical[match], 1 - distance / max(len(match) - len(other) + len(word), len(match))
+
+    def resolve(self, name):
+        '''
+        Checklist name matching `name`, the method that matched it (see
+        `METHODS`) and a similarity score, (None, None, 0.0) if none does
+        '''
+        if name in self._resolved:
+            return self._resolved[name]
+
+        result = None, None, 0.0
+        key = None if not isinstance(name, str) else self.canonical(name)
+        if isinstance(name, str) and _clean(name) in self._exact:
+            result = self._exact[_clean(name)], 'exact', 1.0
+        elif key is not None:
+            tokens = key.split()
+            species = ' '.join(tokens[:2])
+            subspecies = self._subspecies.get(key, [])
+            if key in self._canonical:
+                result = self._canonical[key], 'synonym', 1.0
+            elif len(tokens) == 3 and species in self._canonical:
+                result = self._canonical[species], 'species', 1.0
+            elif len(tokens) == 2 and len(subspecies) == 1:
+                result = subspecies[0], 'subspecies', 1.0
+            elif self.max_edits > 0:
+                match, score = self._fuzzy(key)
+                if match is not None:
+                    result = match, 'fuzzy', score
+        self._resolved[name] = result
+        return result
+
+    def match(self, names):
+        '''
+        Match of every distinct name, with its number of rows, most frequent first
+
+        Returns
+        -------
+        matches : DataFrame
+                  Indexed by name with the columns `match`, `method`, `score`
+                  and `rows`
+        '''
+        rows = pd.Series(names).value_counts(dropna=False)
+        matches = pd.DataFrame([self.resolve(name) for name in rows.index], index=rows.index,
+                               columns=['match', 'method', 'score'])
+        matches['rows'] = rows.to_numpy()
+        return matches
+
+    def reconcile(self, names):
+        '''
+        Checklist name matching each of `names` (a Series), NaN if none does;
+        the unmatched names are added to `unmatched`
+        '''
+        codes, uniques = pd.factorize(names)
+        resolved = np.array([self.resolve(name)[0] for name in uniques] + [None], dtype=object)
+        matched = pd.Series(resolved[codes], index=names.index, name=names.name)
+
+        missing = [i for i, match in enumerate(resolved[:-1]) if match is None]
+        if missing:
+            rows = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            self.unmatched.update({uniques[i]: int(rows[i]) for i in missing})
+        return matched
+
+
+def warn_unmatched(unmatched, checklist='the checklist', limit=10):
+    '''
+    Warn about names matching nothing in `checklist`, most frequent first
+    '''
+    if not unmatched:
+        return
+    top = ', '.join(f'{name} ({rows})' for name, rows in Counter(unmatched).most_common(limit))
+    more = f' and {len(unmatched) - limit} more' if len(unmatched) > limit else ''
+    warnings.warn(f'{len(unmatched)} scientific names ({sum(unmatched.values())} rows) are not in {checklist}: '
+                  f'{top}{more}', stacklevel=3)
@@ -0,0 +1,188 @@
+"""
+The bird flu analysis as a cached stage graph (see birdflu.pipeline).
+
+    wild_birds, birdwatch       -> observations
+    admin_areas, observations   -> area_counts
+    admin_areas                 -> weights
+    area_counts, weights        -> gstar
+    area_counts, observations   -> choropleth
+
+The Queen weights only depend on the council geometries and the map only on
+the counts, so changing the colormap re-renders the map without a new spatial
+join or permutation test:
+
+    pipeline = build_pipeline()
+    lg = pipeline.run('gstar')
+    pipeline.update('choropleth', colormap='YlOrRd_09')
+    html = pipeline.run('choropleth')
+"""
+from pathlib import Path
+
+from birdflu.pipeline import CACHE_PATH, Pipeline
+from birdflu.species import MAX_EDITS, SYNONYMS
+from birdflu.tracing import traced
+
+RAW_PATH = Path('data/98696_58589762-e8f9-4bb0-9d39-09570efbad62.xls')
+BIRDWATCH_PATH = Path('data/BirdWatchIreland.pkl')
+ADMIN_AREAS_PATH = Path('data/Administrative_Areas_Ireland.json')
+TOPOLOGY_PATH = Path('data/topology.json')
+
+
+def read_wild_birds(path):
+    import pandas as pd
+
+    return pd.read_csv(path, encoding='latin-1')
+
+
+def read_birdwatch(path):
+    import pandas as pd
+
+    return pd.read_pickle(path)
+
+
+def join_birdwatch(wild_birds, birdwatch, synonyms=SYNONYMS, max_edits=MAX_EDITS, index=None):
+    '''
+    Observations joined with the BirdWatch Ireland species whose scientific
+    name their own matches (see birdflu.species), in `Scientific_Name_bwi`;
+    warns about the names matching no species
+
+    Pass the `index` of the BirdWatch names to join several chunks, its
+    `unmatched` names are then left to the caller to report.
+    '''
+    from birdflu.species import SpeciesIndex, warn_unmatched
+
+    report = index is None
+    if index is None:
+        index = SpeciesIndex(birdwatch['Scientific_Name'], synonyms, max_edits)
+    wild_birds = wild_birds.assign(Scientific_Name_bwi=index.reconcile(wild_birds['Scientific_Name']))
+    if report:
+        warn_unmatched(index.unmatched, 'the BirdWatch Ireland species')
+    birdwatch = birdwatch.drop_duplicates('Scientific_Name').set_index('Scientific_Name')
+    return wild_birds.join(birdwatch, on='Scientific_Name_bwi', lsuffix='_original', rsuffix='_bwi')
+
+
+def read_admin_areas(path):
+    '''
+    Council geometries with lower case column names and titled names
+    '''
+    import geopandas as gpd
+
+    from birdflu.spatial import COUNT_COLUMNS
+
+    admin_areas = gpd.read_file(path)
+    admin_areas = admin_areas.drop(['GAEILGE', 'PROVINCE', 'GUID', 'CENTROID_X', 'CENTROID_Y', 'AREA', 'CC_ID',
+                                    'Shape__Area', 'Shape__Length'] + COUNT_COLUMNS, axis='columns', errors='ignore')
+    admin_areas = admin_areas.rename(columns={'CONTAE': 'gaeilge', 'ENGLISH': 'council', 'OBJECTID': 'id'})
+    admin_areas.columns = map(str.lower, admin_areas.columns)
+    admin_areas['council'] = admin_areas['council'].str.title()
+    admin_areas['county'] = admin_areas['county'].str.title()
+    return admin_areas
+
+
+def area_counts(admin_areas, observations):
+    '''
+    Councils with the bird counts and proportions of `observations`
+    '''
+    from birdflu.geometry import points_from_frame
+    from birdflu.rates import eb_rate, rate_labels, raw_rate
+    from birdflu.spatial import count_birds_by_area
+
+    admin_areas = admin_areas.copy()
+    counts = count_birds_by_area(admin_areas, points_from_frame(observations))
+    admin_areas[['total_birds', 'healthy_birds', 'infected_birds']] = counts.to_numpy()
+
+    for column in ['infected', 'healthy']:
+        admin_areas[f'prop_{column}'] = raw_rate(admin_areas[f'{column}_birds'], admin_areas['total_birds'])[0]
+        admin_areas[f'label_prop_{column}'] = rate_labels(admin_areas[f'prop_{column}'])
+    admin_areas['eb_prop_infected'], admin_areas['eb_lower'], admin_areas['eb_upper'] = eb_rate(
+        admin_areas['infected_birds'], admin_areas['total_birds'])
+    return admin_areas
+
+
+@traced()
+def queen_weights(admin_areas, topo_json=None):
+    '''
+    Queen contiguity of the councils, from the shared arcs of their topology
+    `topo_json` when given (see birdflu.contiguity)
+    '''
+    if topo_json is not None:
+        from birdflu.contiguity import contiguity_weights
+
+        return contiguity_weights(topo_json)
+
+    import libpysal as lps
+
+    return lps.weights.Queen.from_dataframe(admin_areas, use_index=False)
+
+
+def gstar(area_counts, weights, variable='prop_infected', permutations=99999, seed=12345):
+    from birdflu.hotspots import LocalGStar
+
+    return LocalGStar(area_counts[variable], weights, permutations=permutations, seed=seed)
+
+
+def choropleth_html(area_counts, observations, topo_json=None, colormap='OrRd_04',
+                    quantiles=(0, 0.1, 0.5, 0.9, 0.98, 1)):
+    '''
+    Standalone HTML of the choropleth map, on the simplified topology when
+    `topo_json` is given
+    '''
+    from birdflu.figures import choropleth_map
+
+    areas = area_counts
+    if topo_json is not None:
+        from birdflu.geometry import WGS84
+        from birdflu.topology import simplified_topology
+
+        geometry = simplified_topology(topo_json, quantization=200, epsilon=0.001, algorithm='dp').to_gdf().geometry
+        areas = area_counts.copy()
+        areas['geometry'] = geometry.set_crs(WGS84, allow_override=True).to_numpy()
+
+    infected = observations[observations['target_H5_HPAI'] == 1]
+    location = (infected['Latitude'].mean(), infected['Longitude'].mean())
+    mymap = choropleth_map(areas, location, colormap=colormap, quantiles=list(quantiles))
+    return mymap.get_root().render()
+
+
+def build_pipeline(raw_path=RAW_PATH, birdwatch_path=BIRDWATCH_PATH, admin_areas_path=ADMIN_AREAS_PATH,
+                   topo_json=TOPOLOGY_PATH, cache_dir=CACHE_PATH):
+    '''
+    Stage graph from the raw files to the G* statistics and the choropleth map
+    ...
+
+    Arguments
+    ---------
+    raw_path         : str or Path
+                       DAFM wild birds file (CSV despite its extension)
+    birdwatch_path   : str or Path
+                       Pickled BirdWatch Ireland species scraped by Datasets.ipynb
+    admin_areas_path : str or Path
+                       GeoJSON of the administrative areas
+    topo_json        : str or Path, optional
+                       TopoJSON of the administrative areas used by the map
+                       and the weights, ignored when it does not exist
+    cache_dir        : str or Path
+                       Directory of the cached stage outputs
+
+    Returns
+    -------
+    pipeline         : birdflu.pipeline.Pipeline
+    '''
+    if topo_json is not None and not Path(topo_json).exists():
+        topo_json = None
+
+    pipeline = Pipeline(cache_dir)
+    pipeline.add('wild_birds', read_wild_birds, files=['path'], path=str(raw_path))
+    pipeline.add('birdwatch', read_birdwatch, files=['path'], path=str(birdwatch_path))
+    pipeline.add('observations', join_birdwatch, inputs=['wild_birds', 'birdwatch'], synonyms=SYNONYMS,
+                 max_edits=MAX_EDITS)
+    pipeline.add('admin_areas', read_admin_areas, files=['path'], path=str(admin_areas_path))
+    pipeline.add('area_counts', area_counts, inputs=['admin_areas', 'observations'])
+    pipeline.add('weights', queen_weights, inputs=['admin_areas'], files=['topo_json'],
+                 topo_json=None if topo_json is None else str(topo_json))
+    pipeline.add('gstar', gstar, inputs=['area_counts', 'weights'], variable='prop_infected',
+                 permutations=99999, seed=12345)
+    pipeline.add('choropleth', choropleth_html, inputs=['area_counts', 'observations'], files=['topo_json'],
+                 topo_json=None if topo_json is None else str(topo_json), colormap='OrRd_04',
+                 quantiles=(0, 0.1, 0.5, 0.9, 0.98, 1))
+    return pipeline
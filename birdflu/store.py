@@ -0,0 +1,165 @@
+"""
+Partitioned columnar (Parquet) store for the joined bird flu dataset.
+
+The store replaces `data/bird-flu.pkl`: observations are written once,
+partitioned by Year (and optionally County), and read back selectively with
+column projection and predicate pushdown, e.g.
+
+    load_dataset(columns=['Common_Name', 'County', 'Locality'],
+                 filters=[('Year', '==', 2015), ('target_H5_HPAI', '==', 1)])
+
+only opens the 2015 partition and the three requested columns. Stores of
+other sources with the same columns (e.g. `birdflu.lab_results`) are kept
+apart and read together by passing several paths.
+"""
+from pathlib import Path
+
+import pandas as pd
+
+from birdflu.tracing import traced
+
+DATASET_PATH = Path('data/bird-flu')
+
+PARTITION_COLUMNS = ('Year',)
+
+# text columns with a small number of distinct values are dictionary-encoded
+CATEGORICAL_COLUMNS = ['Scientific_Name', 'Common_Name', 'County', 'Locality',
+                       'Country', 'Country_State_County', 'State', 'Parent_Species',
+                       'Bird_Name', 'Irish_Name', 'Bird_Family', 'Image_Key']
+
+NUMERIC_DTYPES = {
+    'Year': 'int16',
+    'Month': 'int8',
+    'Day': 'int8',
+    'Latitude': 'float64',
+    'Longitude': 'float64',
+    'target_H5_HPAI': 'int8',
+}
+
+# pixel data is kept out of the observations (see birdflu.images)
+EXCLUDED_COLUMNS = ['Image']
+
+
+def optimise_dtypes(df):
+    '''
+    Return a copy of `df` with compact numeric and categorical dtypes
+    '''
+    df = df.drop(columns=[c for c in EXCLUDED_COLUMNS if c in df.columns])
+    dtypes = {c: t for c, t in NUMERIC_DTYPES.items() if c in df.columns}
+    dtypes.update({c: 'category' for c in CATEGORICAL_COLUMNS if c in df.columns})
+    return df.astype(dtypes)
+
+
+def write_dataset(df, path=DATASET_PATH, partition_cols=PARTITION_COLUMNS):
+    '''
+    Write observations to a hive-partitioned Parquet dataset
+    ...
+
+    Arguments
+    ---------
+    df             : DataFrame
+                     Observations, e.g. the DAFM data joined with BirdWatch
+    path           : str or Path
+                     Root directory of the dataset
+    partition_cols : sequence of str
+                     Columns to partition by, ('Year',) or ('Year', 'County')
+
+    Returns
+    -------
+    path           : Path
+                     Root directory of the dataset
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = Path(path)
+    df = optimise_dtypes(df)
+    # partition values live in the directory names, plain values keep them readable
+    df = df.astype({c: str for c in partition_cols if isinstance(df[c].dtype, pd.CategoricalDtype)})
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if path.exists():
+        table = _conform(table, path, partition_cols)
+    pq.write_to_dataset(table, path, partition_cols=list(partition_cols),
+                        existing_data_behavior='delete_matching')
+    return path
+
+
+def _conform(table, path, partition_cols):
+    # partitions added to an existing dataset keep its columns and types,
+    # missing columns are null; extra ones would be lost, so they are refused
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    schema = ds.dataset(path, format='parquet', partitioning='hive').schema
+    extra = [name for name in table.column_names if name not in schema.names]
+    if extra:
+        raise ValueError(f'{path} has no column {", ".join(extra)}: rewrite the whole dataset to add them')
+    columns = []
+    for field in schema:
+        if field.name in partition_cols:
+            column = table.column(field.name)
+        elif field.name not in table.column_names:
+            column = pa.nulls(len(table), field.type)
+        else:
+            column = table.column(field.name)
+            if pa.types.is_dictionary(field.type) and not pa.types.is_dictionary(column.type):
+                column = column.cast(field.type.value_type).dictionary_encode()
+            column = column.cast(field.type)
+        columns.append(column)
+    return pa.table(columns, names=schema.names)
+
+
+def _read(path, columns, expression):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    table = ds.dataset(Path(path), format='parquet', partitioning='hive').to_table(columns=columns,
+                                                                                filter=expression)
+    df = table.to_pandas()
+    # integers with nulls keep a nullable dtype instead of becoming floats
+    for field in table.schema:
+        if pa.types.is_integer(field.type) and table.column(field.name).null_count:
+            kind = 'UInt' if pa.types.is_unsigned_integer(field.type) else 'Int'
+            nullable = {field.type: pd.api.types.pandas_dtype(f'{kind}{field.type.bit_width}')}
+            df[field.name] = table.select([field.name]).to_pandas(types_mapper=nullable.get)[field.name]
+    return df
+
+
+@traced()
+def load_dataset(path=DATASET_PATH, columns=None, filters=None):
+    '''
+    Load observations from the partitioned dataset
+    ...
+
+    Arguments
+    ---------
+    path    : str, Path or list of them
+              Root directory of the dataset, or of several datasets with
+              the same columns to read together (e.g. the DAFM observations
+              and `birdflu.lab_results.LAB_DATASET_PATH`)
+    columns : list of str, optional
+              Columns to read. Defaults to all of them.
+    filters : list of tuple, optional
+              Predicates in `pyarrow.parquet` DNF form, e.g.
+              [('Year', '==', 2015), ('target_H5_HPAI', '==', 1)]. Predicates
+              on partition columns skip whole directories, the others skip
+              row groups using the Parquet statistics.
+
+    Returns
+    -------
+    df      : DataFrame
+              Selected observations with the store's dtypes
+    '''
+    import pyarrow.parquet as pq
+
+    paths = [path] if isinstance(path, (str, Path)) else list(path)
+    expression = pq.filters_to_expression(filters) if filters else None
+    frames = [_read(p, columns, expression) for p in paths]
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    df = df.astype({c: t for c, t in NUMERIC_DTYPES.items() if c in df.columns})
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            # filtered reads keep the dictionary of the whole dataset
+            df[column] = df[column].astype('category').cat.remove_unused_categories()
+    return df
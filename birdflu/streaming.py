@@ -0,0 +1,246 @@
+"""
+Out-of-core aggregation of raw surveillance extracts.
+
+Extracts are read in chunks sized to fit a memory budget. Each chunk is
+joined with the BirdWatch Ireland species (species matched by birdflu.species)
+and folded into mergeable partial aggregates:
+
+- a CountCube of the observation dimensions (counts, per-month and per-county
+  tallies)
+- optionally, the bird counts of every administrative area
+
+so memory stays bounded by the chunk and the size of the aggregates, never by
+the extract. Partial aggregates of separate extracts or workers are combined
+with `merge`:
+
+    python -m birdflu.streaming extract-2020.csv extract-2021.csv --memory 256MB
+"""
+import argparse
+import os
+import re
+
+import pandas as pd
+
+from birdflu.cube import DIMENSIONS, CountCube
+from birdflu.species import MAX_EDITS, SYNONYMS, SpeciesIndex, warn_unmatched
+from birdflu.stages import join_birdwatch
+
+MEMORY_BUDGET = 512 * 2 ** 20
+
+# share of the budget a raw chunk may take: the species join, the points of
+# the spatial join and the aggregates need the rest
+CHUNK_SHARE = 0.25
+
+SAMPLE_ROWS = 1000
+
+UNITS = {'': 1, 'B': 1, 'K': 2 ** 10, 'KB': 2 ** 10, 'M': 2 ** 20, 'MB': 2 ** 20, 'G': 2 ** 30, 'GB': 2 ** 30}
+
+
+def parse_size(size):
+    '''
+    Bytes of a size such as 512 * 2**20, '512MB' or '2G'
+    '''
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.fullmatch(r'\s*([\d.]+)\s*([A-Za-z]*)\s*', size)
+    if match is None or match.group(2).upper() not in UNITS:
+        raise ValueError(f'Not a size: {size!r}')
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+
+def _frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class PartialAggregate:
+    '''
+    Mergeable aggregates of the observations seen so far
+    ...
+
+    Arguments
+    ---------
+    dimensions  : list of str
+                  Dimensions of the count cube
+    areas       : GeoDataFrame, optional
+                  Areas to count the birds of, by `by`
+    by          : list of str, optional
+                  Dimensions breaking the area counts down, e.g. ['Year', 'Month']
+
+    Attributes
+    ----------
+    cube        : CountCube
+                  Counts by `dimensions`
+    area_counts : DataFrame
+                  Output of `count_birds_by_area(areas, ..., by)`, summed
+    rows        : int
+                  Number of observations folded in
+    chunks      : int
+                  Number of chunks folded in
+    '''
+
+    def __init__(self, dimensions=DIMENSIONS, areas=None, by=None):
+        self.dimensions = list(dimensions)
+        self.areas = areas
+        self.by = [by] if isinstance(by, str) else by
+        self.cube = CountCube(pd.DataFrame(columns=self.dimensions + ['count']))
+        self.area_counts = None
+        self.rows = 0
+        self.chunks = 0
+
+    def update(self, observations):
+        '''
+        Fold a chunk of observations into the aggregates
+        '''
+        parts = [self.cube] if self.chunks else []
+        self.cube = CountCube.concat(parts + [CountCube.from_frame(observations, self.dimensions)])
+
+        if self.areas is not None:
+            from birdflu.geometry import points_from_frame
+            from birdflu.spatial import count_birds_by_area
+
+            located = observations.dropna(subset=['Latitude', 'Longitude'])
+            counts = count_birds_by_area(self.areas, points_from_frame(located), by=self.by)
+            self.area_counts = self._add_counts(self.area_counts, counts)
+
+        self.rows += len(observations)
+        self.chunks += 1
+        return self
+
+    @staticmethod
+    def _add_counts(a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return pd.concat([a, b]).groupby(level=list(range(a.index.nlevels)), sort=True).sum()
+
+    def merge(self, other):
+        '''
+        Combine with the aggregates of other chunks, extracts or workers
+        '''
+        merged = PartialAggregate(self.dimensions, self.areas, self.by)
+        merged.cube = CountCube.concat([self.cube, other.cube])
+        merged.area_counts = self._add_counts(self.area_counts, other.area_counts)
+        merged.rows = self.rows + other.rows
+        merged.chunks = self.chunks + other.chunks
+        return merged
+
+    def nbytes(self):
+        size = _frame_bytes(self.cube.counts)
+        return size + (_frame_bytes(self.area_counts) if self.area_counts is not None else 0)
+
+
+def read_chunks(path, memory_budget=MEMORY_BUDGET, usecols=None, encoding='latin-1'):
+    '''
+    Read a CSV extract in chunks of at most `CHUNK_SHARE * memory_budget` bytes
+    ...
+
+    The chunk size is estimated from the first rows and adjusted after every
+    chunk to the memory it actually took.
+
+    Arguments
+    ---------
+    path          : str or Path
+                    CSV extract (the DAFM .xls files are CSV)
+    memory_budget : int or str
+                    Memory budget, e.g. '512MB'
+    usecols       : list of str, optional
+                    Columns to read, all by default
+    encoding      : str
+                    Encoding of the extract
+
+    Yields
+    ------
+    chunk         : DataFrame
+    '''
+    target = parse_size(memory_budget) * CHUNK_SHARE
+    sample = pd.read_csv(path, encoding=encoding, usecols=usecols, nrows=SAMPLE_ROWS)
+    if sample.empty:
+        return
+    rows = max(int(target * len(sample) / _frame_bytes(sample)), 1)
+
+    with pd.read_csv(path, encoding=encoding, usecols=usecols, iterator=True) as reader:
+        while True:
+            try:
+                chunk = reader.get_chunk(rows)
+            except StopIteration:
+                return
+            yield chunk
+            rows = max(int(target * len(chunk) / max(_frame_bytes(chunk), 1)), 1)
+
+
+def aggregate_extracts(paths, birdwatch=None, synonyms=SYNONYMS, max_edits=MAX_EDITS, areas=None, by=None,
+                       dimensions=DIMENSIONS, memory_budget=MEMORY_BUDGET):
+    '''
+    Stream raw extracts into partial aggregates within a memory budget
+    ...
+
+    Arguments
+    ---------
+    paths         : str, Path or list of them
+                    Raw CSV extracts with the columns of the DAFM data set
+    birdwatch     : DataFrame, optional
+                    BirdWatch Ireland species joined to every chunk, needed
+                    when `dimensions` include their columns (e.g. Bird_Family)
+    synonyms      : dict
+                    Former binomials and their accepted binomial, used to
+                    match the species of the join (see birdflu.species)
+    max_edits     : int
+                    Most typos in the epithet of a fuzzy species match
+    areas         : GeoDataFrame, optional
+                    Areas to count the birds of
+    by            : str or list of str, optional
+                    Dimensions breaking the area counts down
+    dimensions    : list of str
+                    Dimensions of the count cube
+    memory_budget : int or str
+                    Memory budget, e.g. '512MB'
+
+    Returns
+    -------
+    aggregate     : PartialAggregate
+    '''
+    paths = [paths] if isinstance(paths, (str, os.PathLike)) else list(paths)
+    budget = parse_size(memory_budget)
+
+    # only read the columns the aggregates need
+    birdwatch_columns = set() if birdwatch is None else set(birdwatch.columns)
+    by = [by] if isinstance(by, str) else list(by or [])
+    needed = {'Scientific_Name'} | (set(dimensions) | set(by)) - birdwatch_columns
+    if areas is not None:
+        needed |= {'Latitude', 'Longitude', 'target_H5_HPAI'}
+
+    # the species names are indexed once, and resolved once over all chunks
+    index = None if birdwatch is None else SpeciesIndex(birdwatch['Scientific_Name'], synonyms, max_edits)
+    aggregate = PartialAggregate(dimensions, areas, by or None)
+    for path in paths:
+        for chunk in read_chunks(path, budget, usecols=lambda c: c in needed):
+            if index is not None:
+                chunk = join_birdwatch(chunk, birdwatch, index=index)
+            aggregate.update(chunk)
+            if aggregate.nbytes() > budget * (1 - CHUNK_SHARE):
+                raise MemoryError(f'The aggregates take {aggregate.nbytes() / 2 ** 20:.1f} MB, '
+                                  f'over the {budget / 2 ** 20:.1f} MB budget: use fewer dimensions')
+    if index is not None:
+        warn_unmatched(index.unmatched, 'the BirdWatch Ireland species')
+    return aggregate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='raw CSV extracts')
+    parser.add_argument('--birdwatch', help='pickled BirdWatch Ireland species to join')
+    parser.add_argument('--memory', default='512MB', help='memory budget (default: 512MB)')
+    parser.add_argument('--dimensions', nargs='+', default=DIMENSIONS, help='dimensions of the count cube')
+    parser.add_argument('--output', default='data/bird-flu-cube.parquet', help='where to save the count cube')
+    args = parser.parse_args(argv)
+
+    birdwatch = pd.read_pickle(args.birdwatch) if args.birdwatch else None
+    aggregate = aggregate_extracts(args.paths, birdwatch, dimensions=args.dimensions, memory_budget=args.memory)
+    aggregate.cube.save(args.output)
+    print(f'{aggregate.rows} observations in {aggregate.chunks} chunks, '
+          f'{len(aggregate.cube.counts)} cells written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
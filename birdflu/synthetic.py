@@ -0,0 +1,190 @@
+"""
+Synthetic surveillance data calibrated on data/bird_flu.csv.
+
+The model learns, with additive smoothing towards the marginals:
+
+- the joint distribution of Year and Month
+- the species given the month (seasonality of each species)
+- the capture site (Locality with its County, State and coordinates) given
+  the species
+- the H5 HPAI rate given the species and the month, shrunk towards the rate
+  of the species and the overall rate
+- the capture times
+
+and samples schema-identical observations from it, vectorized and in chunks
+streamed to CSV or Parquet, reproducibly for a given seed and chunk size:
+
+    python -m birdflu.synthetic --rows 10000000 --seed 42 --output data/synthetic-10M.csv
+"""
+import argparse
+import calendar
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SOURCE_PATH = Path('data/bird_flu.csv')
+
+COLUMNS = ['Scientific_Name', 'Common_Name', 'Date', 'Year', 'Month', 'Day', 'Time', 'Country',
+           'Country_State_County', 'State', 'County', 'Locality', 'Latitude', 'Longitude', 'Parent_Species',
+           'target_H5_HPAI']
+SPECIES_COLUMNS = ['Scientific_Name', 'Common_Name', 'Parent_Species']
+SITE_COLUMNS = ['Country', 'Country_State_County', 'State', 'County', 'Locality', 'Latitude', 'Longitude']
+
+CHUNK_SIZE = 1_000_000
+
+# zero-padded days and months of the dd/mm/YYYY dates
+_PADDED = np.array([f'{i:02d}' for i in range(32)], dtype=object)
+
+
+def _codes(df, columns):
+    # distinct rows of `columns` and the code of every row of `df`
+    codes = df.groupby(columns, dropna=False, sort=False).ngroup().to_numpy()
+    return codes, df[columns].drop_duplicates().reset_index(drop=True)
+
+
+def _conditional(condition, outcome, n_conditions, n_outcomes, smoothing):
+    # cumulative P(outcome | condition), smoothed towards P(outcome)
+    counts = np.zeros((n_conditions, n_outcomes))
+    np.add.at(counts, (condition, outcome), 1)
+    marginal = counts.sum(axis=0) / counts.sum()
+    probabilities = (counts + smoothing * marginal) / (counts.sum(axis=1, keepdims=True) + smoothing)
+    return np.cumsum(probabilities, axis=1)
+
+
+def _sample(rng, cdf, condition):
+    # one outcome per row of `condition`, drawn from the cumulative rows of `cdf`
+    n_outcomes = cdf.shape[1]
+    flat = (cdf + np.arange(len(cdf))[:, None]).ravel()
+    index = np.searchsorted(flat, rng.random(len(condition)) + condition, side='right')
+    return np.minimum(index - condition * n_outcomes, n_outcomes - 1)
+
+
+class SurveillanceModel:
+    '''
+    Generative model of the DAFM wild bird observations
+    ...
+
+    Arguments
+    ---------
+    df         : DataFrame
+                 Observations with the columns of data/bird_flu.csv
+    smoothing  : float
+                 Pseudo-observations pulling every conditional distribution
+                 (and infection rate) towards its marginal, so combinations
+                 unseen in `df` still occur, rarely
+    jitter     : float
+                 Standard deviation, in degrees, of the noise added to the
+                 coordinates of the capture sites; 0 keeps them exact
+    '''
+
+    def __init__(self, df, smoothing=1.0, jitter=0.0):
+        self.columns = [c for c in COLUMNS if c in df.columns]
+        self.jitter = jitter
+
+        species, self.species = _codes(df, SPECIES_COLUMNS)
+        site, self.sites = _codes(df, SITE_COLUMNS)
+        period, self.periods = _codes(df, ['Year', 'Month'])
+        month = df['Month'].to_numpy() - 1
+        infected = df['target_H5_HPAI'].to_numpy()
+
+        self.period_cdf = np.cumsum(np.bincount(period) / len(period))[None, :]
+        self.period_days = np.array([calendar.monthrange(y, m)[1] for y, m in self.periods.itertuples(index=False)])
+        self.species_cdf = _conditional(month, species, 12, len(self.species), smoothing)
+        self.site_cdf = _conditional(species, site, len(self.species), len(self.sites), smoothing)
+
+        # infection rate by species and month, shrunk towards the species' rate
+        overall = infected.mean()
+        totals = np.zeros((len(self.species), 12))
+        cases = np.zeros((len(self.species), 12))
+        np.add.at(totals, (species, month), 1)
+        np.add.at(cases, (species, month), infected)
+        species_rate = (cases.sum(axis=1) + smoothing * overall) / (totals.sum(axis=1) + smoothing)
+        self.infection_rate = (cases + smoothing * species_rate[:, None]) / (totals + smoothing)
+
+        times, counts = np.unique(df['Time'].to_numpy(), return_counts=True)
+        self.times, self.time_cdf = times, np.cumsum(counts / counts.sum())[None, :]
+
+    @classmethod
+    def fit(cls, path=SOURCE_PATH, encoding='latin-1', **kwargs):
+        return cls(pd.read_csv(path, encoding=encoding), **kwargs)
+
+    def sample(self, n, rng):
+        '''
+        `n` observations drawn with the numpy Generator `rng`
+        '''
+        zeros = np.zeros(n, dtype=np.intp)
+        period = _sample(rng, self.period_cdf, zeros)
+        year = self.periods['Year'].to_numpy()[period]
+        month = self.periods['Month'].to_numpy()[period]
+
+        species = _sample(rng, self.species_cdf, month - 1)
+        site = _sample(rng, self.site_cdf, species)
+        day = 1 + (rng.random(n) * self.period_days[period]).astype(np.int64)
+
+        df = pd.concat([self.species.iloc[species].reset_index(drop=True),
+                        self.sites.iloc[site].reset_index(drop=True)], axis=1)
+        if self.jitter:
+            df['Latitude'] += rng.normal(0, self.jitter, n)
+            df['Longitude'] += rng.normal(0, self.jitter, n)
+        df['Year'] = year
+        df['Month'] = month
+        df['Day'] = day
+        df['Date'] = _PADDED[day] + '/' + _PADDED[month] + '/' + year.astype(str).astype(object)
+        df['Time'] = self.times[_sample(rng, self.time_cdf, zeros)]
+        df['target_H5_HPAI'] = (rng.random(n) < self.infection_rate[species, month - 1]).astype(np.int64)
+        return df[self.columns]
+
+    def generate(self, n_rows, seed=None, chunk_size=CHUNK_SIZE):
+        '''
+        Chunks of `n_rows` observations in total, each drawn from its own
+        stream spawned from `seed`
+        '''
+        n_chunks = -(-n_rows // chunk_size)
+        for i, child in enumerate(np.random.SeedSequence(seed).spawn(n_chunks)):
+            yield self.sample(min(chunk_size, n_rows - i * chunk_size), np.random.default_rng(child))
+
+    def write(self, path, n_rows, seed=None, chunk_size=CHUNK_SIZE, encoding='latin-1'):
+        '''
+        Stream `n_rows` observations to a CSV or Parquet (by extension) file
+        '''
+        path = Path(path)
+        if path.suffix == '.parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            writer = None
+            try:
+                for chunk in self.generate(n_rows, seed, chunk_size):
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(path, table.schema)
+                    writer.write_table(table)
+            finally:
+                if writer is not None:
+                    writer.close()
+            return path
+
+        with open(path, 'w', encoding=encoding, newline='') as f:
+            for i, chunk in enumerate(self.generate(n_rows, seed, chunk_size)):
+                chunk.to_csv(f, header=i == 0, index=False)
+        return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, required=True, help='number of observations to generate')
+    parser.add_argument('--output', required=True, help='CSV or .parquet file to write')
+    parser.add_argument('--seed', type=int, default=12345)
+    parser.add_argument('--source', default=str(SOURCE_PATH), help='observations the model is calibrated on')
+    parser.add_argument('--smoothing', type=float, default=1.0)
+    parser.add_argument('--jitter', type=float, default=0.0, help='noise on the coordinates, in degrees')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    model = SurveillanceModel.fit(args.source, smoothing=args.smoothing, jitter=args.jitter)
+    print(model.write(args.output, args.rows, args.seed, args.chunk_size))
+
+
+if __name__ == '__main__':
+    main()
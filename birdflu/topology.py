@@ -0,0 +1,107 @@
+"""
+Disk-backed cache of quantized and simplified TopoJSON topologies.
+
+Results are stored as TopoJSON under a key made of the SHA-256 of the source
+file, the quantization factor and, for simplified topologies, the epsilon and
+algorithm. A cached topology is parsed back through the `topojson` shortcut
+for TopoJSON input, which skips the topology computation entirely.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from birdflu.tracing import traced
+
+CACHE_PATH = Path('data/topology-cache')
+
+# `vw` is only available through the `simplification` package
+SIMPLIFY_WITH = {'dp': 'shapely', 'vw': 'simplification'}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    '''
+    SHA-256 hex digest of a file's content
+    '''
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_topology(path, object_name='data'):
+    '''
+    Parse a TopoJSON file using `object_name`
+    '''
+    import topojson as tp
+
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return tp.Topology(data, object_name=object_name)
+
+
+def _cached(cache_dir, key, object_name, compute):
+    cache_dir = Path(cache_dir)
+    name = hashlib.sha256(json.dumps(key).encode()).hexdigest()
+    cache_file = cache_dir / f'{name}.json'
+
+    if cache_file.exists():
+        return load_topology(cache_file, object_name)
+
+    topo = compute()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = cache_file.with_name(cache_file.name + '.tmp')
+    with open(tmp, 'w') as f:
+        f.write(topo.to_json())
+    os.replace(tmp, cache_file)
+    return topo
+
+
+@traced()
+def quantized_topology(path, quantization=200, object_name='data', cache_dir=CACHE_PATH):
+    '''
+    Topology of `path` quantized with `topoquantize(quantization)`, cached on disk
+    '''
+    key = ['topoquantize', file_digest(path), quantization, object_name]
+    return _cached(cache_dir, key, object_name,
+                   lambda: load_topology(path, object_name).topoquantize(quantization))
+
+
+@traced()
+def simplified_topology(path, quantization=200, epsilon=0.001, algorithm='dp',
+                        object_name='data', cache_dir=CACHE_PATH):
+    '''
+    Quantized and simplified topology of `path`, cached on disk
+    ...
+
+    Arguments
+    ---------
+    path         : str or Path
+                   TopoJSON file
+    quantization : int
+                   Quantization factor passed to `topoquantize`
+    epsilon      : float
+                   Simplification tolerance passed to `toposimplify`
+    algorithm    : str
+                   'dp' for Douglas-Peucker or 'vw' for Visvalingam-Whyatt
+    object_name  : str
+                   Name of the object in the TopoJSON file
+    cache_dir    : str or Path
+                   Directory holding the cached topologies
+
+    Returns
+    -------
+    topo         : topojson.Topology
+                   Simplified topology, computed only on a cache miss
+    '''
+    key = ['toposimplify', file_digest(path), quantization, epsilon, algorithm, object_name]
+
+    def compute():
+        return quantized_topology(path, quantization, object_name, cache_dir).toposimplify(
+            epsilon=epsilon,
+            simplify_with=SIMPLIFY_WITH[algorithm],
+            simplify_algorithm=algorithm
+        )
+
+    return _cached(cache_dir, key, object_name, compute)
@@ -0,0 +1,294 @@
+"""
+Per-stage tracing: wall time, CPU time, memory and row counts.
+
+Stages are wrapped in `span` blocks or decorated with `traced`. Tracing is
+off unless `enable()` is called or the BIRDFLU_TRACE environment variable
+names where to export the trace on exit, e.g.
+
+    BIRDFLU_TRACE=reports/run python -m birdflu.report ...
+
+writes reports/run.json (one record per span) and reports/run.trace.json,
+which chrome://tracing or https://ui.perfetto.dev show as a flame chart.
+When off, `span` returns a shared no-op context manager and `traced`
+functions cost one flag check per call.
+
+On Linux the peak RSS of a span is its own: the watermark is reset on entry
+through /proc/self/clear_refs, so while tracing is enabled the VmHWM and
+ru_maxrss of the process only cover the latest spans, and whatever else
+reads them (e.g. the benchmarks) should not run traced. Elsewhere the peak
+RSS is that of the process so far (`peak_rss_mb`), and the current RSS,
+read from /proc, is not recorded.
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+ENV_VAR = 'BIRDFLU_TRACE'
+
+_enabled = False
+_events = []
+_lock = threading.Lock()
+_local = threading.local()
+_null = nullcontext()
+# spans open in any thread: the watermark is per process, so resetting it for
+# one span first folds the peak so far into all of them
+_open = set()
+
+
+def _rss_mb():
+    # current resident set size, Linux only
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb(maxrss=None):
+    '''
+    Peak resident set size of this process so far in MB, or of the
+    `ru_maxrss` given (e.g. read in a child process); None on Windows
+    '''
+    if maxrss is None:
+        if resource is None:
+            return None
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux and the BSDs
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return maxrss * unit / 2 ** 20
+
+
+def _hwm_mb():
+    # peak resident set size since the last `_reset_hwm`, Linux only
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_hwm():
+    # lower the watermark to the current resident set size (Linux >= 4.0)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.rows = None
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        with _lock:
+            hwm = _hwm_mb()
+            for span in _open:
+                span.peak = max(span.peak, hwm or 0.0)
+            self.peak = 0.0
+            self.reset = _reset_hwm()
+            _open.add(self)
+        self.rss = _rss_mb()
+        self.timestamp = time.time_ns() // 1000
+        self.cpu = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu
+        rss = _rss_mb()
+        with _lock:
+            _open.discard(self)
+            hwm = _hwm_mb() if self.reset else None
+        peak = peak_rss_mb() if hwm is None else max(self.peak, hwm)
+        _local.stack.pop()
+        event = {
+            'name': self.name,
+            'parent': self.parent,
+            'start_us': self.timestamp,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'rss_mb': rss,
+            'rss_delta_mb': None if rss is None or self.rss is None else rss - self.rss,
+            'peak_rss_mb': peak,
+            'rows': self.rows,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': self.args,
+        }
+        if exc[0] is not None:
+            event['error'] = exc[0].__name__
+        with _lock:
+            _events.append(event)
+        return False
+
+
+def enabled():
+    return _enabled
+
+
+def enable(path=None):
+    '''
+    Start recording spans; with `path`, export them there when the process exits
+    '''
+    global _enabled
+    _enabled = True
+    if path is not None:
+        pid = os.getpid()
+        # processes forked or spawned from this one record, but don't export
+        os.environ[ENV_VAR] = str(path)
+        os.environ[ENV_VAR + '_PID'] = str(pid)
+        atexit.register(lambda: os.getpid() == pid and export(path))
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def span(name, **args):
+    '''
+    Context manager timing the block as stage `name`; set `.rows` on the
+    object it returns to record a row count
+    '''
+    if not _enabled:
+        return _null
+    return Span(name, args)
+
+
+def _count_rows(*values):
+    # rows of the first value with a shape (DataFrame, array)
+    for value in values:
+        shape = getattr(value, 'shape', None)
+        if shape is not None and len(shape):
+            return int(shape[0])
+    return None
+
+
+def traced(name=None):
+    '''
+    Decorator recording a span per call, with the rows of the result, or of
+    the first argument, having a shape (DataFrame, array)
+    '''
+    def decorator(func):
+        stage = name or f'{func.__module__.rpartition(".")[2]}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(stage, {}) as s:
+                result = func(*args, **kwargs)
+                s.rows = _count_rows(result, *args)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def drain():
+    '''
+    Remove and return the recorded events, e.g. to ship them from a worker
+    process back to the parent
+    '''
+    with _lock:
+        events = list(_events)
+        _events.clear()
+    return events
+
+
+def extend(events):
+    '''
+    Add events recorded elsewhere (see `drain`)
+    '''
+    with _lock:
+        _events.extend(events)
+
+
+def events():
+    with _lock:
+        return list(_events)
+
+
+def summary():
+    '''
+    Calls, total wall and CPU seconds, largest peak RSS and rows by stage,
+    slowest first
+    '''
+    stages = {}
+    for event in events():
+        stage = stages.setdefault(event['name'], {'name': event['name'], 'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                                  'peak_rss_mb': None, 'rows': None})
+        stage['calls'] += 1
+        stage['wall_s'] += event['wall_s']
+        stage['cpu_s'] += event['cpu_s']
+        if event['peak_rss_mb'] is not None:
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'] or 0.0, event['peak_rss_mb'])
+        if event['rows'] is not None:
+            stage['rows'] = (stage['rows'] or 0) + event['rows']
+    return sorted(stages.values(), key=lambda stage: -stage['wall_s'])
+
+
+def chrome_trace(events):
+    '''
+    Events in the Chrome trace event format: a complete ('X') event per span
+    and an RSS counter ('C') per process
+    '''
+    trace = []
+    for event in events:
+        args = {k: event[k] for k in ['cpu_s', 'rss_mb', 'rss_delta_mb', 'peak_rss_mb', 'rows', 'parent']
+                if event[k] is not None}
+        args.update(event['args'])
+        trace.append({'name': event['name'], 'cat': 'stage', 'ph': 'X', 'ts': event['start_us'],
+                      'dur': int(event['wall_s'] * 1e6), 'pid': event['pid'], 'tid': event['tid'],
+                      'args': args})
+        if event['rss_mb'] is not None:
+            trace.append({'name': 'RSS (MB)', 'ph': 'C', 'ts': event['start_us'] + int(event['wall_s'] * 1e6),
+                          'pid': event['pid'], 'args': {'rss': round(event['rss_mb'], 1)}})
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+def export(path):
+    '''
+    Write the spans to `path`.json and their Chrome trace to `path`.trace.json
+    '''
+    base = Path(path).with_suffix('') if Path(path).suffix == '.json' else Path(path)
+    base.parent.mkdir(parents=True, exist_ok=True)
+    recorded = events()
+    with open(base.with_name(base.name + '.json'), 'w') as f:
+        json.dump({'spans': recorded, 'summary': summary()}, f, indent=1, default=str)
+    with open(base.with_name(base.name + '.trace.json'), 'w') as f:
+        json.dump(chrome_trace(recorded), f, default=str)
+    return base.with_name(base.name + '.json'), base.with_name(base.name + '.trace.json')
+
+
+if os.environ.get(ENV_VAR):
+    if os.environ.get(ENV_VAR + '_PID', str(os.getpid())) == str(os.getpid()):
+        enable(os.environ[ENV_VAR])
+    else:
+        enable()
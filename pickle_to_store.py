@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+
+from birdflu.images import ImageStore
+from birdflu.store import write_dataset
+
+# one-off migration of the legacy pickle into the partitioned columnar store
+bird_flu = pd.read_pickle("./data/bird-flu.pkl")
+
+# images were repeated on every observation, keep one per species
+images = ImageStore()
+species = bird_flu.drop_duplicates(subset='Scientific_Name')
+keys = {row.Scientific_Name: images.add(row.Image, names=[row.Common_Name, row.Scientific_Name, row.Bird_Name])
+        for row in species.itertuples() if isinstance(row.Image, np.ndarray)}
+images.save()
+
+bird_flu['Image_Key'] = bird_flu['Scientific_Name'].map(keys)
+write_dataset(bird_flu)
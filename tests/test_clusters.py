@@ -0,0 +1,63 @@
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+from birdflu.clusters import RADIUS, TILE_SIZE, ClusterIndex, mercator
+
+
+def _tiles(directory):
+    return sorted(str(p.relative_to(directory)) for p in directory.rglob('*.json'))
+
+
+def test_rewrite_leaves_no_stale_tiles(tmp_path):
+    ClusterIndex([-6.26, -6.3], [53.35, 53.4], max_zoom=8).write(tmp_path / 'tiles')
+    index = ClusterIndex([-9.7, -9.5], [52.1, 52.0], max_zoom=8)
+    written = index.write(tmp_path / 'tiles')
+    index.write(tmp_path / 'fresh')
+    assert written == len(_tiles(tmp_path / 'tiles'))
+    assert _tiles(tmp_path / 'tiles') == _tiles(tmp_path / 'fresh')
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['fresh', 'tiles']
+
+
+def test_counts_add_up_at_every_zoom(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 2000
+    lon, lat = rng.uniform(-10, -6, n), rng.uniform(51.5, 55, n)
+    infected = rng.random(n) < 0.1
+    species = rng.choice(['Mute Swan', 'Mallard', 'Herring Gull'], n)
+    index = ClusterIndex(lon, lat, infected, species, max_zoom=10)
+    index.write(tmp_path / 'tiles')
+
+    totals = {name: (species == name).sum() for name in index.species_names}
+    for zoom in range(index.min_zoom, index.max_zoom + 2):
+        level = index.levels[zoom]
+        assert level['count'].sum() == n and level['infected'].sum() == infected.sum()
+        assert dict(zip(index.species_names, index.species[zoom].sum(axis=0).A1)) == totals
+        if zoom > index.min_zoom:
+            # every cluster holds the birds of the clusters it absorbed at the level above
+            above = level.groupby('parent')[['count', 'infected']].sum()
+            below = index.levels[zoom - 1]
+            assert (above['count'].to_numpy() == below['count'].to_numpy()).all()
+            assert (above['infected'].to_numpy() == below['infected'].to_numpy()).all()
+
+        records = [r for path in (tmp_path / 'tiles' / str(zoom)).rglob('*.json') for r in json.loads(path.read_text())]
+        assert len(records) == len(level) and sum(r[2] for r in records) == n
+
+
+def test_sites_merge_once_within_the_radius():
+    # two capture sites, 10 and 4 birds, merge at the zooms where they are within RADIUS pixels
+    lon, lat = np.r_[np.full(10, -8.0), np.full(4, -7.9)], np.full(14, 53.0)
+    index = ClusterIndex(lon, lat, min_zoom=3, max_zoom=12)
+    x, _ = mercator([-8.0, -7.9], [53.0, 53.0])
+    for zoom in range(3, 13):
+        apart = (x[1] - x[0]) * TILE_SIZE * 2 ** zoom > RADIUS
+        assert sorted(index.levels[zoom]['count']) == ([4, 10] if apart else [14])
+    assert sorted(index.levels[13]['count']) == [4, 10]
+
+
+def test_folium_is_loaded_on_first_use():
+    code = ('import sys, birdflu.clusters as c; assert "branca" not in sys.modules; '
+            'assert c.ClusterLayer is c.ClusterLayer; assert "branca" in sys.modules')
+    subprocess.run([sys.executable, '-c', code], check=True)
@@ -0,0 +1,39 @@
+import geopandas as gpd
+import libpysal as lps
+import pytest
+import shapely
+import topojson as tp
+
+from birdflu.contiguity import contiguity_matrix, contiguity_weights
+
+
+def _topology(polygons, prequantize=False):
+    return tp.Topology(gpd.GeoDataFrame(geometry=polygons), prequantize=prequantize).to_dict()
+
+
+@pytest.mark.parametrize('prequantize', [False, 1e5])
+def test_corner_touch_is_queen_not_rook(prequantize):
+    topology = _topology([shapely.box(0, 0, 1, 1), shapely.box(1, 1, 2, 2)], prequantize)
+    assert contiguity_matrix(topology, kind='queen').toarray().tolist() == [[0, 1], [1, 0]]
+    assert contiguity_matrix(topology, kind='rook').nnz == 0
+
+
+@pytest.mark.parametrize('kind', ['queen', 'rook'])
+@pytest.mark.parametrize('prequantize', [False, 1e5])
+def test_matches_libpysal(kind, prequantize):
+    # a grid with a missing cell and a diamond touching four cells at their corners
+    polygons = [shapely.box(i, j, i + 1, j + 1) for i in range(4) for j in range(4) if (i, j) != (1, 1)]
+    polygons.append(shapely.Polygon([(6, 2), (7, 3), (6, 4), (5, 3)]))
+    polygons.append(shapely.box(7, 3, 8, 4))
+    frame = gpd.GeoDataFrame(geometry=polygons)
+    expected = getattr(lps.weights, kind.title()).from_dataframe(frame, use_index=False, silence_warnings=True)
+    matrix = contiguity_matrix(_topology(polygons, prequantize), kind=kind)
+    assert (matrix != expected.sparse).nnz == 0
+
+
+def test_weights_are_cached(tmp_path):
+    topology = _topology([shapely.box(0, 0, 1, 1), shapely.box(1, 0, 2, 1), shapely.box(3, 0, 4, 1)])
+    w = contiguity_weights(topology, ids=['a', 'b', 'c'], cache_dir=tmp_path)
+    assert len(list(tmp_path.glob('queen-*.npz'))) == 1
+    assert contiguity_weights(topology, ids=['a', 'b', 'c'], cache_dir=tmp_path).neighbors == w.neighbors
+    assert w.neighbors == {'a': ['b'], 'b': ['a'], 'c': []}
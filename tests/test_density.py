@@ -0,0 +1,61 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+from birdflu.density import TILE_SIZE, DensitySurface
+
+
+def _tiles(directory):
+    return sorted(str(p.relative_to(directory)) for p in directory.rglob('*.png'))
+
+
+def test_rewrite_leaves_no_stale_tiles(tmp_path):
+    dublin = DensitySurface.from_points([-6.26, -6.3], [53.35, 53.4], zoom=8)
+    kerry = DensitySurface.from_points([-9.7, -9.5], [52.1, 52.0], zoom=8)
+    dublin.write_tiles(tmp_path / 'tiles', min_zoom=6)
+    written = kerry.write_tiles(tmp_path / 'tiles', min_zoom=6)
+    kerry.write_tiles(tmp_path / 'fresh', min_zoom=6)
+    assert written == len(_tiles(tmp_path / 'tiles'))
+    assert _tiles(tmp_path / 'tiles') == _tiles(tmp_path / 'fresh')
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['fresh', 'tiles']
+
+
+def _global_pixel(lon, lat, zoom):
+    # standard XYZ (slippy map) pixel of a WGS84 coordinate
+    scale = TILE_SIZE * 2 ** zoom
+    x = (lon + 180) / 360 * scale
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * scale
+    return x, y
+
+
+def test_tiles_are_on_the_xyz_grid(tmp_path):
+    lon, lat = -8.47, 51.9
+    surface = DensitySurface.from_points([lon], [lat], bandwidth=5000, zoom=9)
+    surface.write_tiles(tmp_path, min_zoom=5)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['5', '6', '7', '8', '9']
+
+    for zoom in range(5, 10):
+        tiles = {}
+        for path in (tmp_path / str(zoom)).rglob('*.png'):
+            with Image.open(path) as image:
+                assert image.mode == 'RGBA' and image.size == (TILE_SIZE, TILE_SIZE)
+                tiles[int(path.parent.name), int(path.stem)] = np.asarray(image)[..., 3]
+        # the most opaque pixels of the pyramid level (clipped and quantized, so several) are
+        # centred on the point
+        top = max(alpha.max() for alpha in tiles.values())
+        peak = np.array([(tx * TILE_SIZE + col, ty * TILE_SIZE + row) for (tx, ty), alpha in tiles.items()
+                         for row, col in zip(*np.nonzero(alpha == top))])
+        assert np.abs(peak.mean(axis=0) + 0.5 - _global_pixel(lon, lat, zoom)).max() <= 0.5
+
+
+def test_coarsen_keeps_the_mass_on_the_grid():
+    surface = DensitySurface.from_points([-6.26, -9.05], [53.35, 53.27], zoom=9)
+    coarse = surface.coarsen()
+    assert coarse.zoom == 8
+    # a pixel at zoom - 1 covers 2x2 pixels at zoom, the densities average
+    assert np.isclose(coarse.values.sum() * 4, surface.values.sum())
+    col0, row0 = surface.origin
+    assert coarse.origin == (col0 // 2, row0 // 2)
+    rows, cols = surface.values.shape
+    assert coarse.values.shape == ((row0 + rows + 1) // 2 - row0 // 2, (col0 + cols + 1) // 2 - col0 // 2)
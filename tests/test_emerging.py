@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+from libpysal.weights import lat2W
+
+from birdflu.emerging import EmergingHotSpots
+
+
+def _cube(rng, months):
+    columns = pd.period_range('2020-01', periods=months, freq='M')
+    return pd.DataFrame(rng.poisson(2, (25, months)).astype(float), columns=columns)
+
+
+@pytest.mark.parametrize('time_window', [0, 1, 3])
+def test_incremental_update_matches_full_recompute(time_window):
+    rng = np.random.default_rng(0)
+    cube = _cube(rng, 12)
+    w = lat2W(5, 5)
+
+    incremental = EmergingHotSpots(w, time_window=time_window)
+    incremental.update(cube.iloc[:, :6])
+    for month in cube.columns[6:]:
+        assert list(incremental.update(cube[[month]])) == [month]
+
+    # a revised month recomputes its slice and the time_window slices after it
+    revised = cube.copy()
+    revised.iloc[3, 4] += 10
+    recomputed = incremental.update(revised.iloc[:, [4]])
+    assert list(recomputed) == list(cube.columns[4:4 + time_window + 1])
+
+    full = EmergingHotSpots(w, time_window=time_window)
+    full.update(revised)
+    pd.testing.assert_frame_equal(incremental.values, full.values)
+    np.testing.assert_allclose(incremental.z.to_numpy(dtype='float64'), full.z.to_numpy(dtype='float64'))
+    pd.testing.assert_frame_equal(incremental.classify(), full.classify())
+
+
+def test_missing_months_are_zero():
+    rng = np.random.default_rng(1)
+    cube = _cube(rng, 6)
+    w = lat2W(5, 5)
+    incremental = EmergingHotSpots(w)
+    incremental.update(cube.iloc[:, :2])
+    incremental.update(cube.iloc[:, 4:])
+
+    gapped = cube.copy()
+    gapped.iloc[:, 2:4] = 0
+    full = EmergingHotSpots(w)
+    full.update(gapped)
+    np.testing.assert_allclose(incremental.z.to_numpy(dtype='float64'), full.z.to_numpy(dtype='float64'))
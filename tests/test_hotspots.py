@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from birdflu.hotspots import LocalGStar, point_hotspots
+
+
+def _points(rng, n, infected):
+    return pd.DataFrame({'Easting': rng.uniform(0, 1e5, n), 'Northing': rng.uniform(0, 1e5, n),
+                         'target_H5_HPAI': infected.astype(np.int8)})
+
+
+def test_uniform_binary_field_is_calibrated():
+    rng = np.random.default_rng(0)
+    for rate in [0.02, 0.1, 0.5]:
+        points = _points(rng, 3000, rng.random(3000) < rate)
+        units = point_hotspots(points, permutations=999, seed=1, n_jobs=1)
+        # ties must not make points significant, about alpha of them are by chance
+        assert (units['P'] <= 0.05).mean() < 2 * 0.05
+
+
+def test_planted_cluster_is_found():
+    rng = np.random.default_rng(1)
+    points = _points(rng, 3000, np.zeros(3000, dtype=bool))
+    cluster = (points['Easting'] < 2e4) & (points['Northing'] < 2e4)
+    points.loc[cluster, 'target_H5_HPAI'] = 1
+    points.loc[rng.random(3000) < 0.05, 'target_H5_HPAI'] = 1
+    units = point_hotspots(points, permutations=999, seed=1, n_jobs=1)
+    significant = (units['P'] <= 0.05) & (units['Z'] > 0)
+    assert significant[cluster].mean() > 0.9
+    assert significant[~cluster].mean() < 0.1
+
+
+def test_all_ties_are_not_significant():
+    # every permutation of a constant neighbourhood ties with the observed G*
+    y = np.r_[np.zeros(50), np.ones(50)]
+    w = np.zeros((100, 100))
+    for i in range(0, 100, 2):
+        w[i, i + 1] = w[i + 1, i] = 1
+    g = LocalGStar(y, w, permutations=999, seed=1, n_jobs=1, ties='both')
+    assert g.p_sim.min() > 0.05
+    # counted in the upper tail as esda does, a zero paired with a zero is at the bottom of it
+    g = LocalGStar(y, w, permutations=999, seed=1, n_jobs=1)
+    assert np.allclose(g.p_sim[g.Gs == 0], 1 / 1000)
+
+
+def test_ties_are_counted_as_esda_does():
+    esda = pytest.importorskip('esda')
+    from libpysal.weights import lat2W
+    rng = np.random.default_rng(2)
+    w = lat2W(12, 12)
+    # proportions with many zeros and repeated values tie often; binary weights keep
+    # esda's sums exact, row-standardized ones break its ties by round-off
+    y = rng.choice([0, 0, 0, 0, 0.25, 0.5, 1], size=w.n)
+    expected = esda.G_Local(y, w, transform='B', star=True, permutations=9999, seed=3).p_sim
+    g = LocalGStar(y, w.full()[0], transform='B', permutations=9999, seed=3, n_jobs=1, early_stop=False)
+    # the Monte Carlo error of either is about 0.005
+    assert np.abs(g.p_sim - expected).max() < 0.03
+    assert g.p_sim.max() <= 0.5
+
+
+def test_chunks_in_flight_do_not_change_the_result():
+    rng = np.random.default_rng(3)
+    y = rng.random(200)
+    w = (rng.random((200, 200)) < 0.03).astype(float)
+    w = np.maximum(w, w.T)
+    np.fill_diagonal(w, 0)
+    serial = LocalGStar(y, w, permutations=2000, chunk_size=100, seed=4, n_jobs=1)
+    parallel = LocalGStar(y, w, permutations=2000, chunk_size=100, seed=4, n_jobs=2)
+    assert parallel.permutations == serial.permutations
+    assert np.array_equal(parallel.p_sim, serial.p_sim)
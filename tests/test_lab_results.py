@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from birdflu.lab_results import bird_ids, ingest_lab_results, to_observations
+from birdflu.store import load_dataset, write_dataset
+
+PARTS = ['Tissue-Pool', 'Intestine', 'Brain']
+
+
+def _results(events):
+    rows = [{'sampEventId': f'PV21-{event:06d}', 'sampDate': pd.Timestamp('2021-02-01'), 'sampYear': 2021,
+             'sampMonth': 2, 'sampDay': 1, 'sampArea': 'Cork', 'sampInfo_latitude': 53.0,
+             'sampInfo_longitude': -7.0, 'sampMatCode_source': species, 'sampMatCode_part': part,
+             'resQualValue': result}
+            for event, species, part, result in events]
+    return pd.DataFrame(rows).sample(frac=1, random_state=0)
+
+
+def test_sample_parts_are_one_bird():
+    results = _results(
+        [(e, 'Mute Swan', p, 'Positive' if p == 'Brain' else 'Negative') for e, p in zip(range(0, 3), PARTS)]
+        + [(e, 'Mute Swan', p, 'Negative') for e, p in zip(range(3, 6), PARTS)]
+        + [(e, 'Herring Gull', p, 'Negative') for e, p in zip(range(6, 8), PARTS)]
+        + [(e, 'Mute Swan', p, 'Negative') for e, p in zip(range(10, 13), PARTS)])
+    birds = pd.Series(bird_ids(results), index=results['sampEventId'])
+    assert sorted(birds.groupby(birds).size()) == [2, 3, 3, 3]
+    assert birds['PV21-000002'] != birds['PV21-000003']
+    assert birds['PV21-000005'] != birds['PV21-000010']
+
+    observations = to_observations(results)
+    assert len(observations) == 4
+    assert observations['target_H5_HPAI'].sum() == 1
+
+
+def test_ingest_keeps_the_observations_apart(tmp_path):
+    observations = pd.DataFrame({'Common_Name': ['Mute Swan', 'Herring Gull'], 'Scientific_Name': ['Cygnus olor',
+                                 'Larus argentatus'], 'Date': ['01/01/2020', '02/01/2020'], 'Year': 2020,
+                                 'Month': 1, 'Day': [1, 2], 'Time': [900, 1000], 'County': 'Cork', 'State': 'Munster',
+                                 'Country_State_County': 'IE-M-CO', 'Locality': 'Lough Mahon',
+                                 'target_H5_HPAI': [1, 0]})
+    write_dataset(observations, tmp_path / 'bird-flu')
+    xlsx = tmp_path / 'results.xlsx'
+    _results([(e, 'Mute Swan', p, 'Positive') for e, p in zip(range(0, 3), PARTS)]).to_excel(xlsx, index=False)
+
+    ingest_lab_results(xlsx, tmp_path / 'lab-results', cache_dir=tmp_path / 'cache', reference=tmp_path / 'bird-flu')
+    assert load_dataset(tmp_path / 'bird-flu')['Year'].tolist() == [2020, 2020]
+    both = load_dataset([tmp_path / 'bird-flu', tmp_path / 'lab-results'])
+    assert both['Year'].tolist() == [2020, 2020, 2021]
+    assert both['Time'].dtype == 'Int64' and both['Time'].isna().tolist() == [False, False, True]
+    assert both['County'].dtype == 'category' and both['State'].tolist() == ['Munster'] * 3
+
+    with pytest.raises(ValueError, match='not written to the store of the DAFM observations'):
+        ingest_lab_results(xlsx, tmp_path / 'bird-flu', cache_dir=tmp_path / 'cache', reference=tmp_path / 'bird-flu')
+    with pytest.raises(ValueError, match='has no column Extra'):
+        write_dataset(observations.assign(Year=2019, Extra=1), tmp_path / 'bird-flu')
@@ -0,0 +1,71 @@
+from birdflu.pipeline import Pipeline
+
+
+def read(path):
+    with open(path) as f:
+        return [int(line) for line in f]
+
+
+def parity(numbers):
+    return sum(numbers) % 2
+
+
+def report(bit, label):
+    return f'{label}: {bit}'
+
+
+def _pipeline(cache_dir, path, label='parity'):
+    pipeline = Pipeline(cache_dir)
+    pipeline.add('read', read, files=['path'], path=str(path))
+    pipeline.add('parity', parity, inputs=['read'])
+    pipeline.add('report', report, inputs=['parity'], label=label)
+    return pipeline
+
+
+def _ran(pipeline):
+    return sorted(name for name, (how, _) in pipeline.log.items() if how == 'computed')
+
+
+def test_stage_reruns_only_when_its_inputs_change(tmp_path):
+    path = tmp_path / 'numbers.txt'
+    path.write_text('1\n2\n')
+    cache = tmp_path / 'cache'
+
+    pipeline = _pipeline(cache, path)
+    assert pipeline.status('report') == {'read': 'missing', 'parity': 'stale', 'report': 'stale'}
+    assert pipeline.run('report') == 'parity: 1'
+    assert _ran(pipeline) == ['parity', 'read', 'report']
+
+    # nothing changed, in this process or a new one
+    assert pipeline.run('report') == 'parity: 1'
+    assert _ran(pipeline) == []
+    pipeline = _pipeline(cache, path)
+    assert pipeline.status('report') == {'read': 'cached', 'parity': 'cached', 'report': 'cached'}
+    assert pipeline.run('report') == 'parity: 1' and _ran(pipeline) == []
+
+    # new numbers (of a new size, mtimes may be coarse) but the same parity: the report is left alone
+    path.write_text('3\n40\n')
+    assert pipeline.run('report') == 'parity: 1'
+    assert _ran(pipeline) == ['parity', 'read']
+
+    # a parameter only reruns its own stage
+    pipeline.update('report', label='odd')
+    assert pipeline.run('report') == 'odd: 1'
+    assert _ran(pipeline) == ['report']
+
+    # a new parity goes all the way down
+    path.write_text('3\n5\n')
+    assert pipeline.run('report') == 'odd: 0'
+    assert _ran(pipeline) == ['parity', 'read', 'report']
+
+
+def test_clear(tmp_path):
+    path = tmp_path / 'numbers.txt'
+    path.write_text('1\n')
+    pipeline = _pipeline(tmp_path / 'cache', path)
+    pipeline.run('report')
+    pipeline.clear('parity')
+    assert pipeline.status('report') == {'read': 'cached', 'parity': 'missing', 'report': 'stale'}
+    pipeline.run('report')
+    # the parity is the same again, its report is still cached
+    assert _ran(pipeline) == ['parity']
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from birdflu.geometry import IRISH_GRID, WGS84, transform_coords
+from birdflu.proximity import ProximityIndex
+
+
+def _observations(rng, n):
+    return pd.DataFrame({
+        'Longitude': rng.uniform(-10, -6, n), 'Latitude': rng.uniform(51.5, 55, n),
+        'Year': rng.integers(2019, 2022, n), 'Month': rng.integers(1, 13, n), 'Day': rng.integers(1, 29, n),
+        'target_H5_HPAI': (rng.random(n) < 0.15).astype(int),
+        'Common_Name': rng.choice(['Mute Swan', 'Mallard', 'Herring Gull'], n),
+    })
+
+
+@pytest.fixture(scope='module')
+def index_and_observations():
+    rng = np.random.default_rng(0)
+    batches = [_observations(rng, n) for n in [2000, 600, 300, 300, 100]]
+    index = ProximityIndex()
+    for source, batch in enumerate(batches):
+        index.add(batch, source)
+    index.remove(2)
+    kept = pd.concat([b for source, b in enumerate(batches) if source != 2], ignore_index=True)
+    sites = pd.DataFrame({'Longitude': rng.uniform(-10, -6, 50), 'Latitude': rng.uniform(51.5, 55, 50)},
+                         index=[f'site {i}' for i in range(50)])
+    return index, kept, sites
+
+
+def _distances(observations, sites, since, until, infected):
+    # every site to every selected observation, in Irish Grid metres
+    day = pd.to_datetime(observations[['Year', 'Month', 'Day']])
+    keep = np.ones(len(observations), dtype=bool)
+    if infected is not None:
+        keep &= observations['target_H5_HPAI'].to_numpy() == int(infected)
+    if since is not None:
+        keep &= (day >= since).to_numpy()
+    if until is not None:
+        keep &= (day <= until).to_numpy()
+    ox, oy = transform_coords(observations['Longitude'], observations['Latitude'], WGS84, IRISH_GRID)
+    sx, sy = transform_coords(sites['Longitude'], sites['Latitude'], WGS84, IRISH_GRID)
+    return np.hypot(sx[:, None] - ox[keep], sy[:, None] - oy[keep]), observations[keep]
+
+
+# the infected birds are a small share (subset trees), all birds or a year about half (filtered queries)
+QUERIES = [(None, None, True), (None, None, None), ('2020-01-01', '2020-12-31', None), ('2021-01-01', None, False)]
+
+
+@pytest.mark.parametrize('since, until, infected', QUERIES)
+def test_nearest_matches_brute_force(index_and_observations, since, until, infected):
+    index, observations, sites = index_and_observations
+    distances, _ = _distances(observations, sites, since, until, infected)
+    nearest = index.nearest(sites, k=7, since=since, until=until, infected=infected)
+    found = nearest.pivot(index='site', columns='rank', values='distance_m').loc[sites.index].to_numpy()
+    np.testing.assert_allclose(found, np.sort(distances, axis=1)[:, :7])
+
+    # within a maximum distance, only the sightings in range
+    capped = index.nearest(sites, k=7, since=since, until=until, infected=infected, max_distance=20000)
+    expected = (np.sort(distances, axis=1)[:, :7] <= 20000).sum(axis=1)
+    assert (capped.groupby('site').size().reindex(sites.index, fill_value=0).to_numpy() == expected).all()
+
+
+@pytest.mark.parametrize('since, until, infected', QUERIES)
+def test_within_and_summary_match_brute_force(index_and_observations, since, until, infected):
+    index, observations, sites = index_and_observations
+    distances, selected = _distances(observations, sites, since, until, infected)
+    inside = distances <= 15000
+
+    within = index.within(sites, radius=15000, since=since, until=until, infected=infected)
+    assert (within.groupby('site').size().reindex(sites.index, fill_value=0).to_numpy() == inside.sum(axis=1)).all()
+    np.testing.assert_allclose(np.sort(within['distance_m']), np.sort(distances[inside]))
+
+    summary = index.summary(sites, radius=15000, since=since, until=until, infected=infected)
+    assert (summary['sightings'].to_numpy() == inside.sum(axis=1)).all()
+    np.testing.assert_allclose(summary['nearest_m'].to_numpy(), distances.min(axis=1))
+    names = selected['Common_Name'].to_numpy()
+    for i, top in enumerate(summary['species']):
+        counts = pd.Series(names[inside[i]]).value_counts()
+        assert dict(top) == {name: birds for name, birds in counts.items()}
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from esda.smoothing import Empirical_Bayes
+
+from birdflu.rates import eb_rate, raw_rate
+
+E = np.array([0, 3, 10, 1, 25, 2, 0, 7])
+N = np.array([5, 40, 60, 4, 90, 30, 12, 20])
+
+
+def test_eb_rate_matches_esda():
+    rate, lower, upper = eb_rate(E, N)
+    np.testing.assert_allclose(rate, Empirical_Bayes(E, N).r.ravel(), rtol=1e-12)
+    assert np.all((lower <= rate) & (rate <= upper))
+
+
+def test_eb_rate_with_empty_areas_matches_esda():
+    # esda gives NaN for every area once one has no birds: a vanishing population stands in for none
+    e, n = np.append(E, [0, 0]), np.append(N, [0, 0])
+    expected = Empirical_Bayes(e, np.where(n == 0, 1e-12, n)).r.ravel()
+    np.testing.assert_allclose(eb_rate(e, n)[0], expected, rtol=1e-9)
+    # the mean population is over all areas: dropping the empty ones changes the shrinkage
+    assert not np.allclose(eb_rate(e, n)[0][:len(E)], eb_rate(E, N)[0])
+
+
+def test_eb_rate_per_slice():
+    e, n = np.stack([E, E[::-1]]), np.stack([N, N[::-1]])
+    np.testing.assert_allclose(eb_rate(e, n)[0][1], Empirical_Bayes(E[::-1], N[::-1]).r.ravel(), rtol=1e-12)
+
+
+def test_raw_rate_without_birds():
+    rate, lower, upper = raw_rate([0, 1], [0, 4])
+    assert rate.tolist() == [0, 0.25] and (lower[0], upper[0]) == (0, 1)
+    assert lower[1] == pytest.approx(0.0456, abs=1e-4) and upper[1] == pytest.approx(0.6994, abs=1e-4)
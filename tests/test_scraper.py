@@ -0,0 +1,98 @@
+import io
+import threading
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from birdflu.scraper import HttpCache, make_session, parse_page, scrape
+
+
+def _png(mode):
+    buffer = io.BytesIO()
+    Image.new(mode, (4, 3)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+PAGE = b'''<html><body>
+<article class="bird">
+  <div class="bird-img"><img data-src="{image}"></div>
+  <h3 class="title">Raven</h3>
+  <div class="bird-info"><p>{irish}</p><p>Corvus corax</p><p>Crows</p></div>
+</article>
+</body></html>'''
+
+
+@pytest.fixture
+def server():
+    # serves every path with an ETag and answers 304 when it is sent back
+    requests = []
+    bodies = {'/image.png': _png('P')}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append((self.path, self.headers.get('If-None-Match')))
+            body = bodies.get(self.path)
+            if body is None:
+                body = PAGE.replace(b'{image}', f'http://127.0.0.1:{self.server.server_port}/image.png'.encode())
+                body = body.replace(b'{irish}', f'Fiach dubh {self.path}'.encode())
+            etag = f'"{len(body)}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}', requests
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_revalidates_cached_body(server, tmp_path):
+    url, requests = server
+    cache = HttpCache(make_session(), tmp_path)
+    first = cache.get(url + '/page/1/')
+    assert cache.get(url + '/page/1/') == first
+    assert [etag for _, etag in requests] == [None, f'"{len(first)}"']
+    # the second response was a 304 without a body, nothing but the cache files is left behind
+    assert sorted(p.suffix for p in tmp_path.iterdir()) == ['.body', '.json']
+
+
+def test_scrape_from_cache(server, tmp_path):
+    url, requests = server
+    for _ in range(2):
+        records = list(scrape(url + '/', no_pages=2, page_workers=2, image_workers=2, cache_path=tmp_path))
+        assert [r['Scientific_Name'] for r in records] == ['Corvus corax'] * 2
+        # a palette PNG is decoded to RGB
+        assert all(r['Image'].shape == (3, 4, 3) and r['Image'].dtype == np.uint8 for r in records)
+    revalidated = requests[len(requests) // 2:]
+    assert len(requests) == 8 and all(etag is not None for _, etag in revalidated)
+
+
+def test_records_come_back_in_order(server, tmp_path):
+    url, _ = server
+    records = list(scrape(url + '/', no_pages=6, page_workers=6, image_workers=3, cache_path=tmp_path))
+    assert [r['Irish_Name'] for r in records] == [f'Fiach dubh /page/{i}/' for i in range(1, 7)]
+
+
+def test_parse_page_sorts_by_image_then_name():
+    articles = [PAGE.split(b'<article')[1].split(b'</article>')[0]
+                .replace(b'{image}', image).replace(b'Raven', name).replace(b'{irish}', b'Fiach')
+                for image, name in [(b'b.png', b'Raven'), (b'a.png', b'Rook'), (b'a.png', b'Jackdaw')]]
+    content = b'<html><body>' + b''.join(b'<article' + a + b'</article>' for a in articles) + b'</body></html>'
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        records = parse_page(content)
+    assert [(r['Image'], r['Bird_Name']) for r in records] == [('a.png', 'Jackdaw'), ('a.png', 'Rook'), ('b.png', 'Raven')]
@@ -0,0 +1,32 @@
+import pytest
+
+from birdflu.species import SpeciesIndex
+
+CHECKLIST = ['Corvus cornix', 'Corvus frugilegus', 'Larus argentatus', 'Larus fuscus', 'Chroicocephalus ridibundus',
+             'Branta bernicla hrota', 'Anas platyrhynchos', 'Cygnus olor', 'Calidris alpina', 'Calidris alba']
+
+
+@pytest.mark.parametrize('name, match, method', [
+    ('Corvus cornix', 'Corvus cornix', 'exact'),
+    ('Larus ridibundus', 'Chroicocephalus ridibundus', 'synonym'),
+    ('Anas platyrhynchos (Domestic type)', 'Anas platyrhynchos', 'synonym'),
+    ('Branta bernicla', 'Branta bernicla hrota', 'subspecies'),
+    ('Larus argentatis', 'Larus argentatus', 'fuzzy'),
+    # a species missing from the checklist is not its neighbour
+    ('Corvus corax', None, None),
+    ('Larrus argentatus', 'Larus argentatus', 'fuzzy'),
+    ('Corvis frugilegus', 'Corvus frugilegus', 'fuzzy'),
+    # one typo in the genus or the epithet, not in a short one, and not between two close names
+    ('Laurs argentatus', None, None),
+    ('Larrus argentatis', None, None),
+    ('Corvis corax', None, None),
+    ('Cygnus olar', None, None),
+    ('Calidris alpna', None, None),
+    ('Larus sp.', None, None),
+])
+def test_resolve(name, match, method):
+    assert SpeciesIndex(CHECKLIST).resolve(name)[:2] == (match, method)
+
+
+def test_no_fuzzy():
+    assert SpeciesIndex(CHECKLIST, max_edits=0).resolve('Larus argentatis') == (None, None, 0.0)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from birdflu.cube import DIMENSIONS, CountCube
+from birdflu.stages import join_birdwatch
+from birdflu.streaming import aggregate_extracts, parse_size, read_chunks
+
+BIRDWATCH = pd.DataFrame({'Scientific_Name': ['Cygnus olor', 'Larus argentatus', 'Anas platyrhynchos'],
+                          'Bird_Family': ['Swans', 'Gulls', 'Ducks']})
+
+
+def _extract(rng, n):
+    return pd.DataFrame({
+        'Scientific_Name': rng.choice(['Cygnus olor', 'Larus argentatus', 'Anas platyrhynchos', 'Corvus corax'], n),
+        'Common_Name': rng.choice(['Mute Swan', 'Herring Gull', 'Mallard', None], n),
+        'Year': rng.integers(2015, 2021, n),
+        'Month': rng.integers(1, 13, n),
+        'County': rng.choice(['Cork', 'Dublin', 'Kerry', None], n),
+        'Locality': rng.choice([f'Site {i}' for i in range(30)], n),
+        'target_H5_HPAI': rng.integers(0, 2, n),
+    })
+
+
+def _counts(cube):
+    return cube.counts.set_index(cube.dimensions)['count'].sort_index()
+
+
+@pytest.mark.parametrize('dimensions, birdwatch, memory_budget', [
+    (DIMENSIONS, None, '1MB'),
+    # fewer columns are read, in larger chunks
+    (['Year', 'Bird_Family', 'target_H5_HPAI'], BIRDWATCH, '64KB'),
+])
+def test_streamed_cube_matches_from_frame(tmp_path, dimensions, birdwatch, memory_budget):
+    rng = np.random.default_rng(0)
+    extracts = [_extract(rng, 3000), _extract(rng, 2000)]
+    paths = []
+    for i, extract in enumerate(extracts):
+        paths.append(tmp_path / f'extract-{i}.csv')
+        extract.to_csv(paths[-1], index=False)
+
+    aggregate = aggregate_extracts(paths, birdwatch, dimensions=dimensions, memory_budget=memory_budget)
+    assert aggregate.chunks > len(paths) and aggregate.rows == 5000
+
+    # what the whole extracts give in memory, read the same way
+    frame = pd.concat([pd.read_csv(path, encoding='latin-1') for path in paths], ignore_index=True)
+    if birdwatch is not None:
+        frame = join_birdwatch(frame, birdwatch)
+    pd.testing.assert_series_equal(_counts(aggregate.cube), _counts(CountCube.from_frame(frame, dimensions)),
+                                   check_dtype=False)
+
+
+def test_chunks_cover_the_extract(tmp_path):
+    path = tmp_path / 'extract.csv'
+    extract = _extract(np.random.default_rng(1), 4000)
+    extract.to_csv(path, index=False)
+    chunks = list(read_chunks(path, '128KB'))
+    assert len(chunks) > 1
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), pd.read_csv(path, encoding='latin-1'))
+
+
+@pytest.mark.parametrize('size, expected', [(1024, 1024), ('512MB', 512 * 2 ** 20), ('2G', 2 ** 31), ('1.5k', 1536)])
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
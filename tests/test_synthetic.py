@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from birdflu.synthetic import COLUMNS, SurveillanceModel
+
+SPECIES = [('Cygnus olor', 'Mute Swan', 'Cygnus olor'), ('Larus argentatus', 'Herring Gull', 'Larus argentatus'),
+           ('Anas platyrhynchos', 'Mallard', np.nan)]
+SITES = [('Ireland', 'IE-M-CO', 'Munster', 'Cork', 'Cork Harbour', 51.84, -8.29),
+         ('Ireland', 'IE-L-D', 'Leinster', 'Dublin', 'Bull Island', 53.37, -6.15),
+         ('Ireland', 'IE-C-GY', 'Connaught', 'Galway', 'Inishmore (Inis Mór)', 53.13, -9.75)]
+
+
+@pytest.fixture
+def real(tmp_path):
+    # observations in the layout of data/bird_flu.csv, read back as the analysis reads them
+    rng = np.random.default_rng(0)
+    n = 500
+    species = pd.DataFrame(SPECIES, columns=['Scientific_Name', 'Common_Name', 'Parent_Species'])
+    sites = pd.DataFrame(SITES, columns=['Country', 'Country_State_County', 'State', 'County', 'Locality',
+                                         'Latitude', 'Longitude'])
+    df = pd.concat([species.iloc[rng.integers(0, 3, n)].reset_index(drop=True),
+                    sites.iloc[rng.integers(0, 3, n)].reset_index(drop=True)], axis=1)
+    df['Year'] = rng.integers(2015, 2021, n)
+    df['Month'] = rng.integers(1, 13, n)
+    df['Day'] = rng.integers(1, 29, n)
+    df['Date'] = [f'{d:02d}/{m:02d}/{y}' for d, m, y in zip(df['Day'], df['Month'], df['Year'])]
+    df['Time'] = rng.choice([900, 1100, 1430], n)
+    df['target_H5_HPAI'] = (rng.random(n) < 0.1).astype(int)
+    path = tmp_path / 'bird_flu.csv'
+    df[COLUMNS].to_csv(path, index=False, encoding='latin-1')
+    return path
+
+
+def test_synthetic_data_has_the_schema_of_the_real_data(real, tmp_path):
+    observed = pd.read_csv(real, encoding='latin-1')
+    model = SurveillanceModel.fit(real)
+
+    sample = model.sample(1000, np.random.default_rng(1))
+    pd.testing.assert_series_equal(sample.dtypes, observed.dtypes)
+
+    csv = pd.read_csv(model.write(tmp_path / 'synthetic.csv', 2500, seed=2, chunk_size=1000), encoding='latin-1')
+    assert len(csv) == 2500
+    pd.testing.assert_series_equal(csv.dtypes, observed.dtypes)
+
+    parquet = pd.read_parquet(model.write(tmp_path / 'synthetic.parquet', 2500, seed=2, chunk_size=1000))
+    pd.testing.assert_series_equal(parquet.dtypes, observed.dtypes)
+    # both files hold the same observations
+    pd.testing.assert_frame_equal(parquet, csv)
+
+    # values come from the real ones
+    for column in ['Scientific_Name', 'Locality', 'Time', 'target_H5_HPAI']:
+        assert set(csv[column]) <= set(observed[column])
+    assert pd.to_datetime(csv['Date'], format='%d/%m/%Y').dt.day.eq(csv['Day']).all()
+
+
+def test_generation_is_reproducible(real):
+    model = SurveillanceModel.fit(real)
+    first = pd.concat(model.generate(2500, seed=3, chunk_size=1000), ignore_index=True)
+    again = pd.concat(model.generate(2500, seed=3, chunk_size=1000), ignore_index=True)
+    pd.testing.assert_frame_equal(first, again)
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+from birdflu import tracing
+
+
+@pytest.fixture
+def trace():
+    tracing.enable()
+    tracing.drain()
+    yield
+    tracing.disable()
+    tracing.drain()
+
+
+@pytest.mark.skipif(not tracing._reset_hwm(), reason='the RSS watermark cannot be reset')
+def test_peak_rss_per_span(trace):
+    with tracing.span('outer'):
+        with tracing.span('large'):
+            large = np.ones(200 * 2 ** 20 // 8)
+            del large
+        with tracing.span('small'):
+            small = np.ones(20 * 2 ** 20 // 8)
+            del small
+    with tracing.span('after'):
+        pass
+    peaks = {e['name']: e['peak_rss_mb'] - e['rss_mb'] for e in tracing.events()}
+    assert peaks['large'] > 150 and peaks['outer'] > 150
+    # the spans after the large allocation don't report its peak
+    assert 10 < peaks['small'] < 100 and peaks['after'] < 10
+
+
+def test_events_per_span(trace):
+    with tracing.span('stage', chunk=1) as s:
+        s.rows = 3
+    (event,) = tracing.events()
+    assert event['rows'] == 3 and event['args'] == {'chunk': 1} and event['pid'] == os.getpid()
+    assert tracing.summary()[0]['calls'] == 1
+
+
+class _Usage:
+    RUSAGE_SELF = 0
+
+    def __init__(self, maxrss):
+        self.maxrss = maxrss
+
+    def getrusage(self, who):
+        return type('rusage', (), {'ru_maxrss': self.maxrss})
+
+
+@pytest.mark.parametrize('platform, maxrss', [('linux', 2 ** 20), ('darwin', 2 ** 30)])
+def test_peak_rss_units(monkeypatch, platform, maxrss):
+    monkeypatch.setattr(tracing.sys, 'platform', platform)
+    monkeypatch.setattr(tracing, 'resource', _Usage(maxrss))
+    assert tracing.peak_rss_mb() == 1024
+
+
+def test_no_memory_readings(monkeypatch, trace):
+    # e.g. Windows: no resource module, no /proc
+    monkeypatch.setattr(tracing, 'resource', None)
+    monkeypatch.setattr(tracing, '_hwm_mb', lambda: None)
+    with tracing.span('stage'):
+        pass
+    assert tracing.events()[0]['peak_rss_mb'] is None
+    assert tracing.summary()[0]['peak_rss_mb'] is None
+
+
+def test_peak_rss_of_a_child(monkeypatch):
+    monkeypatch.setattr(tracing.sys, 'platform', 'darwin')
+    assert tracing.peak_rss_mb(2 ** 21) == 2